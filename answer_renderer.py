@@ -0,0 +1,174 @@
+import re
+import pandas as pd
+import sqlparse
+from sqlparse import tokens as T
+from sqlparse.sql import IdentifierList
+from typing import Dict, List, Optional, Tuple
+
+from config import SUMMARY_POLICY, SUMMARY_TEMPLATE_MAX_ROWS, SUMMARY_TEMPLATE_MAX_COLUMNS
+from metadata_registry import TableMetadata
+from utils import format_numbers_in_df
+
+_IDENTIFIER = r'(?:\w+\.)?("(?:[^"]|"")+"|\w+)'
+_ALIAS = r'(?:\s+(?:AS\s+)?(?:"(?:[^"]|"")+"|\w+))?'
+# Шаблоны подходят только для колонки "как есть" и для SUM по колонке: AVG/MAX/COUNT,
+# выражения и оконные функции подписываются и форматируются иначе, их описывает LLM
+_DIRECT_RE = re.compile(rf"{_IDENTIFIER}{_ALIAS}", re.IGNORECASE)
+_SUM_RE = re.compile(rf"SUM\s*\(\s*{_IDENTIFIER}\s*\){_ALIAS}", re.IGNORECASE)
+# Ранжирование, объединения и подзапросы меняют смысл значения ("максимум", "топ-3")
+_UNSUPPORTED_KEYWORDS = {"DISTINCT", "LIMIT", "OFFSET", "FETCH", "UNION", "INTERSECT", "EXCEPT", "OVER", "HAVING"}
+# Проценты и коэффициенты нельзя выводить в евро
+_NON_MONEY_RE = re.compile(r"%|percent|ratio|процент|соотношен|коэффициент", re.IGNORECASE)
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def _select_columns(sql: str) -> Optional[List[Tuple[Optional[str], str]]]:
+    """
+    Разбирает список SELECT сгенерированного запроса: для каждой колонки результата
+    возвращает (агрегат, исходная колонка), где агрегат — "sum" или None для колонки "как есть".
+    Возвращает None, если запрос сложнее (другие функции, выражения, LIMIT, подзапросы).
+    """
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip(" \n\t;")]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return None
+    statement = statements[0]
+    keywords = [t.normalized for t in statement.flatten() if t.ttype in T.Keyword or t.ttype in T.Keyword.DML]
+    if keywords.count("SELECT") != 1 or _UNSUPPORTED_KEYWORDS.intersection(keywords):
+        return None
+
+    items = []
+    select_seen = False
+    for token in statement.tokens:
+        if token.ttype is T.DML and token.normalized == "SELECT":
+            select_seen = True
+            continue
+        if not select_seen or token.is_whitespace:
+            continue
+        if token.ttype is T.Keyword and token.normalized == "FROM":
+            break
+        if isinstance(token, IdentifierList):
+            items.extend(str(item).strip() for item in token.get_identifiers())
+        else:
+            items.append(str(token).strip())
+
+    columns = []
+    for item in items:
+        match = _SUM_RE.fullmatch(item)
+        if match:
+            columns.append(("sum", _unquote(match.group(1))))
+            continue
+        match = _DIRECT_RE.fullmatch(item)
+        if not match:
+            return None
+        columns.append((None, _unquote(match.group(1))))
+    return columns or None
+
+
+def _schema_column(source: str, schema_columns: Dict) -> Optional[str]:
+    """Колонка схемы по имени из SQL (имена без кавычек PostgreSQL приводит к нижнему регистру)."""
+    if source in schema_columns:
+        return source
+    return next((c for c in schema_columns if c.lower() == source.lower()), None)
+
+
+def _is_money(column: Optional[str], schema_columns: Dict) -> bool:
+    """Денежный показатель: колонка схемы, в названии и описании которой нет процентов и коэффициентов."""
+    if column is None:
+        return False
+    info = schema_columns.get(column) or {}
+    texts = [column, info.get("description") or "", *((info.get("aliases") or {}).values())]
+    return not any(_NON_MONEY_RE.search(str(text)) for text in texts)
+
+
+def _metric_label(column: str, schema_columns: Dict) -> str:
+    """Русское название показателя по схеме."""
+    aliases = (schema_columns.get(column) or {}).get("aliases") or {}
+    return aliases.get("ru") or column
+
+
+def _format_value(value: str) -> str:
+    return "нет данных" if value in ("nan", "<NA>", "None", "NaT", "") else value
+
+
+def _scope(generation_result: Dict) -> str:
+    groups = generation_result.get("groups") or []
+    years = generation_result.get("years") or []
+    parts = []
+    if groups:
+        parts.append(f"у {', '.join(map(str, groups))}")
+    if len(years) == 1:
+        parts.append(f"за {years[0]} год")
+    elif years:
+        parts.append(f"за {', '.join(map(str, years))} годы")
+    return (" " + " ".join(parts)) if parts else ""
+
+
+def render_answer(df: pd.DataFrame, generation_result: Dict, metadata: TableMetadata) -> Optional[str]:
+    """
+    Строит ответ по шаблону без вызова LLM для простых результатов:
+    одно значение (1×1) или небольшая таблица "ключ — показатели".
+    Шаблон используется, только если SQL выбирает денежные показатели как есть или как SUM;
+    иначе (AVG/MAX/COUNT, проценты, коэффициенты, ранжирование) возвращает None,
+    и ответ формирует LLM.
+    """
+    if SUMMARY_POLICY != "auto" or df.empty:
+        return None
+    if "%" in (generation_result.get("units") or []):
+        return None
+    columns = _select_columns(generation_result.get("sql") or "")
+    if columns is None or len(columns) != df.shape[1]:
+        return None
+
+    schema_columns = metadata.schema.get("columns", {})
+    # Ключевые колонки — нечисловые измерения "как есть" (компания, период), остальные — показатели
+    key_columns, value_columns = [], []
+    sources: Dict[str, Tuple[Optional[str], str]] = {}
+    for column, (aggregate, source) in zip(df.columns, columns):
+        schema_column = _schema_column(source, schema_columns)
+        is_metric = schema_column is not None and schema_column not in metadata.catalog
+        if pd.api.types.is_numeric_dtype(df[column]) or is_metric or aggregate:
+            if not is_metric or not _is_money(schema_column, schema_columns):
+                return None
+            value_columns.append(column)
+            sources[column] = (aggregate, schema_column)
+        else:
+            key_columns.append(column)
+    if not value_columns:
+        return None
+
+    formatted = format_numbers_in_df(df)
+    labels = {c: _metric_label(sources[c][1], schema_columns) for c in value_columns}
+    aggregate = any(sources[c][0] == "sum" for c in value_columns)
+
+    if df.shape == (1, 1):
+        column = df.columns[0]
+        prefix = "Суммарный показатель" if aggregate else "Показатель"
+        value = _format_value(str(formatted.iloc[0, 0]))
+        return f"{prefix} «{labels[column]}»{_scope(generation_result)}: {value}."
+
+    if len(df) > SUMMARY_TEMPLATE_MAX_ROWS:
+        return None
+    if not key_columns or len(key_columns) > 2 or len(value_columns) > SUMMARY_TEMPLATE_MAX_COLUMNS:
+        return None
+    if df.duplicated(subset=key_columns).any():
+        return None
+
+    title_labels = ", ".join(f"«{labels[c]}»" for c in value_columns)
+    title = (
+        f"{'Суммарные значения' if aggregate else 'Значения'} "
+        f"{'показателя' if len(value_columns) == 1 else 'показателей'} {title_labels}"
+        f"{_scope(generation_result)}:"
+    )
+
+    lines = [title]
+    for _, row in formatted.iterrows():
+        key = ", ".join(str(row[c]) for c in key_columns)
+        if len(value_columns) == 1:
+            lines.append(f"- {key}: {_format_value(str(row[value_columns[0]]))}")
+        else:
+            values = "; ".join(f"{labels[c]} — {_format_value(str(row[c]))}" for c in value_columns)
+            lines.append(f"- {key}: {values}")
+    return "\n".join(lines)
@@ -1,18 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, constr
+from typing import List, Optional
 
 # --- Импорт конфигурации и основной логики ---
-from config import logger, API_AUTH_KEY
-from pipeline import run_companies_pipeline
+from config import logger, API_AUTH_KEY, BATCH_MAX_SIZE, TIMING_HEADER_ENABLED
+from pipeline import (
+    run_companies_pipeline, run_companies_batch, stream_companies_pipeline, metadata_registry, table_router,
+    pipeline_flight, sql_generation_flight, sql_execution_flight, prewarm, warmup_state,
+)
+from query_cache import sql_cache
+from semantic_cache import semantic_cache
+from fast_router import fast_router
+from llm_client import provider_stats, provider_health
+from prompt_compaction import prompt_compactor
+from sql_rewriter import year_filter_rewriter
+from result_cache import result_cache
+from metrics import (
+    HTTP_REQUEST_DURATION, request_timings, format_timings, register_stats_collector, register_pool_collector,
+    render_metrics,
+)
+from resources import open_resources, close_resources, db_pool_stats
+
+# --- Жизненный цикл воркера ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Выполняется в каждом воркере uvicorn отдельно: пул соединений к БД и HTTP клиент
+    создаются уже после fork и корректно закрываются при остановке.
+    """
+    open_resources()
+    # Загружаем схемы и каталоги заранее, чтобы не читать их с диска на каждый запрос
+    metadata_registry.load_all()
+    # Соединение с БД и клиенты LLM прогреваются в фоне: воркер начинает принимать запросы сразу
+    prewarm_task = asyncio.create_task(prewarm())
+    logger.info("API сервер успешно запущен.")
+    yield
+    prewarm_task.cancel()
+    # Прогрев работает в потоках с пулом БД и клиентами LLM: закрываем их только после его завершения
+    with suppress(asyncio.CancelledError):
+        await prewarm_task
+    await close_resources()
+    logger.info("API сервер остановлен, соединения закрыты.")
 
 # --- Инициализация FastAPI приложения ---
 app = FastAPI(
     title="Промптологи - Shai Pro Case 6",
     description="Демо API для анализа финансовых данных (12_german_c).",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -23,10 +65,35 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
-# --- Событие при старте приложения ---
-@app.on_event("startup")
-async def startup_event():
-    logger.info("API сервер успешно запущен.")
+# Счетчики кешей попадают в /metrics из тех же stats(), что и в /stats
+register_stats_collector({
+    "sql_cache": sql_cache.stats,
+    "semantic_cache": semantic_cache.stats,
+    "fast_path": fast_router.stats,
+    "result_cache": result_cache.stats,
+})
+register_pool_collector(db_pool_stats)
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """
+    Замеряет длительность запроса для /metrics и отдает разбивку по этапам пайплайна
+    в заголовке X-Timing. У потоковых ответов заголовок уходит до генерации текста,
+    поэтому в нем только этапы до первого события.
+    """
+    timings = {}
+    request_timings.set(timings)
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # Шаблон маршрута вместо фактического пути, чтобы не плодить метки
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    HTTP_REQUEST_DURATION.labels(path=path, method=request.method, status=str(response.status_code)).observe(elapsed)
+    if TIMING_HEADER_ENABLED:
+        response.headers["X-Timing"] = format_timings(timings, elapsed)
+    return response
 
 # --- Безопасность: схема и функция для проверки API ключа ---
 auth_scheme = HTTPBearer()
@@ -54,15 +121,66 @@ class ChatResponse(BaseModel):
     """Модель для исходящего ответа."""
     answer: str
 
+class BatchChatRequest(BaseModel):
+    """Модель для пакетного запроса."""
+    # Каждый вопрос проверяется, как query в /chat; вопросы из одних пробелов тоже отклоняются
+    queries: List[constr(strip_whitespace=True, min_length=1)] = Field(
+        ..., min_length=1, max_length=BATCH_MAX_SIZE, description="Список текстовых запросов пользователя"
+    )
+
+class BatchChatItem(BaseModel):
+    """Ответ на один вопрос из пакета."""
+    query: str
+    answer: str
+    elapsed_ms: float
+    deduplicated: bool = Field(False, description="Ответ взят у такого же вопроса из этого пакета")
+
+class BatchChatResponse(BaseModel):
+    """Модель для ответа на пакетный запрос."""
+    results: List[BatchChatItem]
+    elapsed_ms: float
+
 # --- HTTP Эндпоинты ---
 
 @app.get("/health", summary="Проверка состояния сервиса")
 def health_check():
     """
     Простой эндпоинт для проверки, что API сервис запущен и отвечает на запросы.
-    Используется системами мониторинга.
+    Используется системами мониторинга. Также показывает состояние автомата защиты LLM провайдеров
+    и `warm` — завершен ли фоновый прогрев воркера (соединение с БД, клиенты LLM).
+    """
+    return {"status": "ok", "warm": warmup_state["done"], "llm_providers": provider_health()}
+
+@app.get("/stats", summary="Статистика кешей", dependencies=[Depends(verify_api_key)])
+def stats():
     """
-    return {"status": "ok"}
+    Счетчики попаданий/промахов кешей. Нужны, чтобы подбирать их размеры.
+    Раскрывает внутреннее состояние (пул БД, провайдеры LLM), поэтому требует API ключ.
+    """
+    return {
+        "sql_cache": sql_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "fast_path": fast_router.stats(),
+        "llm_providers": provider_stats(),
+        "prompt_compaction": prompt_compactor.stats(),
+        "table_router": table_router.stats(),
+        "sql_rewrite": year_filter_rewriter.stats(),
+        "result_cache": result_cache.stats(),
+        "db_pool": db_pool_stats(),
+        "single_flight": {
+            flight.name: flight.stats()
+            for flight in (pipeline_flight, sql_generation_flight, sql_execution_flight)
+        },
+    }
+
+@app.get("/metrics", summary="Метрики Prometheus", dependencies=[Depends(verify_api_key)])
+def metrics():
+    """
+    Гистограммы задержек по этапам пайплайна, HTTP запросам и вызовам LLM, расход токенов
+    и счетчики кешей в текстовом формате Prometheus. Требует API ключ, как и /stats.
+    """
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
 
 @app.post("/chat", 
           response_model=ChatResponse, 
@@ -82,4 +200,49 @@ async def http_chat_endpoint(request: ChatRequest):
         logger.exception("Критическая ошибка при обработке запроса в эндпоинте /chat.")
         # Возвращаем общую ошибку, чтобы не раскрывать детали реализации
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                            detail="Внутренняя ошибка сервера.")
\ No newline at end of file
+                            detail="Внутренняя ошибка сервера.")
+
+@app.post("/chat/batch",
+          response_model=BatchChatResponse,
+          summary="Отправить пакет запросов чат-боту",
+          dependencies=[Depends(verify_api_key)])
+async def http_chat_batch_endpoint(request: BatchChatRequest):
+    """
+    Пакетный эндпоинт: обрабатывает несколько вопросов за один HTTP-запрос с ограниченным параллелизмом.
+    Ответы возвращаются в порядке вопросов.
+    """
+    try:
+        logger.info(f"Получен пакет из {len(request.queries)} запросов.")
+        started = time.perf_counter()
+        results = await run_companies_batch(request.queries)
+        return BatchChatResponse(
+            results=[BatchChatItem(**item) for item in results],
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+    except Exception as e:
+        logger.exception("Критическая ошибка при обработке запроса в эндпоинте /chat/batch.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Внутренняя ошибка сервера.")
+
+@app.post("/chat/stream",
+          summary="Отправить запрос чат-боту с потоковым ответом (SSE)",
+          dependencies=[Depends(verify_api_key)])
+async def http_chat_stream_endpoint(request: ChatRequest):
+    """
+    Потоковый вариант /chat (Server-Sent Events). По мере работы пайплайна отправляет события
+    `sql_generated`, `rows_fetched`, затем `token` с фрагментами ответа и финальное `answer`
+    (или `error`).
+    """
+    logger.info(f"Получен потоковый запрос: '{request.query}'")
+
+    async def event_source():
+        async for event in stream_companies_pipeline(request.query):
+            data = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        # Отключаем буферизацию на прокси, чтобы события доходили сразу
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
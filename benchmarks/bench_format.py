@@ -0,0 +1,95 @@
+"""
+Микробенчмарк utils.format_numbers_in_df: векторная реализация против прежней
+поэлементной (apply с замыканием), на DataFrame из 100k строк.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_format.py --rows 100000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import format_numbers_in_df  # noqa: E402
+
+
+def format_numbers_in_df_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """Прежняя реализация: копия DataFrame и apply по каждому значению."""
+    df_copy = df.copy()
+
+    for col in df_copy.columns:
+        if not pd.api.types.is_numeric_dtype(df_copy[col]):
+            continue
+
+        def format_value(x):
+            if pd.isna(x):
+                return x
+            try:
+                num = float(x)
+                if abs(num) >= 1_000_000_000:
+                    val = f'{num / 1_000_000_000:,.2f}'.replace(',', ' ').replace('.00', '')
+                    return f'{val} млрд евро'
+                if abs(num) >= 1_000_000:
+                    val = f'{num / 1_000_000:,.2f}'.replace(',', ' ').replace('.00', '')
+                    return f'{val} млн евро'
+                return f'{num:,.2f}'.replace(',', ' ').replace('.00', '') + ' €'
+            except (ValueError, TypeError):
+                return x
+
+        df_copy[col] = df_copy[col].apply(format_value).astype(str)
+
+    return df_copy
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Таблица, похожая на top_12_german_companies: компания, период и показатели разных порядков."""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "Company": rng.choice(["Volkswagen AG", "Siemens AG", "Allianz SE", "BMW AG"], rows),
+        "Period": rng.choice(["3/31/2023", "6/30/2023", "9/30/2023", "12/31/2023"], rows),
+        "Revenue": rng.integers(1_000_000, 100_000_000_000, rows),
+        "Net Income": rng.normal(1e9, 2e9, rows),
+        "ROA (%)": rng.normal(3, 2, rows),
+        "Debt to Equity": rng.uniform(0, 5_000_000, rows),
+    })
+    frame.loc[frame.sample(frac=0.01, random_state=seed).index, "Net Income"] = np.nan
+    # Nullable-колонки: пропуски pd.NA должны форматироваться так же, как NaN
+    frame["Equity"] = pd.array(rng.integers(1_000_000, 10_000_000_000, rows), dtype="Int64")
+    frame.loc[frame.sample(frac=0.01, random_state=seed + 1).index, "Equity"] = pd.NA
+    return frame
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark format_numbers_in_df")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    if not format_numbers_in_df(df).equals(format_numbers_in_df_legacy(df)):
+        raise SystemExit("Результаты векторной и прежней реализаций не совпадают")
+
+    legacy = best_of(lambda: format_numbers_in_df_legacy(df), args.repeat)
+    vectorized = best_of(lambda: format_numbers_in_df(df), args.repeat)
+
+    print(f"rows={args.rows} repeat={args.repeat} (лучшее время)")
+    print(f"  legacy apply: {legacy * 1000:9.1f} ms")
+    print(f"  vectorized:   {vectorized * 1000:9.1f} ms  x{legacy / vectorized:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Регрессионная проверка определения типов колонок в db_uploader.py на строках из
+input_data/top_12_german_companies.csv: числа с точками-разделителями без запятой
+и "%" ("942.175.618" — это ROA 0.942175618, а не 942 миллиона) должны остаться
+текстом, а однозначные числа в немецкой локали ("283,68%") — стать числами.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/check_db_uploader.py
+"""
+import os
+import sys
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from db_uploader import DEFAULT_CSV, ColumnProfile  # noqa: E402
+
+# Колонка -> ожидаемый тип
+KINDS = {
+    "Company": "text",
+    "Period": "date",
+    "Revenue": "integer",
+    "Net Income": "plain",
+    "ROA (%)": "text",
+    "ROE (%)": "text",
+    "Debt to Equity": "text",
+    "percentage  Debt to Equity": "locale",
+}
+# (компания, период, колонка, ожидаемое значение после convert)
+VALUES = [
+    ("Volkswagen AG", "12/31/2017", "ROA (%)", "942.175.618"),
+    ("BMW AG", "12/31/2017", "ROA (%)", "142.614.028"),
+    ("Volkswagen AG", "12/31/2017", "percentage  Debt to Equity", 0.0),
+    ("Siemens AG", "12/31/2017", "percentage  Debt to Equity", 283.68),
+    ("Volkswagen AG", "12/31/2017", "Net Income", 516889818.4),
+]
+
+
+def main():
+    rows = pd.read_csv(os.path.join(ROOT_DIR, DEFAULT_CSV), dtype=str, keep_default_na=False)
+    profiles = {}
+    for column in rows.columns:
+        profiles[column] = ColumnProfile(column)
+        profiles[column].observe(rows[column])
+
+    checks = []
+    for column, expected in KINDS.items():
+        actual = profiles[column].kind
+        checks.append((actual == expected, f"{column!r}: kind {actual}, expected {expected}"))
+    for company, period, column, expected in VALUES:
+        row = rows[(rows["Company"] == company) & (rows["Period"] == period)].iloc[0]
+        actual = profiles[column].convert(pd.Series([row[column]]))[column].iloc[0]
+        checks.append((actual == expected, f"{company} {period} {column!r}: {actual!r}, expected {expected!r}"))
+
+    failures = 0
+    for ok, message in checks:
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if failures:
+        raise SystemExit(f"Не прошло проверок: {failures} из {len(checks)}")
+    print(f"Все {len(checks)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
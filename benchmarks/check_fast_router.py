@@ -0,0 +1,59 @@
+"""
+Регрессионная проверка быстрого пути (fast_router.py) на метаданных из metadata_output:
+типовые вопросы разбираются без LLM с нужными показателями, а вопросы, где слово из
+составного алиаса относится к другому показателю ("чистый капитал", "чистые активы"),
+отдаются LLM.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/check_fast_router.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'check_fast_router.db')}")
+
+from config import FAST_PATH_MIN_CONFIDENCE  # noqa: E402
+from fast_router import FastPathRouter  # noqa: E402
+from metadata_registry import MetadataRegistry  # noqa: E402
+
+TABLE_NAME = "top_12_german_companies"
+
+# (вопрос, ожидаемые показатели; None — запрос должен уйти в LLM)
+CASES = [
+    ("какая выручка у BMW в 2022", ["Revenue"]),
+    ("чистая прибыль BMW в 2022", ["Net Income"]),
+    ("прибыль BMW в 2022", ["Net Income"]),
+    ("net income of SAP in 2022", ["Net Income"]),
+    ("капитал BMW в 2022", ["Equity"]),
+    ("активы и обязательства Siemens в 2021", ["Assets", "Liabilities"]),
+    ("чистый капитал BMW в 2022", None),
+    ("чистые активы BMW в 2022", None),
+    ("net assets of SAP in 2022", None),
+    ("средняя выручка BMW в 2022", None),
+]
+
+
+def main():
+    metadata = MetadataRegistry(os.path.join(ROOT_DIR, "metadata_output")).get(TABLE_NAME)
+    router = FastPathRouter(FAST_PATH_MIN_CONFIDENCE)
+
+    failures = 0
+    for query, expected in CASES:
+        result = router.route(query, metadata)
+        actual = result["metrics"] if result else None
+        ok = actual == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {query!r}: {actual if actual else 'LLM'}")
+
+    if failures:
+        raise SystemExit(f"Не прошло проверок: {failures} из {len(CASES)}")
+    print(f"Все {len(CASES)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
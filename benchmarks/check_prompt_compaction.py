@@ -0,0 +1,59 @@
+"""
+Регрессионная проверка сокращения промпта generate_sql на метаданных из metadata_output:
+значения каталога для компаний сокращаются до найденных в запросе, а периоды передаются
+все, чтобы диапазоны ("за 2020-2022", "после 2020") не теряли лет, которых нет в тексте.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/check_prompt_compaction.py
+"""
+import json
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'check_prompt_compaction.db')}")
+
+from config import PROMPT_SCHEMA_TOP_K, PROMPT_CATALOG_TOP_K  # noqa: E402
+from metadata_registry import MetadataRegistry  # noqa: E402
+from prompt_compaction import PromptCompactor  # noqa: E402
+
+TABLE_NAME = "top_12_german_companies"
+
+# (вопрос, компании, которые должны остаться в каталоге; None — все компании)
+CASES = [
+    ("Выручка BMW за 2020-2022", ["BMW AG"]),
+    ("Выручка BMW с 2020 по 2022", ["BMW AG"]),
+    ("Чистая прибыль SAP за 2018, 2019, 2020", ["SAP SE"]),
+    ("Выручка Siemens после 2020", ["Siemens AG"]),
+    ("Выручка всех компаний в 4 квартале 2021", None),
+]
+
+
+def main():
+    metadata = MetadataRegistry(os.path.join(ROOT_DIR, "metadata_output")).get(TABLE_NAME)
+    compactor = PromptCompactor(PROMPT_SCHEMA_TOP_K, PROMPT_CATALOG_TOP_K)
+    periods = list(metadata.catalog["Period"])
+    companies = list(metadata.catalog["Company"])
+
+    failures = 0
+    for query, expected_companies in CASES:
+        _, catalog_prompt, _ = compactor.build(query, metadata)
+        catalog = json.loads(catalog_prompt)
+        missing = [p for p in periods if p not in catalog["Period"]]
+        kept = list(catalog["Company"])
+        ok = not missing and kept == (expected_companies or companies)
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {query!r}: periods {len(periods) - len(missing)}/{len(periods)}, "
+              f"companies {kept if len(kept) < len(companies) else 'all'}")
+
+    if failures:
+        raise SystemExit(f"Не прошло проверок: {failures} из {len(CASES)}")
+    print(f"Все {len(CASES)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Регрессионная проверка семантического кеша на метаданных из metadata_output:
+перефразировки с тем же смыслом должны попадать в кеш, а близкие по тексту вопросы
+с другим показателем, агрегацией, группировкой, границей периода, порядком
+или единицами — промахиваться.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/check_semantic_cache.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'check_semantic_cache.db')}")
+
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_DIM  # noqa: E402
+from metadata_registry import MetadataRegistry  # noqa: E402
+from semantic_cache import SemanticCache  # noqa: E402
+
+TABLE_NAME = "top_12_german_companies"
+
+# (закешированный вопрос, новый вопрос, ожидается попадание)
+CASES = [
+    ("какая выручка у BMW в 2022", "покажи выручку BMW за 2022 год", True),
+    ("net income of SAP in 2022", "what was the net income of SAP in 2022", True),
+    ("какая выручка у BMW в 2022", "какая выручка у BMW в 2023", False),
+    ("какая выручка у BMW в 2022", "какая средняя выручка у BMW в 2022", False),
+    ("какая выручка у BMW в 2022", "какая выручка у BMW в 2022 помесячно", False),
+    ("какая выручка у BMW в 2022", "какая выручка у BMW в 2022 по кварталам", False),
+    ("какая выручка у BMW в 2022", "какая максимальная выручка у BMW в 2022", False),
+    ("какая выручка у BMW в 2022", "какая минимальная выручка у BMW в 2022", False),
+    ("net income of SAP in 2022", "income of SAP in 2022", False),
+    ("какая чистая прибыль у SAP в 2022", "какая прибыль у SAP в 2022", False),
+    ("какие активы у Siemens в 2021", "какие обязательства у Siemens в 2021", False),
+    ("ROA у Bayer в 2020", "ROE у Bayer в 2020", False),
+    ("выручка BMW после 2020", "выручка BMW до 2020", False),
+    ("выручка BMW в 2020", "выручка BMW до 2020", False),
+    ("выручка BMW в 2020", "выручка BMW с 2020 по 2022", False),
+    ("выручка BMW 2018 2020", "выручка BMW 2018-2020", False),
+    ("компании с выручкой больше 10 млрд", "компании с выручкой меньше 10 млрд", False),
+    ("компании с выручкой больше 10 млрд", "компании с выручкой больше 10 млн", False),
+    ("revenue of companies above 10 billion", "revenue of companies below 10 billion", False),
+    ("выручка компаний в 2022", "выручка компаний в 2022 по убыванию", False),
+    ("выручка компаний в 2022 по убыванию", "выручка компаний в 2022 по возрастанию", False),
+    ("top companies by revenue in 2022", "revenue of companies in 2022", False),
+    ("выручка BMW в 2022", "выручка BMW в 2022 в долларах", False),
+    ("чистая прибыль BMW в 2022", "чистая прибыль BMW в 2022 в процентах", False),
+    ("выручка компаний после 2020", "покажи выручку компаний после 2020 года", True),
+]
+
+
+def main():
+    metadata = MetadataRegistry(os.path.join(ROOT_DIR, "metadata_output")).get(TABLE_NAME)
+    failures = 0
+    for cached, asked, expect_hit in CASES:
+        cache = SemanticCache(max_size=8, threshold=SEMANTIC_CACHE_THRESHOLD, dim=SEMANTIC_CACHE_DIM)
+        cache.add(cached, metadata, {"sql": cached})
+        hit = cache.lookup(asked, metadata) is not None
+        ok = hit == expect_hit
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {'hit ' if hit else 'miss'} {cached!r} -> {asked!r}")
+
+    if failures:
+        raise SystemExit(f"Не прошло проверок: {failures} из {len(CASES)}")
+    print(f"Все {len(CASES)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Регрессионная проверка sql_rewriter.py на данных из input_data: CSV загружается
+db_uploader.py во временную SQLite, и для каждого запроса проверяется, переведен ли он
+на годовые суммы `<table>_yearly` и совпадает ли результат с исходным запросом.
+Запросы с AVG, COUNT, долями, точными периодами или кварталами должны остаться на исходной таблице.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/check_sql_rewriter.py
+"""
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), "check_sql_rewriter.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from db_uploader import DEFAULT_CSV, DEFAULT_CHUNK_SIZE, DEFAULT_KEY_COLUMNS, DEFAULT_TABLE, replace_table  # noqa: E402
+from sql_rewriter import YearFilterRewriter  # noqa: E402
+
+T = f'"{DEFAULT_TABLE}"'
+# (запрос, ожидается перевод на годовые суммы)
+CASES = [
+    (f"""SELECT SUM("Revenue") AS "Total Annual Revenue" FROM {T} WHERE "Company" = 'BMW AG' AND "Period" LIKE '%2022'""", True),
+    (f"""SELECT "Company", SUM("Net Income") AS "Total Net Income" FROM {T} WHERE "Period" LIKE '%2021' """
+     f"""GROUP BY "Company" ORDER BY "Total Net Income" DESC""", True),
+    (f"""SELECT "Company", year, ROUND(SUM("Revenue") / 1e9, 2) AS bn FROM {DEFAULT_TABLE} t """
+     f"""GROUP BY "Company", year ORDER BY 1, 2""", True),
+    (f"""SELECT SUM(t."Assets") FROM {T} t WHERE t."Company" IN ('SAP SE', 'BMW AG') """
+     f"""AND ("Period" LIKE '%2020' OR "Period" LIKE '%2021');""", True),
+    (f"""SELECT AVG("Revenue") FROM {T} WHERE "Period" LIKE '%2022'""", False),
+    (f"""SELECT SUM("Revenue"), COUNT(*) FROM {T}""", False),
+    (f"""SELECT SUM("ROA (%)") FROM {T}""", False),
+    (f"""SELECT SUM("Revenue") FROM {T} WHERE "Period" = '12/31/2022'""", False),
+    (f"""SELECT SUM("Revenue") FROM {T} WHERE quarter = 4""", False),
+    (f"""SELECT SUM("Revenue" - "Net Income") FROM {T}""", False),
+    (f"""SELECT SUM(DISTINCT "Revenue") FROM {T}""", False),
+    (f"""SELECT "Company", SUM("Revenue") OVER (PARTITION BY "Company") FROM {T}""", False),
+    (f"""SELECT SUM("Revenue") FROM {T} WHERE "Revenue" > 1000""", False),
+    (f"""SELECT SUM(x."Revenue") FROM (SELECT * FROM {T}) x""", False),
+    (f"""SELECT SUM("Revenue") AS "Revenue" FROM {T} WHERE "Company" = 'BMW AG'""", False),
+]
+
+
+def main():
+    engine = create_engine(os.environ["DATABASE_URL"])
+    replace_table(engine, os.path.join(ROOT_DIR, DEFAULT_CSV), DEFAULT_TABLE, DEFAULT_KEY_COLUMNS, DEFAULT_CHUNK_SIZE)
+    rewriter = YearFilterRewriter(refresh_interval=60)
+
+    failures = 0
+    with engine.connect() as conn:
+        for sql_query, expect_yearly in CASES:
+            rewritten = rewriter.rewrite(sql_query, conn)
+            yearly = f"{DEFAULT_TABLE}_yearly" in rewritten
+            # Суммы Numeric в SQLite — float: сравниваем с точностью до копеек
+            expected = pd.read_sql(text(sql_query), conn).round(2)
+            actual = pd.read_sql(text(rewritten), conn).round(2)
+            ok = yearly == expect_yearly and expected.equals(actual)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {'yearly' if yearly else 'base  '} {rewritten}")
+
+    if failures:
+        raise SystemExit(f"Не прошло проверок: {failures} из {len(CASES)}")
+    print(f"Все {len(CASES)} проверок прошли")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Проверка времени холодного старта: `python -X importtime` для импорта api и время
+от запуска `uvicorn api:app` до первого успешного ответа /health. Каждый замер —
+в новом процессе, поэтому результаты не зависят от уже загруженных модулей.
+
+С заданными бюджетами завершается с кодом 1, если они превышены (для CI).
+
+Запуск из корня репозитория:
+    python benchmarks/cold_start.py --runs 3
+    python benchmarks/cold_start.py --import-budget-ms 1500 --health-budget-ms 3000
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import time:   self [us] | cumulative | imported package
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def bench_env() -> Dict[str, str]:
+    """Окружение для дочерних процессов: без реальных ключей и БД приложение тоже должно стартовать."""
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'cold_start.db')}")
+    env.setdefault("OPENAI_API_KEY", "cold-start")
+    return env
+
+
+def measure_import(module: str, env: Dict[str, str]) -> Tuple[float, List[Tuple[str, float]]]:
+    """Время импорта модуля (мс) и самые дорогие пакеты верхнего уровня по накопленному времени."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    packages: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)), match.group(3)
+        if name == module:
+            total_us = cumulative
+            continue
+        # Первый импорт пакета (на любой глубине) включает всю его стоимость
+        root = name.split(".")[0]
+        packages[root] = max(packages.get(root, 0), cumulative)
+    top = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return total_us / 1000, [(name, us / 1000) for name, us in top]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_health(env: Dict[str, str], timeout: float) -> float:
+    """Время от запуска uvicorn до первого 200 на /health (мс)."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise SystemExit(f"uvicorn завершился с кодом {process.returncode}:\n"
+                                 f"{process.stderr.read().decode(errors='replace')[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise SystemExit(f"/health не ответил за {timeout} с")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start budget check for api.py")
+    parser.add_argument("--runs", type=int, default=3, help="Сколько раз повторить каждый замер (берется медиана)")
+    parser.add_argument("--module", default="api", help="Модуль для замера импорта")
+    parser.add_argument("--top", type=int, default=8, help="Сколько самых дорогих пакетов показать")
+    parser.add_argument("--import-budget-ms", type=float, help="Бюджет на импорт модуля, мс")
+    parser.add_argument("--health-budget-ms", type=float, help="Бюджет от запуска uvicorn до первого /health, мс")
+    parser.add_argument("--timeout", type=float, default=60, help="Сколько ждать /health, с")
+    args = parser.parse_args()
+
+    env = bench_env()
+    imports = [measure_import(args.module, env) for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _ in imports)
+    print(f"import {args.module}: median {import_ms:.0f} ms over {args.runs} runs")
+    for name, ms in imports[-1][1][:args.top]:
+        print(f"    {name:<20} {ms:8.1f} ms")
+
+    health_runs = [measure_health(env, args.timeout) for _ in range(args.runs)]
+    health_ms = statistics.median(health_runs)
+    print(f"uvicorn start -> first /health: median {health_ms:.0f} ms "
+          f"(runs: {', '.join(f'{ms:.0f}' for ms in health_runs)})")
+
+    failures = []
+    if args.import_budget_ms is not None and import_ms > args.import_budget_ms:
+        failures.append(f"import {args.module} {import_ms:.0f} ms > budget {args.import_budget_ms:.0f} ms")
+    if args.health_budget_ms is not None and health_ms > args.health_budget_ms:
+        failures.append(f"first /health {health_ms:.0f} ms > budget {args.health_budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Офлайн-бенчмарк пайплайна: прогоняет нагрузку из JSONL через run_companies_pipeline
+и через FastAPI приложение (в процессе, без сети) на нескольких уровнях параллелизма.
+
+Вместо LLM используется локальный mock_llm.py (контракт CUSTOM_LLM_API_BASE) с заданной
+задержкой, вместо рабочей БД — SQLite (или локальный PostgreSQL из --database-url),
+засеянная из input_data/top_12_german_companies.csv через db_uploader.py.
+
+Печатает p50/p95/p99, RPS и разбивку по этапам пайплайна (route_tables, resolve_sql,
+execute_sql, summarize). С --baseline сравнивает p95 с прошлым прогоном и завершается
+с кодом 1 при регрессии больше --max-regression.
+
+Запуск из корня репозитория:
+    python benchmarks/load_test.py --concurrency 1,4,16 --requests 200 --llm-latency 0.3
+    python benchmarks/load_test.py --no-cache --output bench.json
+    python benchmarks/load_test.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm import MockLLM, create_app, load_workload  # noqa: E402
+
+TABLE_NAME = "top_12_german_companies"
+BENCH_API_KEY = "bench"
+STAGES = ("route_tables", "resolve_sql", "execute_sql", "summarize")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_llm(mock: MockLLM, port: int):
+    """Запускает mock LLM в фоновом потоке и ждет, пока он начнет принимать соединения."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(mock), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise SystemExit("Mock LLM не запустился за 10 секунд")
+        time.sleep(0.05)
+    return server, thread
+
+
+def seed_database(database_url: str, csv_path: str) -> int:
+    from sqlalchemy import create_engine
+    from db_uploader import replace_table
+
+    engine = create_engine(database_url)
+    try:
+        return replace_table(engine, csv_path, TABLE_NAME, ["Company", "Period"], chunk_size=10_000)
+    finally:
+        engine.dispose()
+
+
+def configure_environment(args, llm_base: str, database_url: str) -> None:
+    """
+    Переменные окружения задаются до импорта config: оба провайдера смотрят в mock LLM,
+    кеши на диске отключены, чтобы прогоны не влияли друг на друга.
+    """
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "LLM_PROVIDER": "custom",
+        "CUSTOM_LLM_API_BASE": llm_base,
+        "CUSTOM_LLM_MODEL": "mock",
+        "CUSTOM_LLM_API_KEY": "",
+        "OPENAI_API_KEY": BENCH_API_KEY,
+        "OPENAI_BASE_URL": llm_base,
+        "API_AUTH_KEY": BENCH_API_KEY,
+        "SQL_CACHE_SQLITE_PATH": "",
+        "RESULT_CACHE_SQLITE_PATH": "",
+        "TIMING_HEADER_ENABLED": "true",
+    })
+    if args.no_cache:
+        os.environ.update({
+            "SQL_CACHE_MAX_SIZE": "0",
+            "SEMANTIC_CACHE_MAX_SIZE": "0",
+            "RESULT_CACHE_MAX_BYTES": "0",
+            "FAST_PATH_ENABLED": "false",
+        })
+
+
+def parse_timing_header(value: str) -> Dict[str, float]:
+    """X-Timing "resolve_sql=812.4;execute_sql=3.1;total=830.2" -> секунды по этапам."""
+    timings = {}
+    for part in (value or "").split(";"):
+        name, _, ms = part.partition("=")
+        if name and name != "total" and ms:
+            timings[name] = float(ms) / 1000
+    return timings
+
+
+async def run_level(send, queries: List[str], concurrency: int, total: int) -> Dict:
+    """Отправляет total запросов из цикла по queries, не более concurrency одновременно."""
+    source = itertools.islice(itertools.cycle(queries), total)
+    latencies: List[float] = []
+    stage_samples: Dict[str, List[float]] = {}
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for query in source:
+            started = time.perf_counter()
+            try:
+                ok, timings = await send(query)
+            except Exception as e:
+                logging.getLogger("bench").warning(f"Ошибка запроса '{query}': {e!r}")
+                ok, timings = False, {}
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+            for name, seconds in timings.items():
+                stage_samples.setdefault(name, []).append(seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(ms, 99)), 1),
+        "mean_ms": round(float(ms.mean()), 1),
+        "stages": {
+            name: {
+                "mean_ms": round(float(np.mean(samples)) * 1000, 1),
+                "p95_ms": round(float(np.percentile(samples, 95)) * 1000, 1),
+                "count": len(samples),
+            }
+            for name, samples in sorted(stage_samples.items(), key=lambda item: _stage_order(item[0]))
+        },
+    }
+
+
+def _stage_order(name: str) -> int:
+    return STAGES.index(name) if name in STAGES else len(STAGES)
+
+
+def make_pipeline_sender():
+    from pipeline import run_companies_pipeline, INTERNAL_ERROR_ANSWER
+    from metrics import request_timings
+
+    async def send(query: str):
+        # Каждый воркер — отдельная задача asyncio, значение ContextVar видно только ей
+        timings = {}
+        request_timings.set(timings)
+        answer = await run_companies_pipeline(query)
+        return answer != INTERNAL_ERROR_ANSWER, dict(timings)
+
+    return send
+
+
+def make_api_sender(client):
+    headers = {"Authorization": f"Bearer {BENCH_API_KEY}"}
+
+    async def send(query: str):
+        response = await client.post("/chat", json={"query": query}, headers=headers)
+        return response.status_code == 200, parse_timing_header(response.headers.get("X-Timing"))
+
+    return send
+
+
+async def run_benchmark(args, queries: List[str]) -> List[Dict]:
+    import httpx
+    from api import app
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    modes = args.mode.split(",")
+    results = []
+
+    # lifespan_context выполняет те же обработчики старта/остановки, что и uvicorn
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            senders = {"pipeline": make_pipeline_sender(), "api": make_api_sender(client)}
+            for mode in modes:
+                if mode not in senders:
+                    raise SystemExit(f"Неизвестный режим: {mode} (ожидается pipeline или api)")
+                send = senders[mode]
+                for _ in range(args.warmup):
+                    await run_level(send, queries, 1, len(queries))
+                for level in levels:
+                    result = await run_level(send, queries, level, args.requests)
+                    result["mode"] = mode
+                    results.append(result)
+                    print_result(result)
+    return results
+
+
+def print_result(result: Dict) -> None:
+    print(
+        f"{result['mode']:<9} c={result['concurrency']:<4} n={result['requests']:<5} err={result['errors']:<3} "
+        f"rps={result['rps']:>8.2f}  p50={result['p50_ms']:>8.1f}  p95={result['p95_ms']:>8.1f}  "
+        f"p99={result['p99_ms']:>8.1f} ms"
+    )
+    for name, stage in result["stages"].items():
+        print(f"    {name:<14} mean={stage['mean_ms']:>8.1f}  p95={stage['p95_ms']:>8.1f} ms  (n={stage['count']})")
+
+
+def check_regressions(results: List[Dict], baseline_path: str, max_regression: float) -> List[str]:
+    """Сравнивает p95 с прошлым прогоном по совпадающим (mode, concurrency)."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["mode"], r["concurrency"]): r for r in json.load(f)["results"]}
+    failures = []
+    for result in results:
+        previous = baseline.get((result["mode"], result["concurrency"]))
+        if not previous or not previous["p95_ms"]:
+            continue
+        change = result["p95_ms"] / previous["p95_ms"] - 1
+        if change > max_regression:
+            failures.append(
+                f"{result['mode']} c={result['concurrency']}: p95 {previous['p95_ms']} -> {result['p95_ms']} ms "
+                f"(+{change:.0%})"
+            )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the text-to-SQL pipeline")
+    parser.add_argument("--workload", default=os.path.join(ROOT_DIR, "benchmarks", "workload.jsonl"),
+                        help="JSONL с вопросами (и необязательным полем sql для ответа mock LLM)")
+    parser.add_argument("--field", default="query", help="Поле JSON объекта с вопросом")
+    parser.add_argument("--concurrency", default="1,4,16", help="Уровни параллелизма через запятую")
+    parser.add_argument("--requests", type=int, default=100, help="Запросов на каждый уровень")
+    parser.add_argument("--mode", default="pipeline,api", help="pipeline, api или оба через запятую")
+    parser.add_argument("--warmup", type=int, default=1, help="Проходов по нагрузке до замеров (прогрев кешей)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Средняя задержка mock LLM, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="Стандартное отклонение задержки, с")
+    parser.add_argument("--database-url", help="БД для прогона; по умолчанию временная SQLite")
+    parser.add_argument("--csv", default=os.path.join(ROOT_DIR, "input_data", "top_12_german_companies.csv"))
+    parser.add_argument("--skip-seed", action="store_true", help="Не перезаливать таблицу в --database-url")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Отключить кеши SQL/результатов и быстрый путь: каждый запрос идет в LLM и БД")
+    parser.add_argument("--output", help="Сохранить результаты в JSON (для --baseline следующего прогона)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения p95")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимый рост p95, доля")
+    parser.add_argument("--verbose", action="store_true", help="Не приглушать логи приложения")
+    args = parser.parse_args()
+
+    os.chdir(ROOT_DIR)
+    workload = load_workload(args.workload, args.field)
+    if not workload:
+        raise SystemExit(f"В файле {args.workload} не найдено ни одного вопроса")
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_'), 'bench.db')}"
+    if not args.skip_seed:
+        rows = seed_database(database_url, args.csv)
+        print(f"Seeded {rows} rows into {TABLE_NAME} ({database_url})")
+
+    mock = MockLLM(workload, args.llm_latency, args.llm_jitter, token_delay=0.0)
+    port = free_port()
+    server, thread = start_mock_llm(mock, port)
+    configure_environment(args, f"http://127.0.0.1:{port}", database_url)
+
+    if not args.verbose:
+        logging.getLogger("chatbot_app").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    try:
+        results = asyncio.run(run_benchmark(args, [r["query"] for r in workload]))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+    print(f"Mock LLM calls: {mock.calls}, total time: {time.perf_counter() - started:.1f} s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "llm_latency": args.llm_latency,
+                "no_cache": args.no_cache,
+                "database": database_url.split(":", 1)[0],
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        failures = check_regressions(results, args.baseline, args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
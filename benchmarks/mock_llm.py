@@ -0,0 +1,157 @@
+"""
+Локальная замена LLM для бенчмарков: OpenAI-совместимый `/chat/completions`
+(контракт CUSTOM_LLM_API_BASE) с настраиваемой задержкой и заготовленными ответами.
+
+Промпт generate_sql распознается по вопросу пользователя: если вопрос есть в файле
+нагрузки, возвращается JSON с его SQL (поле `sql`), иначе — SQL по умолчанию.
+На промпт суммаризации возвращается короткий фиксированный текст.
+
+Отдельный запуск (например, чтобы нагрузить развернутый API):
+    python benchmarks/mock_llm.py --workload benchmarks/workload.jsonl --port 8081 --latency 0.4
+    CUSTOM_LLM_API_BASE=http://127.0.0.1:8081 CUSTOM_LLM_MODEL=mock LLM_PROVIDER=custom uvicorn api:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_SQL = 'SELECT "Company", "Period", "Revenue" FROM top_12_german_companies ORDER BY "Period" DESC LIMIT 5'
+SUMMARY_ANSWER = (
+    "По данным таблицы показатели компании стабильны: значения за указанный период "
+    "приведены выше, существенных отклонений не наблюдается."
+)
+
+# Вопрос пользователя в промпте generate_sql (pipeline.generate_sql)
+_SQL_PROMPT_RE = re.compile(r'Вот вопрос от пользователя:\s*"(?P<query>.*?)"\s*\n', re.DOTALL)
+
+
+def load_workload(path: str, field: str = "query") -> List[Dict]:
+    """Читает JSONL с нагрузкой: по объекту на строку, вопрос в поле `field`, SQL — в `sql`."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and record.get(field):
+                records.append({"query": record[field], "sql": record.get("sql", DEFAULT_SQL)})
+    return records
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class MockLLM:
+    """Заготовленные ответы и имитация задержки модели."""
+
+    def __init__(self, workload: List[Dict], latency: float, jitter: float, token_delay: float):
+        self.sql_by_query = {_normalize(r["query"]): r["sql"] for r in workload}
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.calls = 0
+
+    def delay(self) -> float:
+        return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def answer(self, messages: List[Dict]) -> str:
+        prompt = messages[-1].get("content", "") if messages else ""
+        match = _SQL_PROMPT_RE.search(prompt)
+        if match is None:
+            return SUMMARY_ANSWER
+        query = match.group("query")
+        sql: Optional[str] = self.sql_by_query.get(_normalize(query), DEFAULT_SQL)
+        return json.dumps({
+            "sql": sql,
+            "clarified_prompt": query,
+            "metrics": [],
+            "groups": [],
+            "years": [],
+            "units": [],
+        }, ensure_ascii=False)
+
+
+def _usage(messages: List[Dict], content: str) -> Dict:
+    # Грубая оценка токенов: для бенчмарка важна не точность, а наличие поля usage
+    prompt_tokens = sum(len(m.get("content", "").split()) for m in messages)
+    completion_tokens = len(content.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_app(mock: MockLLM) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        mock.calls += 1
+        content = mock.answer(messages)
+        await asyncio.sleep(mock.delay())
+        created = int(time.time())
+        model = body.get("model") or "mock"
+
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": f"mock-{mock.calls}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage(messages, content),
+            })
+
+        async def events():
+            words = content.split(" ")
+            for i, word in enumerate(words):
+                delta = word if i == len(words) - 1 else word + " "
+                chunk = {
+                    "id": f"mock-{mock.calls}", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if mock.token_delay:
+                    await asyncio.sleep(mock.token_delay)
+            final = {
+                "id": f"mock-{mock.calls}", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": _usage(messages, content),
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server for benchmarks")
+    parser.add_argument("--workload", default="benchmarks/workload.jsonl")
+    parser.add_argument("--field", default="query")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.4, help="Средняя задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Стандартное отклонение задержки, с")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Пауза между токенами потока, с")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    mock = MockLLM(load_workload(args.workload, args.field), args.latency, args.jitter, args.token_delay)
+    uvicorn.run(create_app(mock), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
 import os
-import openai
 import logging
-import httpx
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from typing import List, Dict
 
 # === Загрузка .env ===
 load_dotenv()
@@ -18,7 +15,83 @@ API_AUTH_KEY = os.getenv("API_AUTH_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL не установлена.")
-db_engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# Пул соединений SQLAlchemy создается в каждом воркере uvicorn при старте (см. resources.py).
+# Лимит соединений к PostgreSQL на воркер: DB_POOL_SIZE + DB_MAX_OVERFLOW.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Сколько секунд ждать свободное соединение, прежде чем вернуть ошибку
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Соединения старше этого возраста (секунды) пересоздаются вместо проверки pre-ping на каждой выдаче
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+
+# Синхронные запросы к БД выполняются в ограниченном пуле потоков, чтобы не блокировать event loop.
+# По умолчанию размер совпадает с лимитом пула соединений, чтобы потоки не простаивали в ожидании соединения.
+DB_EXECUTOR_MAX_WORKERS = int(os.getenv("DB_EXECUTOR_MAX_WORKERS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+# Таймаут одного SQL-запроса в миллисекундах (statement_timeout в PostgreSQL), 0 — без ограничения
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+# Переписывать фильтры "Period" LIKE '%YYYY' в индексируемое "year" = YYYY (колонку year добавляет db_uploader.py)
+SQL_REWRITE_ENABLED = os.getenv("SQL_REWRITE_ENABLED", "true").lower() == "true"
+# Как часто (в секундах) перечитывать состав колонок таблиц для переписывания
+SQL_REWRITE_REFRESH_INTERVAL = float(os.getenv("SQL_REWRITE_REFRESH_INTERVAL", "60"))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_MAX_WORKERS, thread_name_prefix="sql")
+
+# === Метаданные таблиц ===
+# Как часто (в секундах) реестр сверяет mtime файлов схем/каталогов
+METADATA_RELOAD_INTERVAL = float(os.getenv("METADATA_RELOAD_INTERVAL", "5"))
+# Сколько таблиц-кандидатов передавать в generate_sql и минимальная оценка относительно лучшей
+TABLE_ROUTER_TOP_K = int(os.getenv("TABLE_ROUTER_TOP_K", "2"))
+TABLE_ROUTER_MIN_RELATIVE_SCORE = float(os.getenv("TABLE_ROUTER_MIN_RELATIVE_SCORE", "0.6"))
+
+# === Кеш сгенерированного SQL ===
+SQL_CACHE_MAX_SIZE = int(os.getenv("SQL_CACHE_MAX_SIZE", "1024"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))
+# Путь к SQLite-файлу для общего между воркерами кеша; пусто — только память
+SQL_CACHE_SQLITE_PATH = os.getenv("SQL_CACHE_SQLITE_PATH", "")
+
+# === Кеш результатов выполненного SQL ===
+# Предел суммарного размера сериализованных результатов в памяти, 0 отключает кеш
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+# Путь к SQLite-файлу для общего между воркерами кеша результатов; пусто — только память
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH", "")
+# Как часто (в секундах) проверять штамп версии данных, который пишет db_uploader.py
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "5"))
+
+# === Семантический кеш (по сходству запросов) ===
+# 0 отключает кеш
+SEMANTIC_CACHE_MAX_SIZE = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "2048"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "4096"))
+
+# === Быстрый путь: шаблонный SQL без LLM ===
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+# Минимальная доля слов запроса, которую должен объяснить разборщик
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+# === Сокращение промпта generate_sql ===
+# В промпт попадают только релевантные запросу колонки схемы и значения каталога
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+PROMPT_SCHEMA_TOP_K = int(os.getenv("PROMPT_SCHEMA_TOP_K", "4"))
+PROMPT_CATALOG_TOP_K = int(os.getenv("PROMPT_CATALOG_TOP_K", "8"))
+
+# === Формирование ответа ===
+# auto — простые результаты (1×1, небольшие таблицы) оформляются по шаблону без LLM; llm — всегда через LLM
+SUMMARY_POLICY = os.getenv("SUMMARY_POLICY", "auto").lower()
+SUMMARY_TEMPLATE_MAX_ROWS = int(os.getenv("SUMMARY_TEMPLATE_MAX_ROWS", "12"))
+SUMMARY_TEMPLATE_MAX_COLUMNS = int(os.getenv("SUMMARY_TEMPLATE_MAX_COLUMNS", "3"))
+
+# === Пакетная обработка (/chat/batch) ===
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+
+# === Объединение одинаковых одновременных запросов (single-flight) ===
+# Одинаковые вопросы/SQL, пришедшие пока первый еще выполняется, ждут его результат
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# === Метрики и трассировка задержек ===
+# Заголовок X-Timing с длительностями этапов пайплайна в ответах API
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "true").lower() == "true"
 
 # === Конфигурация LLM Провайдеров ===
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
@@ -31,58 +104,35 @@ CUSTOM_LLM_API_KEY = os.getenv("CUSTOM_LLM_API_KEY")
 # OpenAI (как основной или запасной)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
-openai_async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-# Создаем единый асинхронный HTTP клиент для всех запросов
-async_http_client = httpx.AsyncClient(timeout=120.0)
-
-async def get_llm_completion(messages: List[Dict[str, str]], temperature: float) -> str:
-    """
-    Универсальная функция для вызова LLM.
-    Пытается использовать основного провайдера, при ошибке переключается на OpenAI.
-    """
-    use_custom_llm = LLM_PROVIDER == 'custom' and CUSTOM_LLM_API_BASE and CUSTOM_LLM_MODEL
-
-    if use_custom_llm:
-        try:
-            logger.info(f"Вызов кастомного LLM: {CUSTOM_LLM_MODEL}")
-            headers = {"Content-Type": "application/json"}
-            if CUSTOM_LLM_API_KEY:
-                headers["Authorization"] = f"Bearer {CUSTOM_LLM_API_KEY}"
-            
-            payload = {
-                "messages": messages,
-                "model": CUSTOM_LLM_MODEL,
-                "temperature": temperature,
-                "max_completion_tokens": 1024, 
-                "stream": False
-            }
-            
-            response = await async_http_client.post(
-                f"{CUSTOM_LLM_API_BASE.rstrip('/')}/chat/completions",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status() 
-            
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-        
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            logger.warning(f"Ошибка при вызове кастомного LLM: {e}. Переключение на OpenAI.")
-            # При ошибке автоматически переходим к запасному варианту
-
-    try:
-        logger.info(f"Вызов OpenAI LLM: {OPENAI_MODEL}")
-        if not OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY не установлен для запасного варианта.")
-            
-        response = await openai_async_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            temperature=temperature
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Критическая ошибка: оба LLM провайдера недоступны. Ошибка OpenAI: {e}")
-        raise IOError("Сервис генерации текста временно недоступен.")
\ No newline at end of file
+# Клиент OpenAI создается при первом вызове или на этапе прогрева (см. resources.py)
+
+# Общий асинхронный HTTP клиент для кастомного LLM создается в каждом воркере при старте (см. resources.py)
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+
+# Ограничения и повторы вызовов LLM (действуют для каждого провайдера отдельно)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Частота запросов в секунду; 0 — без ограничения
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "0"))
+LLM_RATE_LIMIT_BURST = float(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Таймаут одной попытки (для потокового ответа — до первого токена)
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+
+# Хеджирование: если основной провайдер не ответил за свой p95, параллельно вызывается запасной
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+
+# Автомат защиты (circuit breaker): при высокой доле ошибок провайдер временно исключается
+LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "60"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+# Вызовы дольше этого порога считаются неудачными при расчете доли ошибок
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "30"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+LLM_BREAKER_HALF_OPEN_CALLS = int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1"))
@@ -1,28 +1,425 @@
+import argparse
+import io
 import os
+import re
+import time
+import uuid
 import pandas as pd
-from sqlalchemy import create_engine
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import (
+    create_engine, inspect, text, MetaData, Table, Column, BigInteger, Integer, Numeric, Date, Text,
+)
+from sqlalchemy.engine import Connection
 from dotenv import load_dotenv
 
+from utils import (
+    YEAR_COLUMN, QUARTER_COLUMN, DATA_VERSIONS_TABLE, YEARLY_PERIODS_COLUMN, date_column_name, yearly_table_name,
+)
+
 # Загружаем переменные окружения из .env
 load_dotenv()
 
-# 1. Load your CSV
-df = pd.read_csv("input_data/top_12_german_companies.csv")
+DEFAULT_CSV = "input_data/top_12_german_companies.csv"
+DEFAULT_TABLE = "top_12_german_companies"
+DEFAULT_CHUNK_SIZE = 50_000
+# Ключ строки для инкрементальной загрузки (--mode upsert)
+DEFAULT_KEY_COLUMNS = ["Company", "Period"]
+# Хеш исходных значений строки: по нему upsert находит измененные строки
+ROW_HASH_COLUMN = "row_hash"
 
+# Число в формате Python/CSV: "9750496618", "516889818.4"
+_PLAIN_NUMBER = r"[+-]?\d+(?:\.\d+)?%?"
+# Число в немецкой локали: точка — разделитель разрядов, запятая — десятичная ("1.234,5", "283,68%")
+_LOCALE_NUMBER = r"[+-]?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?%?"
+# Признак локали, который нельзя спутать с потерянной десятичной точкой: запятая или "%"
+_LOCALE_MARKER = r"[,%]"
+_INTEGER = r"[+-]?\d+"
+# Доли и коэффициенты: их суммы по периодам бессмысленны, в годовой агрегат они не попадают
+_RATIO_NAME_RE = re.compile(r"%|percent|ratio|(?<!\w)(?:to|rate|margin)(?!\w)|процент|доля|коэфф", re.IGNORECASE)
+# Форматы дат, которые распознаются автоматически
+_DATE_FORMATS = {
+    r"\d{1,2}/\d{1,2}/\d{4}": "%m/%d/%Y",
+    r"\d{4}-\d{2}-\d{2}": "%Y-%m-%d",
+}
 
-DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL is not set in .env")
+class ColumnProfile:
+    """
+    Тип колонки CSV, определяемый по всем ее значениям (потоково, по чанкам):
+    integer, plain (число с точкой), locale (число в немецкой локали), date или text.
 
-engine = create_engine(DATABASE_URL)
+    Колонка считается locale, только если хотя бы одно значение содержит запятую или "%".
+    Значения вида "942.175.618" без этих признаков неоднозначны: в исходном CSV это
+    дроби, потерявшие десятичную точку (ROA 0.942175618), а не 942 миллиона. Такие
+    колонки остаются текстом (см. ambiguous), чтобы не сохранить в БД неверные числа.
+    """
 
+    def __init__(self, name: str):
+        self.name = name
+        self.integer = True
+        self.plain = True
+        self.locale = True
+        self.locale_marker = False
+        self.percent = False
+        self.date_formats = dict(_DATE_FORMATS)
+
+    def observe(self, values: pd.Series) -> None:
+        values = values.dropna()
+        values = values[values != ""]
+        if values.empty:
+            return
+        if self.integer:
+            self.integer = bool(values.str.fullmatch(_INTEGER).all())
+        if self.plain:
+            self.plain = bool(values.str.fullmatch(_PLAIN_NUMBER).all())
+        if self.locale:
+            self.locale = bool(values.str.fullmatch(_LOCALE_NUMBER).all())
+        if not self.percent:
+            self.percent = bool(values.str.endswith("%").any())
+        if self.locale and not self.locale_marker:
+            self.locale_marker = bool(values.str.contains(_LOCALE_MARKER).any())
+        for pattern in list(self.date_formats):
+            if not values.str.fullmatch(pattern).all():
+                del self.date_formats[pattern]
+
+    @property
+    def ambiguous(self) -> bool:
+        """Числа только с точками-разделителями: разряды это или потерянная десятичная точка, не определить."""
+        return self.locale and not (self.integer or self.plain or self.locale_marker)
+
+    @property
+    def additive(self) -> bool:
+        """Денежный показатель, который можно суммировать по периодам (не доля и не коэффициент)."""
+        return self.kind in ("integer", "plain") and not self.percent and not _RATIO_NAME_RE.search(self.name)
+
+    @property
+    def kind(self) -> str:
+        if self.integer:
+            return "integer"
+        if self.plain:
+            return "plain"
+        if self.locale and self.locale_marker:
+            return "locale"
+        if self.ambiguous:
+            return "text"
+        if self.date_formats:
+            return "date"
+        return "text"
+
+    def sql_columns(self) -> List[Column]:
+        kind = self.kind
+        if kind == "integer":
+            return [Column(self.name, BigInteger)]
+        if kind in ("plain", "locale"):
+            return [Column(self.name, Numeric)]
+        if kind == "date":
+            # Исходная текстовая колонка остается: на ее значения опираются каталог и промпты
+            return [Column(self.name, Text), Column(date_column_name(self.name), Date)]
+        return [Column(self.name, Text)]
+
+    def convert(self, values: pd.Series) -> Dict[str, pd.Series]:
+        """Приводит значения чанка к типу колонки; пустые строки становятся NULL."""
+        values = values.where(values != "")
+        kind = self.kind
+        if kind == "text":
+            return {self.name: values}
+        if kind == "date":
+            date_format = next(iter(self.date_formats.values()))
+            dates = pd.to_datetime(values, format=date_format, errors="raise").dt.date
+            return {self.name: values, date_column_name(self.name): dates.where(values.notna())}
+
+        numbers = values.str.rstrip("%")
+        if kind == "locale":
+            numbers = numbers.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        numbers = pd.to_numeric(numbers)
+        if kind == "integer":
+            numbers = numbers.astype("Int64")
+        return {self.name: numbers}
+
+
+def read_chunks(csv_path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Потоковое чтение CSV: все значения читаются как строки, типы определяет ColumnProfile."""
+    return pd.read_csv(csv_path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def profile_csv(csv_path: str, chunk_size: int) -> List[ColumnProfile]:
+    """Первый проход по файлу: определяет типы колонок без загрузки файла в память целиком."""
+    profiles = None
+    for chunk in read_chunks(csv_path, chunk_size):
+        if profiles is None:
+            profiles = [ColumnProfile(column) for column in chunk.columns]
+        for profile in profiles:
+            profile.observe(chunk[profile.name])
+    if profiles is None:
+        raise ValueError(f"CSV file {csv_path} is empty")
+    for profile in profiles:
+        if profile.ambiguous:
+            print(f"Warning: column {profile.name!r} has ambiguous dotted numbers, stored as text")
+    return profiles
+
+
+def period_profile(profiles: List[ColumnProfile]) -> Optional[ColumnProfile]:
+    """Первая колонка-дата, от которой считаются производные year/quarter (если их нет в самом файле)."""
+    names = {p.name for p in profiles}
+    if YEAR_COLUMN in names or QUARTER_COLUMN in names:
+        return None
+    return next((p for p in profiles if p.kind == "date"), None)
+
+
+def build_table(table_name: str, profiles: List[ColumnProfile]) -> Table:
+    columns = [column for profile in profiles for column in profile.sql_columns()]
+    if period_profile(profiles) is not None:
+        columns += [Column(YEAR_COLUMN, Integer), Column(QUARTER_COLUMN, Integer)]
+    return Table(table_name, MetaData(), *columns, Column(ROW_HASH_COLUMN, BigInteger))
+
+
+def convert_chunk(chunk: pd.DataFrame, profiles: List[ColumnProfile]) -> pd.DataFrame:
+    converted = {}
+    for profile in profiles:
+        converted.update(profile.convert(chunk[profile.name]))
+    period = period_profile(profiles)
+    if period is not None:
+        dates = pd.to_datetime(converted[date_column_name(period.name)])
+        converted[YEAR_COLUMN] = dates.dt.year.astype("Int64")
+        converted[QUARTER_COLUMN] = dates.dt.quarter.astype("Int64")
+    # Хеш детерминирован между запусками; uint64 хранится как знаковый BIGINT
+    converted[ROW_HASH_COLUMN] = pd.util.hash_pandas_object(chunk, index=False).astype("int64")
+    return pd.DataFrame(converted)
+
+
+def _quote(conn: Connection, name: str) -> str:
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def _copy_chunk(conn: Connection, table: Table, df: pd.DataFrame) -> None:
+    """Загрузка чанка в PostgreSQL через COPY FROM STDIN в текущей транзакции."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+    columns = ", ".join(_quote(conn, c.name) for c in table.columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {_quote(conn, table.name)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_chunk(conn: Connection, table: Table, df: pd.DataFrame) -> None:
+    """Загрузка чанка через executemany (SQLite и другие СУБД без COPY)."""
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    conn.execute(table.insert(), records)
+
+
+def load_csv(conn: Connection, table: Table, csv_path: str, profiles: List[ColumnProfile], chunk_size: int) -> int:
+    """Второй проход: типизирует чанки и загружает их в таблицу. Возвращает число строк."""
+    load_chunk = _copy_chunk if conn.dialect.name == "postgresql" else _insert_chunk
+    rows = 0
+    for chunk in read_chunks(csv_path, chunk_size):
+        df = convert_chunk(chunk, profiles)
+        load_chunk(conn, table, df)
+        rows += len(df)
+        print(f"  loaded {rows} rows")
+    return rows
+
+
+def swap_tables(conn: Connection, table_name: str, new_table_name: str) -> None:
+    """Подменяет таблицу новой в текущей транзакции: читатели видят либо старые, либо новые данные."""
+    old_table_name = f"{table_name}__old"
+    conn.execute(text(f"DROP TABLE IF EXISTS {_quote(conn, old_table_name)}"))
+    if inspect(conn).has_table(table_name):
+        conn.execute(text(f"ALTER TABLE {_quote(conn, table_name)} RENAME TO {_quote(conn, old_table_name)}"))
+    conn.execute(text(f"ALTER TABLE {_quote(conn, new_table_name)} RENAME TO {_quote(conn, table_name)}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {_quote(conn, old_table_name)}"))
+
+
+def stamp_data_version(conn: Connection, table_name: str) -> str:
+    """Записывает новую версию данных таблицы в той же транзакции, что и загрузка."""
+    versions = Table(
+        DATA_VERSIONS_TABLE, MetaData(),
+        Column("table_name", Text, primary_key=True),
+        Column("version", Text, nullable=False),
+        Column("updated_at", Text, nullable=False),
+    )
+    versions.create(conn, checkfirst=True)
+    version = uuid.uuid4().hex
+    conn.execute(text(
+        f"INSERT INTO {_quote(conn, DATA_VERSIONS_TABLE)} (table_name, version, updated_at) "
+        "VALUES (:table_name, :version, :updated_at) "
+        "ON CONFLICT (table_name) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at"
+    ), {"table_name": table_name, "version": version, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    return version
+
+
+def drop_yearly(conn: Connection, table_name: str) -> None:
+    kind = "MATERIALIZED VIEW" if conn.dialect.name == "postgresql" else "TABLE"
+    conn.execute(text(f"DROP {kind} IF EXISTS {_quote(conn, yearly_table_name(table_name))}"))
+
+
+def provision(conn: Connection, table_name: str, profiles: List[ColumnProfile], key_columns: List[str]) -> None:
+    """
+    Индексы и агрегаты под типичные запросы generate_sql: фильтр по компании и году
+    (`LIKE '%YYYY'` переписывается в `"year" = YYYY` перед выполнением) и годовые суммы.
+    Создает B-tree индексы (группы, year) и (year) и сводную таблицу `<table>_yearly`
+    (в PostgreSQL — материализованное представление) с суммами денежных показателей
+    по группам и годам; на нее sql_rewriter.py переводит запросы из одних SUM по этим колонкам.
+    """
+    period = period_profile(profiles)
+    if period is None:
+        print("No date column, provisioning skipped")
+        return
+    q = lambda name: _quote(conn, name)
+    names = {p.name for p in profiles}
+    groups = [c for c in key_columns if c != period.name and c in names]
+    group_list = ", ".join(q(c) for c in groups + [YEAR_COLUMN])
+
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {q(f'ix_{table_name}_year')} ON {q(table_name)} ({q(YEAR_COLUMN)})"))
+    if groups:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {q(f'ix_{table_name}_groups_year')} ON {q(table_name)} ({group_list})"
+        ))
+
+    summary = yearly_table_name(table_name)
+    sums = ", ".join(f"SUM({q(p.name)}) AS {q(p.name)}" for p in profiles if p.additive and p.name not in groups)
+    kind = "MATERIALIZED VIEW" if conn.dialect.name == "postgresql" else "TABLE"
+    drop_yearly(conn, table_name)
+    conn.execute(text(
+        f"CREATE {kind} {q(summary)} AS SELECT {group_list}, COUNT(*) AS {q(YEARLY_PERIODS_COLUMN)}"
+        f"{', ' + sums if sums else ''} FROM {q(table_name)} GROUP BY {group_list}"
+    ))
+    conn.execute(text(f"CREATE INDEX {q(f'ix_{summary}')} ON {q(summary)} ({group_list})"))
+    print(f"Provisioned indexes and {summary}")
+
+
+def replace_table(engine, csv_path: str, table_name: str, key_columns: List[str], chunk_size: int,
+                  provision_enabled: bool = True) -> int:
+    """
+    Полная перезагрузка: файл грузится в новую типизированную таблицу, которая
+    в той же транзакции подменяет старую. При ошибке старая таблица не меняется.
+    """
+    profiles = profile_csv(csv_path, chunk_size)
+    print("Column types: " + ", ".join(f"{p.name}={p.kind}" for p in profiles))
+    new_table = build_table(f"{table_name}__new", profiles)
+    with engine.begin() as conn:
+        new_table.drop(conn, checkfirst=True)
+        new_table.create(conn)
+        rows = load_csv(conn, new_table, csv_path, profiles, chunk_size)
+        # Сводная таблица зависит от старой таблицы, поэтому удаляется до подмены
+        drop_yearly(conn, table_name)
+        swap_tables(conn, table_name, new_table.name)
+        if provision_enabled:
+            provision(conn, table_name, profiles, key_columns)
+        stamp_data_version(conn, table_name)
+    return rows
+
+
+def upsert_table(engine, csv_path: str, table_name: str, key_columns: List[str], chunk_size: int,
+                 provision_enabled: bool = True) -> Dict[str, int]:
+    """
+    Инкрементальная загрузка: файл грузится в staging-таблицу, по хешу строк
+    определяются новые и измененные строки, и в целевую таблицу применяются только
+    они через INSERT ... ON CONFLICT по ключу. Строки, которых нет в файле, не удаляются.
+    """
+    profiles = profile_csv(csv_path, chunk_size)
+    missing = [c for c in key_columns if c not in {p.name for p in profiles}]
+    if missing:
+        raise ValueError(f"Key columns not found in CSV: {', '.join(missing)}")
+
+    staging = build_table(f"{table_name}__staging", profiles)
+    target = build_table(table_name, profiles)
+    with engine.begin() as conn:
+        q = lambda name: _quote(conn, name)
+        target.create(conn, checkfirst=True)
+        existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+        added = [c for c in target.columns if c.name not in existing]
+        for column in added:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {q(table_name)} ADD COLUMN {q(column.name)} {column_type}"))
+        if added:
+            # Новые колонки нужно заполнить у всех строк: сбрасываем хеши, чтобы все строки обновились
+            print("Added columns: " + ", ".join(c.name for c in added))
+            conn.execute(text(f"UPDATE {q(table_name)} SET {q(ROW_HASH_COLUMN)} = NULL"))
+        keys = ", ".join(q(c) for c in key_columns)
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {q(f'ux_{table_name}_key')} ON {q(table_name)} ({keys})"
+        ))
+        staging.drop(conn, checkfirst=True)
+        staging.create(conn)
+        total = load_csv(conn, staging, csv_path, profiles, chunk_size)
+
+        duplicates = conn.execute(text(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {q(staging.name)} GROUP BY {keys} HAVING COUNT(*) > 1) d"
+        )).scalar()
+        if duplicates:
+            raise ValueError(f"CSV contains {duplicates} duplicated keys ({', '.join(key_columns)})")
+
+        join = " AND ".join(f"t.{q(c)} = s.{q(c)}" for c in key_columns)
+        counts = conn.execute(text(f"""
+            SELECT
+                SUM(CASE WHEN t.{q(key_columns[0])} IS NULL THEN 1 ELSE 0 END),
+                SUM(CASE WHEN t.{q(key_columns[0])} IS NOT NULL
+                          AND (t.{q(ROW_HASH_COLUMN)} IS NULL OR t.{q(ROW_HASH_COLUMN)} <> s.{q(ROW_HASH_COLUMN)})
+                         THEN 1 ELSE 0 END)
+            FROM {q(staging.name)} s LEFT JOIN {q(table_name)} t ON {join}
+        """)).one()
+        inserted, updated = int(counts[0] or 0), int(counts[1] or 0)
+
+        columns = [c.name for c in target.columns]
+        column_list = ", ".join(q(c) for c in columns)
+        updates = ", ".join(f"{q(c)} = excluded.{q(c)}" for c in columns if c not in key_columns)
+        conn.execute(text(f"""
+            INSERT INTO {q(table_name)} ({column_list})
+            SELECT {", ".join(f"s.{q(c)}" for c in columns)} FROM {q(staging.name)} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {q(table_name)} t WHERE {join} AND t.{q(ROW_HASH_COLUMN)} = s.{q(ROW_HASH_COLUMN)}
+            )
+            ON CONFLICT ({keys}) DO UPDATE SET {updates}
+        """))
+        staging.drop(conn)
+        # Без provision прежние годовые суммы устарели бы: sql_rewriter.py читал бы из них старые данные
+        drop_yearly(conn, table_name)
+        if provision_enabled:
+            provision(conn, table_name, profiles, key_columns)
+        if inserted or updated:
+            stamp_data_version(conn, table_name)
+    return {"rows": total, "inserted": inserted, "updated": updated, "unchanged": total - inserted - updated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a CSV file into the database as a typed table.")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="Path to the CSV file")
+    parser.add_argument("--table", default=DEFAULT_TABLE, help="Target table name")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk")
+    parser.add_argument("--mode", choices=["replace", "upsert"], default="replace",
+                        help="replace: reload the whole table; upsert: apply only new and changed rows")
+    parser.add_argument("--key", action="append", dest="keys",
+                        help=f"Key column, repeatable (default: {', '.join(DEFAULT_KEY_COLUMNS)}). "
+                             "Used for upsert and for the provisioned indexes")
+    parser.add_argument("--skip-provision", action="store_true",
+                        help="Do not create the year indexes and the yearly summary")
+    args = parser.parse_args()
+
+    DATABASE_URL = os.getenv("DATABASE_URL")
+
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL is not set in .env")
+
+    engine = create_engine(DATABASE_URL)
+
+    key_columns = args.keys or DEFAULT_KEY_COLUMNS
+    started = time.perf_counter()
+    if args.mode == "upsert":
+        counts = upsert_table(engine, args.csv, args.table, key_columns, args.chunk_size, not args.skip_provision)
+        print(
+            f"CSV upserted successfully! {counts['rows']} rows: {counts['inserted']} inserted, "
+            f"{counts['updated']} updated, {counts['unchanged']} unchanged "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+    else:
+        rows = replace_table(engine, args.csv, args.table, key_columns, args.chunk_size, not args.skip_provision)
+        print(f"CSV uploaded successfully! {rows} rows in {time.perf_counter() - started:.1f}s")
 
-df.to_sql(
-    "top_12_german_companies",  
-    engine,
-    if_exists="replace",  
-    index=False
-)
 
-print("CSV uploaded successfully!")
+if __name__ == "__main__":
+    main()
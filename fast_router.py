@@ -0,0 +1,327 @@
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config import logger, FAST_PATH_ENABLED, FAST_PATH_MIN_CONFIDENCE
+from metadata_registry import TableMetadata
+from query_cache import get_alias_resolver
+from utils import normalize_text, stem_word, QUERY_STOPWORDS
+
+# Потоковые показатели: за год без указания квартала пользователь ждет годовую сумму
+# (правило 8 промпта generate_sql). Остальные показатели выводятся по периодам.
+FLOW_METRICS = {"Revenue", "Net Income"}
+
+_YEAR_RE = re.compile(r"(?<!\d)((?:19|20)\d{2})(?!\d)")
+_QUARTER_RE = re.compile(
+    r"(?<!\w)(?:q([1-4])|([1-4])\s*(?:й|ый|ой|th|st|nd|rd)?\s*(?:квартал\w*|quarter)"
+    r"|(перв|втор|трет|четверт)\w*\s+квартал\w*)(?!\w)"
+)
+_QUARTER_WORDS = {"перв": 1, "втор": 2, "трет": 3, "четверт": 4}
+
+_SUM_WORDS = ("сумм", "общ", "итог", "совокупн", "total", "sum")
+_PER_GROUP_PHRASES = ("кажд", "всем компаниям", "по компаниям", "each", "per company", "every")
+_ALL_GROUPS_WORDS = ("всех", "все", "всем", "all")
+_GROUP_WORDS = ("компани", "compan")
+# Слова, которые означают более сложную логику, чем у шаблонов: отдаем запрос LLM
+_UNSUPPORTED_PREFIXES = (
+    "средн", "avg", "average", "максим", "минимал", "maxim", "minim", "больш", "меньш", "рост",
+    "сравн", "compar", "изменен", "динамик", "разниц", "лучш", "худш", "кроме", "полугод", "месяц",
+)
+_UNSUPPORTED_WORDS = {
+    "max", "min", "топ", "top", "кто", "чем", "не", "нет", "без", "half", "vs",
+    "между", "после", "до", "between", "after", "before", "since", "until", "till",
+}
+# Диапазоны ("с 2019 по 2021", "2019-2021") и разбивка по периодам ("по кварталам", "помесячно"):
+# шаблоны умеют только перечисление лет, а разбивка по периодам не совпадает с годовой суммой
+_UNSUPPORTED_PATTERNS = re.compile(
+    r"(?<!\w)(?:с|со|from)\s+(?:\S+\s+){0,3}?(?:по|to)(?!\w)"
+    r"|(?<!\w)(?:по|кажд\w*|each|every|per|by)\s+(?:квартал|месяц|год|полугод|quarter|month|year)"
+    r"|(?<!\w)(?:помесячн|ежемесячн|поквартальн|ежекварт|погодов|ежегодн|monthly|quarterly|yearly|annually|trend)"
+)
+_YEAR_RANGE_RE = re.compile(r"(?<!\d)(?:19|20)\d{2}\s*[-–—]\s*(?:19|20)\d{2}(?!\d)")
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _parse_date(value: str) -> Optional[datetime]:
+    for fmt in ("%m/%d/%Y", "%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class TableRules:
+    """Правила разбора запросов для одной версии метаданных таблицы."""
+
+    def __init__(self, metadata: TableMetadata):
+        self.metadata = metadata
+        catalog = metadata.catalog
+
+        # Колонка с датами определяется по значениям каталога, остальные колонки каталога — группы
+        self.period_column: Optional[str] = None
+        self.period_dates: Dict[str, datetime] = {}
+        self.group_columns: List[str] = []
+        for column, values in catalog.items():
+            dates = {value: _parse_date(value) for value in values}
+            if values and all(dates.values()) and self.period_column is None:
+                self.period_column = column
+                self.period_dates = dates
+            else:
+                self.group_columns.append(column)
+
+        # Показатели — все колонки схемы, которые не являются измерениями из каталога
+        self.metric_labels: Dict[str, str] = {}
+        phrases: Dict[Tuple[str, ...], set] = {}
+        words: Dict[str, set] = {}
+        for column, info in metadata.schema.get("columns", {}).items():
+            if column in catalog:
+                continue
+            aliases = (info or {}).get("aliases") or {}
+            self.metric_labels[column] = aliases.get("ru") or column
+            for name in [column, *aliases.values()]:
+                tokens = [t for t in normalize_text(name).split() if t != "%"]
+                if not tokens:
+                    continue
+                phrases.setdefault(tuple(stem_word(t) for t in tokens), set()).add(column)
+                # Из составного алиаса отдельно ищется только главное (последнее) слово: определение
+                # ("чистая" в "чистая прибыль") относится к любому показателю — "чистые активы", "чистый капитал"
+                head = tokens[-1]
+                if len(tokens) > 1 and len(head) >= 5 and head not in QUERY_STOPWORDS:
+                    words.setdefault(stem_word(head), set()).add(column)
+
+        # Главные слова составных алиасов ("прибыль" из "чистая прибыль") — только если однозначны
+        for stem, columns in words.items():
+            if len(columns) == 1:
+                phrases.setdefault((stem,), set()).update(columns)
+        self.metric_phrases = sorted(
+            ((p, next(iter(c))) for p, c in phrases.items() if len(c) == 1),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def find_metrics(self, tokens: List[str], consumed: List[bool]) -> List[str]:
+        """Находит показатели в запросе (длинные алиасы первыми), в порядке упоминания."""
+        found: Dict[str, int] = {}
+        for phrase, column in self.metric_phrases:
+            n = len(phrase)
+            for i in range(len(tokens) - n + 1):
+                if any(consumed[i:i + n]):
+                    continue
+                if all(
+                    tokens[i + k].startswith(stem) and len(tokens[i + k]) - len(stem) <= 4
+                    for k, stem in enumerate(phrase)
+                ):
+                    for k in range(n):
+                        consumed[i + k] = True
+                    found.setdefault(column, i)
+        return sorted(found, key=found.get)
+
+
+class FastPathRouter:
+    """
+    Детерминированный разбор типовых вопросов (показатель X компании Y за год Z,
+    сумма показателя за год, показатель по каждой компании) без обращения к LLM.
+    Возвращает результат в том же формате, что и generate_sql, или None, если не уверен.
+    """
+
+    def __init__(self, min_confidence: float):
+        self.min_confidence = min_confidence
+        self._rules: Dict[str, TableRules] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+
+    def get_rules(self, metadata: TableMetadata) -> TableRules:
+        """Правила разбора для версии метаданных (строятся один раз на версию)."""
+        key = f"{metadata.table_name}:{metadata.version}"
+        rules = self._rules.get(key)
+        if rules is None:
+            rules = TableRules(metadata)
+            with self._lock:
+                for stale in [k for k in self._rules if k.startswith(f"{metadata.table_name}:")]:
+                    self._rules.pop(stale, None)
+                self._rules[key] = rules
+        return rules
+
+    def route(self, user_query: str, metadata: TableMetadata) -> Optional[Dict]:
+        result = self._parse(user_query, metadata)
+        if result is None:
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        logger.info(f"Быстрый путь: SQL построен без LLM (уверенность {result['confidence']}).")
+        return result
+
+    def _parse(self, user_query: str, metadata: TableMetadata) -> Optional[Dict]:
+        rules = self.get_rules(metadata)
+        if rules.period_column is None or not rules.group_columns:
+            return None
+
+        if _YEAR_RANGE_RE.search(user_query):
+            return None
+        normalized = normalize_text(user_query)
+        if any(t in _UNSUPPORTED_WORDS or t.startswith(_UNSUPPORTED_PREFIXES) for t in normalized.split()):
+            return None
+        if _UNSUPPORTED_PATTERNS.search(normalized):
+            return None
+
+        # Значения каталога (компании, конкретные периоды) вырезаем из текста
+        groups: Dict[str, List[str]] = {}
+        exact_periods: List[str] = []
+        remainder = normalized
+        for column, canonical, fragment in get_alias_resolver(metadata).find(normalized):
+            if column == rules.period_column:
+                exact_periods.append(canonical)
+            else:
+                groups.setdefault(column, [])
+                if canonical not in groups[column]:
+                    groups[column].append(canonical)
+            remainder = re.sub(rf"(?<!\w){re.escape(fragment)}(?!\w)", " ", remainder, count=1)
+        if len(groups) > 1:
+            return None
+        group_column = next(iter(groups), rules.group_columns[0])
+        group_values = groups.get(group_column, [])
+
+        quarters = []
+        for match in _QUARTER_RE.finditer(remainder):
+            number = match.group(1) or match.group(2)
+            quarters.append(int(number) if number else _QUARTER_WORDS[match.group(3)])
+        remainder = _QUARTER_RE.sub(" ", remainder)
+        years = sorted({int(y) for y in _YEAR_RE.findall(remainder)})
+        remainder = _YEAR_RE.sub(" ", remainder)
+
+        tokens = remainder.split()
+        consumed = [False] * len(tokens)
+        metrics = rules.find_metrics(tokens, consumed)
+        if not metrics:
+            return None
+
+        wants_sum = any(t.startswith(_SUM_WORDS) for t in tokens)
+        per_group = any(p in remainder for p in _PER_GROUP_PHRASES)
+        for i, token in enumerate(tokens):
+            if (
+                token.startswith(_SUM_WORDS)
+                or token.startswith(("кажд", "each", "every", "per") + _GROUP_WORDS) or token in _ALL_GROUPS_WORDS
+            ):
+                consumed[i] = True
+
+        # Уверенность — доля значимых слов запроса, которые удалось объяснить. Служебные слова
+        # не учитываются ни в числителе, ни в знаменателе, иначе "вода" в вопросе завышает долю.
+        significant = [i for i, token in enumerate(tokens) if token not in QUERY_STOPWORDS and token != "%"]
+        confidence = round(sum(consumed[i] for i in significant) / len(significant), 2) if significant else 1.0
+        if confidence < self.min_confidence:
+            return None
+
+        periods = self._resolve_periods(rules, years, quarters, exact_periods)
+        if periods is False:
+            return None
+
+        return self._build(rules, metrics, group_column, group_values, years, periods,
+                           wants_sum, per_group, confidence)
+
+    @staticmethod
+    def _resolve_periods(rules: TableRules, years: List[int], quarters: List[int], exact_periods: List[str]):
+        """Возвращает список точных периодов, None (фильтр по годам) или False (не уверены)."""
+        if exact_periods:
+            return None if quarters or years else sorted(set(exact_periods))
+        if not quarters:
+            return None
+        if not years:
+            return False
+        return sorted(
+            value for value, date in rules.period_dates.items()
+            if date.year in years and (date.month - 1) // 3 + 1 in quarters
+        ) or False
+
+    def _build(self, rules: TableRules, metrics: List[str], group_column: str, group_values: List[str],
+               years: List[int], periods: Optional[List[str]], wants_sum: bool, per_group: bool,
+               confidence: float) -> Optional[Dict]:
+        table = _quote_identifier(rules.metadata.table_name)
+        period = _quote_identifier(rules.period_column)
+        group = _quote_identifier(group_column)
+
+        conditions = []
+        if group_values:
+            if len(group_values) == 1:
+                conditions.append(f"{group} = {_quote_literal(group_values[0])}")
+            else:
+                conditions.append(f"{group} IN ({', '.join(_quote_literal(v) for v in group_values)})")
+        if periods:
+            conditions.append(
+                f"{period} = {_quote_literal(periods[0])}" if len(periods) == 1
+                else f"{period} IN ({', '.join(_quote_literal(p) for p in periods)})"
+            )
+        elif years:
+            likes = [f"{period} LIKE '%{year}'" for year in years]
+            conditions.append(likes[0] if len(likes) == 1 else f"({' OR '.join(likes)})")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        labels = ", ".join(f"«{rules.metric_labels[m]}»" for m in metrics)
+        scope = f" у {', '.join(group_values)}" if group_values else ""
+        when = f" за {', '.join(periods)}" if periods else (f" за {', '.join(map(str, years))} год" if years else "")
+        single_flow = len(metrics) == 1 and metrics[0] in FLOW_METRICS
+
+        if per_group and not group_values:
+            # Шаблон 4: показатель по каждой компании
+            if not single_flow:
+                return None
+            alias = _quote_identifier(f"Total {metrics[0]}")
+            sql = (f"SELECT {group}, SUM({_quote_identifier(metrics[0])}) AS {alias} FROM {table}{where} "
+                   f"GROUP BY {group} ORDER BY {alias} DESC")
+            clarified = f"Каково суммарное значение показателя {labels} для каждой компании{when}?"
+        elif not group_values:
+            # Шаблон 3: сумма по всем компаниям — только при явной просьбе и за один год
+            if not (wants_sum and single_flow and len(years) == 1 and not periods):
+                return None
+            alias = _quote_identifier(f"Total {metrics[0]}")
+            sql = f"SELECT SUM({_quote_identifier(metrics[0])}) AS {alias} FROM {table}{where}"
+            clarified = f"Каково суммарное значение показателя {labels} по всем компаниям{when}?"
+        elif single_flow and len(years) == 1 and not periods and len(group_values) == 1:
+            # Шаблоны 6 и 3: годовая сумма потокового показателя
+            alias = _quote_identifier(f"Total Annual {metrics[0]}")
+            sql = f"SELECT SUM({_quote_identifier(metrics[0])}) AS {alias} FROM {table}{where}"
+            clarified = f"Каково суммарное годовое значение показателя {labels}{scope}{when}?"
+        else:
+            if wants_sum:
+                return None
+            # Шаблоны 1, 2 и 5: значения показателей по периодам
+            columns = ([group] if len(group_values) != 1 else []) + [period]
+            columns += [_quote_identifier(m) for m in metrics]
+            order = f"{period}" if years or periods else f"{period} DESC"
+            if len(group_values) != 1:
+                order = f"{group}, {order}"
+            sql = f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY {order}"
+            clarified = f"Какие значения показателей {labels} были{scope}{when or ' за все периоды'}?"
+
+        return {
+            "sql": sql,
+            "clarified_prompt": clarified,
+            "metrics": metrics,
+            "groups": group_values,
+            "years": years,
+            "units": ["%"] if any("%" in m for m in metrics) else [],
+            "source": "fast_path",
+            "confidence": confidence,
+        }
+
+    def stats(self) -> Dict:
+        total = self.hits + self.fallbacks
+        return {
+            "enabled": FAST_PATH_ENABLED,
+            "min_confidence": self.min_confidence,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+fast_router = FastPathRouter(FAST_PATH_MIN_CONFIDENCE)
@@ -0,0 +1,516 @@
+import abc
+import json
+import sys
+import time
+import random
+import asyncio
+import httpx
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+from metrics import LLM_REQUEST_DURATION, record_llm_usage
+from resources import get_http_client, get_openai_client
+from config import (
+    logger,
+    LLM_PROVIDER, CUSTOM_LLM_API_BASE, CUSTOM_LLM_MODEL, CUSTOM_LLM_API_KEY, OPENAI_API_KEY, OPENAI_MODEL,
+    LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST, LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_ATTEMPT_TIMEOUT,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY,
+    LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE, LLM_BREAKER_SLOW_CALL_SECONDS,
+    LLM_BREAKER_OPEN_SECONDS, LLM_BREAKER_HALF_OPEN_CALLS,
+)
+
+
+class TokenBucket:
+    """Простой асинхронный token bucket: не более `rate` запросов в секунду со всплеском до `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class LatencyWindow:
+    """Скользящее окно последних задержек для расчета перцентилей."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class CircuitOpenError(Exception):
+    """Провайдер временно исключен из маршрутизации автоматом защиты."""
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты провайдера с состояниями closed / open / half_open.
+
+    Считает долю неудачных вызовов за последние `window` секунд; медленные вызовы
+    (дольше `slow_call_seconds`) тоже считаются неудачными. При превышении порога цепь
+    размыкается на `open_seconds`, затем пропускает несколько пробных вызовов:
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window: float, min_calls: int, error_rate: float,
+                 slow_call_seconds: float, open_seconds: float, half_open_calls: int):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._trials = 0
+        self.times_opened = 0
+
+    def _current_state(self) -> str:
+        # Переход в half_open по истечении open_seconds. Повторно тот же таймаут дает новые
+        # пробные вызовы, если прежние так и не завершились (например, были отменены).
+        if self.state != self.CLOSED and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            self._opened_at = time.monotonic()
+            self._trials = 0
+        return self.state
+
+    def is_available(self) -> bool:
+        """Можно ли направлять запросы провайдеру (без резервирования пробного вызова)."""
+        state = self._current_state()
+        return state == self.CLOSED or (state == self.HALF_OPEN and self._trials < self.half_open_calls)
+
+    def acquire(self) -> bool:
+        """Резервирует право на вызов; в half_open — один из пробных вызовов."""
+        state = self._current_state()
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._trials < self.half_open_calls:
+            self._trials += 1
+            return True
+        return False
+
+    def record(self, success: bool, latency: float) -> None:
+        now = time.monotonic()
+        failed = not success or latency >= self.slow_call_seconds
+        state = self._current_state()
+        if state == self.HALF_OPEN:
+            if failed:
+                self._open(now)
+            else:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                logger.info("Автомат защиты LLM: цепь снова замкнута.")
+            return
+        if state == self.OPEN:
+            return
+
+        self._outcomes.append((now, failed))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+        if len(self._outcomes) >= self.min_calls:
+            failures = sum(1 for _, f in self._outcomes if f)
+            if failures / len(self._outcomes) >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.times_opened += 1
+        logger.warning(f"Автомат защиты LLM: цепь разомкнута на {self.open_seconds:.0f} с.")
+
+    def stats(self) -> Dict:
+        failures = sum(1 for _, f in self._outcomes if f)
+        return {
+            "state": self._current_state(),
+            "window_calls": len(self._outcomes),
+            "window_error_rate": round(failures / len(self._outcomes), 4) if self._outcomes else 0.0,
+            "times_opened": self.times_opened,
+        }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Значение заголовка Retry-After (в секундах), если провайдер его прислал."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Повторяем только временные ошибки: 429, 5xx, таймауты и сетевые сбои."""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    # SDK OpenAI импортируется лениво: если его нет в процессе, его ошибок быть не может
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return False
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _is_request_error(error: Exception) -> bool:
+    """Ошибка в самом запросе (4xx, кроме 429 и ошибок ключа/модели), а не сбой провайдера."""
+    status_code = None
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+    else:
+        openai = sys.modules.get("openai")
+        if openai is not None and isinstance(error, openai.APIStatusError):
+            status_code = error.status_code
+    return status_code is not None and 400 <= status_code < 500 and status_code not in (401, 403, 404, 429)
+
+
+class LLMProvider(abc.ABC):
+    """
+    Клиент одного LLM провайдера: ограничение параллельных вызовов (семафор),
+    ограничение частоты (token bucket), таймаут на попытку, повторы
+    с экспоненциальной задержкой и джиттером на 429/5xx и автомат защиты.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.bucket = TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST)
+        self.latencies = LatencyWindow()
+        self.breaker = CircuitBreaker(
+            LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE,
+            LLM_BREAKER_SLOW_CALL_SECONDS, LLM_BREAKER_OPEN_SECONDS, LLM_BREAKER_HALF_OPEN_CALLS,
+        )
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+
+    @abc.abstractmethod
+    async def _complete_once(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        """Одна попытка вызова без повторов: возвращает текст ответа."""
+
+    @abc.abstractmethod
+    def _stream_once(self, messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+        """Одна попытка потокового вызова без повторов: асинхронный генератор токенов."""
+
+    def _start_attempt(self) -> float:
+        if not self.breaker.acquire():
+            raise CircuitOpenError(f"Цепь провайдера '{self.name}' разомкнута.")
+        self.calls += 1
+        return time.perf_counter()
+
+    def _record(self, started: float, error: Optional[Exception] = None) -> None:
+        latency = time.perf_counter() - started
+        LLM_REQUEST_DURATION.labels(provider=self.name, outcome="ok" if error is None else "error").observe(latency)
+        if error is None:
+            self.latencies.add(latency)
+            self.breaker.record(True, latency)
+            return
+        self.errors += 1
+        # Ошибки конкретного запроса (400, 413, 422...) не говорят о здоровье провайдера и не учитываются.
+        # Остальное — 5xx, таймауты, неверный ключ, испорченный ответ 200 — считается отказом.
+        if not _is_request_error(error):
+            self.breaker.record(False, latency)
+
+    async def _backoff(self, attempt: int, error: Exception) -> None:
+        delay = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+        delay = max(delay, _retry_after(error) or 0.0)
+        self.retries += 1
+        logger.warning(f"[{self.name}] Временная ошибка LLM: {error!r}. Повтор через {delay:.2f} с.")
+        await asyncio.sleep(delay)
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self.semaphore:
+                await self.bucket.acquire()
+                started = self._start_attempt()
+                try:
+                    result = await asyncio.wait_for(
+                        self._complete_once(messages, temperature), timeout=LLM_ATTEMPT_TIMEOUT
+                    )
+                    self._record(started)
+                    return result
+                except asyncio.CancelledError:
+                    # Вызов отменили (например, хеджирование взяло ответ запасного): он длился не меньше
+                    # прошедшего времени. Без этой нижней оценки p95 для _hedge_delay смещается к быстрым ответам
+                    self.latencies.add(time.perf_counter() - started)
+                    raise
+                except Exception as e:
+                    self._record(started, e)
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        raise
+                    error = e
+            await self._backoff(attempt, error)
+        raise RuntimeError("unreachable")
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+        """
+        Потоковый вызов. Таймаут и повторы применяются только до первого токена:
+        начатый ответ повторить незаметно для пользователя уже нельзя.
+        """
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self.semaphore:
+                await self.bucket.acquire()
+                started = self._start_attempt()
+                tokens = self._stream_once(messages, temperature)
+                try:
+                    first = await asyncio.wait_for(tokens.__anext__(), timeout=LLM_ATTEMPT_TIMEOUT)
+                except StopAsyncIteration:
+                    self._record(started)
+                    return
+                except Exception as e:
+                    self._record(started, e)
+                    await tokens.aclose()
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        raise
+                    error = e
+                else:
+                    try:
+                        yield first
+                        async for token in tokens:
+                            yield token
+                    except Exception as e:
+                        self._record(started, e)
+                        raise
+                    finally:
+                        await tokens.aclose()
+                    self._record(started)
+                    return
+            await self._backoff(attempt, error)
+
+    def stats(self) -> Dict:
+        latencies = {}
+        for p in (50, 95, 99):
+            value = self.latencies.percentile(p)
+            latencies[f"latency_p{p}_ms"] = round(value * 1000, 1) if value is not None else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            **latencies,
+            "circuit": self.breaker.stats(),
+        }
+
+
+class CustomLLMProvider(LLMProvider):
+    """Кастомный OpenAI-совместимый провайдер (CUSTOM_LLM_API_BASE) через общий httpx клиент."""
+
+    def _request(self, messages: List[Dict[str, str]], temperature: float, stream: bool):
+        headers = {"Content-Type": "application/json"}
+        if CUSTOM_LLM_API_KEY:
+            headers["Authorization"] = f"Bearer {CUSTOM_LLM_API_KEY}"
+
+        payload = {
+            "messages": messages,
+            "model": CUSTOM_LLM_MODEL,
+            "temperature": temperature,
+            "max_completion_tokens": 1024,
+            "stream": stream
+        }
+        return f"{CUSTOM_LLM_API_BASE.rstrip('/')}/chat/completions", payload, headers
+
+    async def _complete_once(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        logger.info(f"Вызов кастомного LLM: {CUSTOM_LLM_MODEL}")
+        url, payload, headers = self._request(messages, temperature, stream=False)
+        response = await get_http_client().post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        record_llm_usage(self.name, data.get("usage"))
+        return data["choices"][0]["message"]["content"]
+
+    async def _stream_once(self, messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+        logger.info(f"Потоковый вызов кастомного LLM: {CUSTOM_LLM_MODEL}")
+        url, payload, headers = self._request(messages, temperature, stream=True)
+        async with get_http_client().stream("POST", url, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[len("data:"):].strip()
+                if chunk == "[DONE]":
+                    break
+                data = json.loads(chunk)
+                # Итоговый чанк OpenAI-совместимых серверов может содержать usage
+                record_llm_usage(self.name, data.get("usage"))
+                choices = data.get("choices") or [{}]
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    yield token
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI через официальный асинхронный клиент."""
+
+    async def _complete_once(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        logger.info(f"Вызов OpenAI LLM: {OPENAI_MODEL}")
+        response = await get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            temperature=temperature
+        )
+        record_llm_usage(self.name, response.usage)
+        return response.choices[0].message.content
+
+    async def _stream_once(self, messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+        logger.info(f"Потоковый вызов OpenAI LLM: {OPENAI_MODEL}")
+        stream = await get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            # Последний чанк придет с usage и пустым choices
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            record_llm_usage(self.name, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+# --- Реестр провайдеров в порядке приоритета ---
+providers: Dict[str, LLMProvider] = {}
+if LLM_PROVIDER == "custom" and CUSTOM_LLM_API_BASE and CUSTOM_LLM_MODEL:
+    providers["custom"] = CustomLLMProvider("custom")
+if OPENAI_API_KEY:
+    providers["openai"] = OpenAIProvider("openai")
+
+
+def _healthy_providers() -> List[LLMProvider]:
+    """Провайдеры в порядке приоритета, кроме тех, чья цепь сейчас разомкнута."""
+    return [provider for provider in providers.values() if provider.breaker.is_available()]
+
+
+def _hedge_delay(provider: LLMProvider) -> float:
+    """
+    Через сколько секунд без ответа запускать запасного провайдера: p95 основного в пределах [min, max].
+    Отмененные хеджированием вызовы попадают в окно задержек нижней оценкой своей длительности.
+    """
+    observed = provider.latencies.percentile(LLM_HEDGE_PERCENTILE) if len(provider.latencies) >= 20 else None
+    delay = observed if observed is not None else LLM_HEDGE_MAX_DELAY
+    return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, delay))
+
+
+async def _hedged_completion(primary: LLMProvider, secondary: LLMProvider,
+                             messages: List[Dict[str, str]], temperature: float) -> str:
+    """
+    Хеджированный запрос: если основной провайдер не ответил за свой p95,
+    параллельно запускается запасной, и берется первый успешный ответ.
+    """
+    primary_task = asyncio.create_task(primary.complete(messages, temperature))
+    tasks = {primary_task}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=_hedge_delay(primary))
+        if done and not primary_task.exception():
+            return primary_task.result()
+
+        logger.info(f"Хеджирование: запускаем запасного провайдера '{secondary.name}'.")
+        tasks.add(asyncio.create_task(secondary.complete(messages, temperature)))
+        if done:
+            # Основной уже упал — ждем только запасного
+            tasks.discard(primary_task)
+        while tasks:
+            finished, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                if not task.exception():
+                    return task.result()
+                logger.warning(f"Ошибка при хеджированном вызове LLM: {task.exception()!r}")
+        raise IOError("Сервис генерации текста временно недоступен.")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_llm_completion(messages: List[Dict[str, str]], temperature: float) -> str:
+    """
+    Универсальная функция для вызова LLM.
+    Пытается использовать основного провайдера, при ошибке переключается на OpenAI.
+    В режиме хеджирования запасной провайдер запускается параллельно, если основной медлит.
+    """
+    ordered = _healthy_providers()
+    if not ordered:
+        logger.error("Критическая ошибка: нет доступных LLM провайдеров (не настроены или цепь разомкнута).")
+        raise IOError("Сервис генерации текста временно недоступен.")
+
+    if LLM_HEDGE_ENABLED and len(ordered) > 1:
+        return await _hedged_completion(ordered[0], ordered[1], messages, temperature)
+
+    for provider in ordered:
+        try:
+            return await provider.complete(messages, temperature)
+        except Exception as e:
+            logger.warning(f"Ошибка при вызове LLM провайдера '{provider.name}': {e!r}")
+    logger.error("Критическая ошибка: все LLM провайдеры недоступны.")
+    raise IOError("Сервис генерации текста временно недоступен.")
+
+
+async def stream_llm_completion(messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+    """
+    Потоковый вариант get_llm_completion: отдает текст ответа по мере генерации (stream=True).
+    На следующего провайдера переключается, только если текущий упал до первого токена.
+    """
+    for provider in _healthy_providers():
+        started = False
+        try:
+            async for token in provider.stream(messages, temperature):
+                started = True
+                yield token
+            return
+        except Exception as e:
+            if started:
+                logger.error(f"Поток LLM провайдера '{provider.name}' оборвался: {e!r}")
+                raise IOError("Сервис генерации текста прервал ответ.")
+            logger.warning(f"Ошибка при потоковом вызове LLM провайдера '{provider.name}': {e!r}")
+    logger.error("Критическая ошибка: все LLM провайдеры недоступны.")
+    raise IOError("Сервис генерации текста временно недоступен.")
+
+
+def provider_stats() -> Dict:
+    """Статистика вызовов, перцентили задержек и состояние автомата защиты по каждому провайдеру."""
+    return {name: provider.stats() for name, provider in providers.items()}
+
+
+def warm_providers() -> None:
+    """Создает клиентов настроенных провайдеров заранее (импорт SDK OpenAI занимает заметное время)."""
+    if "openai" in providers:
+        get_openai_client()
+
+
+def provider_health() -> Dict[str, str]:
+    """Краткое состояние провайдеров для /health: closed / open / half_open."""
+    return {name: provider.breaker.stats()["state"] for name, provider in providers.items()}
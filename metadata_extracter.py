@@ -1,11 +1,15 @@
 import os
 import re
+import random
+import asyncio
 import pandas as pd
 import json
 import time
+import hashlib
+import codecs
 from pathlib import Path
 from tqdm import tqdm
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 
 
@@ -14,25 +18,38 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("Missing environment variable: OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
 
 #  Папки
 CSV_FOLDER = './input_data'
 OUTPUT_FOLDER = './metadata_output'
 LOG_FOLDER = './metadata_logs'
+# Кеш ответов модели по хешу промпта: при повторном запуске неизмененные таблицы и чанки не запрашиваются
+CACHE_FOLDER = './metadata_cache'
 
 Path(OUTPUT_FOLDER).mkdir(parents=True, exist_ok=True)
 Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
+Path(CACHE_FOLDER).mkdir(parents=True, exist_ok=True)
 
 #  Настройки
 CATEGORICAL_THRESHOLD = 300
 CHUNK_SIZE = 15
 RETRY_LIMIT = 5
-RETRY_DELAY = 7
-SLEEP_BETWEEN_REQUESTS = 2
+# Экспоненциальная задержка между попытками: RETRY_DELAY * 2^n (с джиттером), не больше RETRY_MAX_DELAY
+RETRY_DELAY = 2
+RETRY_MAX_DELAY = 30
+# Сколько запросов к OpenAI выполняется одновременно и сколько можно начать в минуту
+MAX_CONCURRENCY = int(os.getenv("METADATA_MAX_CONCURRENCY", "8"))
+REQUESTS_PER_MINUTE = int(os.getenv("METADATA_REQUESTS_PER_MINUTE", "300"))
 
 EXCLUDE_COLUMNS = ['year', 'report_year']
+COMPANY_COLUMNS = ['name_short_ru', 'name_short_en', 'name_abbr']
+
+# Профилирование больших CSV: файл читается один раз по PROFILE_CHUNK_ROWS строк,
+# кодировка определяется по первым SNIFF_BYTES байтам
+PROFILE_CHUNK_ROWS = 100_000
+SNIFF_BYTES = 1 << 20
 
 
 #  Удаление даты из названия файла
@@ -59,18 +76,81 @@ def load_table_descriptions(json_path):
     return table_desc_map
 
 
-#  Запрос к OpenAI с ретраями
-def ask_openai(prompt, filename_tag, model="gpt-3.5-turbo", temperature=0):
+#  Ограничение частоты: запросы начинаются не чаще REQUESTS_PER_MINUTE в минуту
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+semaphore = None
+rate_limiter = None
+cache_stats = {"hits": 0, "misses": 0}
+
+
+#  Кеш ответов: промпт содержит все входные данные (таблица, колонки, описание, чанк значений),
+#  поэтому ключ — хеш модели и промпта. Запись атомарная, чтобы прерванный запуск не оставил битый файл.
+def load_cached(cache_key):
+    cache_path = os.path.join(CACHE_FOLDER, f"{cache_key}.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cache_stats["misses"] += 1
+        return None
+    cache_stats["hits"] += 1
+    return result
+
+
+def save_cached(cache_key, result):
+    cache_path = os.path.join(CACHE_FOLDER, f"{cache_key}.json")
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+
+#  Уже сгенерированный каталог таблицы: значения из него не отправляются в модель повторно
+def load_existing_catalog(table_name):
+    catalog_path = os.path.join(OUTPUT_FOLDER, f'{table_name}_catalog.json')
+    try:
+        with open(catalog_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+#  Запрос к OpenAI с единой политикой ретраев: ошибка API, пустой ответ и невалидный JSON
+#  повторяются с экспоненциальной задержкой. Возвращает разобранный JSON или None.
+async def ask_openai(prompt, filename_tag, model="gpt-3.5-turbo", temperature=0):
+    cache_key = hashlib.sha256(f"{model}|{temperature}|{prompt}".encode("utf-8")).hexdigest()
+    cached = load_cached(cache_key)
+    if cached is not None:
+        return cached
+
     for attempt in range(RETRY_LIMIT):
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a JSON generator. Return only valid JSON. No explanations, no markdown, no comments. JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature
-            )
+            async with semaphore:
+                await rate_limiter.wait()
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": "You are a JSON generator. Return only valid JSON. No explanations, no markdown, no comments. JSON only."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=temperature
+                )
             result = response.choices[0].message.content
 
             log_file = os.path.join(LOG_FOLDER, f"{filename_tag}_attempt{attempt + 1}.txt")
@@ -78,18 +158,22 @@ def ask_openai(prompt, filename_tag, model="gpt-3.5-turbo", temperature=0):
                 f.write(result or "EMPTY RESPONSE")
 
             if result and result.strip() != "":
-                time.sleep(SLEEP_BETWEEN_REQUESTS)
-                return result
+                parsed = json.loads(result)
+                save_cached(cache_key, parsed)
+                return parsed
 
-            print(f" Empty response. Retry {attempt + 1}/{RETRY_LIMIT}")
-            time.sleep(RETRY_DELAY)
+            print(f" Empty response for {filename_tag}. Retry {attempt + 1}/{RETRY_LIMIT}")
 
+        except json.JSONDecodeError as e:
+            print(f" JSON parse error in {filename_tag} attempt {attempt + 1}: {e}")
         except Exception as e:
-            print(f" OpenAI error: {e}")
-            if attempt < RETRY_LIMIT - 1:
-                print(f" Retry in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+            print(f" OpenAI error in {filename_tag}: {e}")
+
+        if attempt < RETRY_LIMIT - 1:
+            delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
 
+    print(f" Failed {filename_tag} after {RETRY_LIMIT} attempts")
     return None
 
 
@@ -154,54 +238,104 @@ Return JSON like:
 """
 
 
+#  Каталог одной колонки: чанки значений запрашиваются параллельно
+async def process_catalog_column(table_name, col, unique_values):
+    chunks = list(chunk_list(unique_values, CHUNK_SIZE))
+
+    async def process_chunk(idx, chunk):
+        print(f" Генерация каталога {table_name}.{col} — чанк {idx + 1}/{len(chunks)}")
+        tag = f"{table_name}_{col}_chunk{idx + 1}"
+        cat_json = await ask_openai(generate_catalog_prompt(col, chunk), tag)
+        if cat_json is None:
+            return {}
+
+        chunk_file = os.path.join(LOG_FOLDER, f'{tag}_output.json')
+        with open(chunk_file, 'w', encoding='utf-8') as f:
+            json.dump(cat_json, f, indent=2, ensure_ascii=False)
+        return cat_json.get(col, {})
+
+    combined_catalog = {}
+    for result in await asyncio.gather(*(process_chunk(idx, chunk) for idx, chunk in enumerate(chunks))):
+        combined_catalog.update(result)
+    return combined_catalog
+
+
+#  Кодировка по префиксу файла: UTF-8 (с BOM или без), иначе cp1251
+def sniff_encoding(csv_path):
+    with open(csv_path, 'rb') as f:
+        prefix = f.read(SNIFF_BYTES)
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # final=False: префикс может обрываться посреди многобайтового символа
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+#  Потоковый профиль CSV: уникальные значения колонок-кандидатов в каталог и пары названий компаний.
+#  Колонка перестает отслеживаться, как только у нее больше CATEGORICAL_THRESHOLD значений,
+#  чтение прекращается, когда отслеживать больше нечего. Память ограничена размером чанка и порогом.
+def profile_csv(csv_path):
+    encoding = sniff_encoding(csv_path)
+    columns = pd.read_csv(csv_path, encoding=encoding, nrows=0).columns.tolist()
+
+    tracked = {col: {} for col in columns if col not in EXCLUDE_COLUMNS and col not in COMPANY_COLUMNS}
+    has_companies = {'name_short_ru', 'name_short_en'}.issubset(set(columns))
+    company_values = {}
+
+    usecols = list(tracked) + [col for col in COMPANY_COLUMNS if has_companies and col in columns]
+    if not usecols:
+        return columns, {}, company_values
+
+    # category хранит каждое значение чанка один раз, значения читаются как строки
+    reader = pd.read_csv(csv_path, encoding=encoding, usecols=usecols, dtype='category', chunksize=PROFILE_CHUNK_ROWS)
+    for chunk in reader:
+        for col in list(tracked):
+            values = tracked[col]
+            for value in chunk[col].dropna().unique():
+                values[value] = None
+            if len(values) > CATEGORICAL_THRESHOLD:
+                del tracked[col]
+
+        if has_companies:
+            pairs = chunk[[c for c in COMPANY_COLUMNS if c in chunk.columns]].drop_duplicates(['name_short_ru', 'name_short_en'])
+            for row in pairs.itertuples(index=False):
+                key = (row.name_short_ru, row.name_short_en)
+                if key not in company_values:
+                    abbr = getattr(row, 'name_abbr', "")
+                    company_values[key] = "" if pd.isna(abbr) else abbr
+
+        if not tracked and not has_companies:
+            break
+
+    distinct_values = {col: list(values) for col, values in tracked.items() if values}
+    return columns, distinct_values, company_values
+
+
 #  Обработка одной таблицы
-def process_csv(csv_file, table_descriptions):
+async def process_csv(csv_file, table_descriptions):
     table_name = clean_table_name(csv_file)
     csv_path = os.path.join(CSV_FOLDER, csv_file)
 
-    try:
-        df = pd.read_csv(csv_path, encoding='utf-8')
-    except:
-        df = pd.read_csv(csv_path, encoding='cp1251')
-
-    columns = df.columns.tolist()
+    columns, distinct_values, company_values = profile_csv(csv_path)
 
     table_description = table_descriptions.get(table_name, None)
 
     table_prompt = generate_table_prompt(table_name, columns, table_description)
     print(f"\n Генерация описания таблицы: {table_name}")
 
-    response = ask_openai(table_prompt, f"{table_name}_schema")
-
-    if not response:
-        print(f" Failed table description for {table_name}")
-        return None, None
-
-    try:
-        table_schema = json.loads(response)
-    except Exception as e:
-        print(f" JSON parse error in table {table_name}: {e}")
-        print(response)
-        return None, None
+    # Описание таблицы и каталоги запрашиваются одновременно
+    schema_task = asyncio.create_task(ask_openai(table_prompt, f"{table_name}_schema"))
 
     catalogs = {}
 
     #  Каталог компаний
-    if {'name_short_ru', 'name_short_en'}.issubset(set(df.columns)):
-        company_values = df[['name_short_ru', 'name_short_en']].drop_duplicates()
-
-        if 'name_abbr' in df.columns:
-            company_values['name_abbr'] = df['name_abbr']
-        else:
-            company_values['name_abbr'] = ""
-
+    if company_values:
         catalogs['company'] = {}
 
-        for _, row in company_values.iterrows():
-            ru = row['name_short_ru']
-            en = row['name_short_en']
-            abbr = row['name_abbr']
-
+        for (ru, en), abbr in company_values.items():
             key = ru
 
             catalogs['company'][key] = {
@@ -213,81 +347,76 @@ def process_csv(csv_file, table_descriptions):
                 }
             }
 
-    #  Поиск категориальных колонок (все кроме исключённых)
-    for col in df.columns:
-        if col in EXCLUDE_COLUMNS or col in ['name_short_ru', 'name_short_en', 'name_abbr']:
-            continue
-
-        nunique = df[col].nunique(dropna=True)
-        if nunique <= CATEGORICAL_THRESHOLD:
-            unique_values = df[col].dropna().astype(str).unique().tolist()
-            combined_catalog = {}
-
-            chunks = list(chunk_list(unique_values, CHUNK_SIZE))
-
-            for idx, chunk in enumerate(chunks):
-                print(f" Генерация каталога {table_name}.{col} — чанк {idx + 1}/{len(chunks)}")
-
-                prompt = generate_catalog_prompt(col, chunk)
-                tag = f"{table_name}_{col}_chunk{idx + 1}"
-
-                retry_success = False
-
-                for attempt in range(RETRY_LIMIT):
-                    cat_response = ask_openai(prompt, tag)
+    #  Категориальные колонки (все кроме исключённых) — по профилю файла
+    existing_catalog = load_existing_catalog(table_name)
+    catalog_columns = []
+    for col, unique_values in distinct_values.items():
+        known = existing_catalog.get(col)
+        known = known if isinstance(known, dict) else {}
+        # В модель уходят только значения, которых еще нет в сохраненном каталоге
+        reused = {value: known[value] for value in unique_values if value in known}
+        new_values = [value for value in unique_values if value not in known]
+        if reused:
+            print(f" Каталог {table_name}.{col}: {len(reused)} значений из сохраненного каталога, новых {len(new_values)}")
+        catalog_columns.append((col, reused, new_values))
+
+    column_catalogs = await asyncio.gather(
+        *(process_catalog_column(table_name, col, new_values) for col, _, new_values in catalog_columns)
+    )
+    for (col, reused, _), new_catalog in zip(catalog_columns, column_catalogs):
+        combined_catalog = {**reused, **new_catalog}
+        if combined_catalog:
+            catalogs[col] = combined_catalog
+
+    table_schema = await schema_task
+    if table_schema is None:
+        print(f" Failed table description for {table_name}")
+        return None, None
 
-                    if cat_response and cat_response.strip() != "":
-                        try:
-                            cat_json = json.loads(cat_response)
-                            combined_catalog.update(cat_json.get(col, {}))
+    return table_schema, catalogs
 
-                            chunk_file = os.path.join(LOG_FOLDER, f'{tag}_output.json')
-                            with open(chunk_file, 'w', encoding='utf-8') as f:
-                                json.dump(cat_json, f, indent=2, ensure_ascii=False)
 
-                            retry_success = True
-                            break
+#  Сохранение результатов одной таблицы
+def save_table(table_name, table_schema, catalogs):
+    if table_schema:
+        related_catalogs = [f"{col}_catalog.json" for col in catalogs.keys()] if catalogs else []
+        table_schema["related_catalogs"] = related_catalogs
 
-                        except Exception as e:
-                            print(f" JSON parse error in {col} chunk {idx + 1} attempt {attempt + 1}: {e}")
-                            time.sleep(RETRY_DELAY)
-                    else:
-                        print(f" Empty response for {col} chunk {idx + 1} attempt {attempt + 1}")
-                        time.sleep(RETRY_DELAY)
+        schema_path = os.path.join(OUTPUT_FOLDER, f'{table_name}_schema.json')
+        with open(schema_path, 'w', encoding='utf-8') as f:
+            json.dump(table_schema, f, indent=2, ensure_ascii=False)
 
-                if not retry_success:
-                    print(f" Failed to process {col} chunk {idx + 1} after {RETRY_LIMIT} retries")
+    if catalogs:
+        catalog_path = os.path.join(OUTPUT_FOLDER, f'{table_name}_catalog.json')
+        with open(catalog_path, 'w', encoding='utf-8') as f:
+            json.dump(catalogs, f, indent=2, ensure_ascii=False)
 
-            if combined_catalog:
-                catalogs[col] = combined_catalog
 
-    return table_schema, catalogs
+#  Основной цикл: все таблицы обрабатываются параллельно в общих лимитах MAX_CONCURRENCY и REQUESTS_PER_MINUTE
+async def main_async():
+    global semaphore, rate_limiter
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
 
-
-#  Основной цикл
-def main():
     table_descriptions = load_table_descriptions(os.path.join(CSV_FOLDER, 'table_descriptions.json'))
 
     csv_files = [f for f in os.listdir(CSV_FOLDER) if f.endswith('.csv')]
 
-    for csv_file in tqdm(csv_files, desc="Processing CSV"):
+    async def process_and_save(csv_file):
         table_name = clean_table_name(csv_file)
-        table_schema, catalogs = process_csv(csv_file, table_descriptions)
+        table_schema, catalogs = await process_csv(csv_file, table_descriptions)
+        save_table(table_name, table_schema, catalogs)
 
-        if table_schema:
-            related_catalogs = [f"{col}_catalog.json" for col in catalogs.keys()] if catalogs else []
-            table_schema["related_catalogs"] = related_catalogs
+    tasks = [asyncio.create_task(process_and_save(csv_file)) for csv_file in csv_files]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing CSV"):
+        await task
 
-            schema_path = os.path.join(OUTPUT_FOLDER, f'{table_name}_schema.json')
-            with open(schema_path, 'w', encoding='utf-8') as f:
-                json.dump(table_schema, f, indent=2, ensure_ascii=False)
+    print("\n Схема и каталоги успешно сохранены по таблицам!")
+    print(f" Кеш ответов модели: {cache_stats['hits']} попаданий, {cache_stats['misses']} запросов к модели")
 
-        if catalogs:
-            catalog_path = os.path.join(OUTPUT_FOLDER, f'{table_name}_catalog.json')
-            with open(catalog_path, 'w', encoding='utf-8') as f:
-                json.dump(catalogs, f, indent=2, ensure_ascii=False)
 
-    print("\n Схема и каталоги успешно сохранены по таблицам!")
+def main():
+    asyncio.run(main_async())
 
 
 if __name__ == "__main__":
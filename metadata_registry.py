@@ -0,0 +1,163 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from config import logger, METADATA_RELOAD_INTERVAL
+
+SCHEMA_SUFFIX = "_schema.json"
+CATALOG_SUFFIX = "_catalog.json"
+
+
+def load_json(path: str) -> Dict:
+    """Загружает JSON файл с обработкой ошибок."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"Файл не найден: {path}")
+        raise ValueError(f"Конфигурационный файл не найден: {path}")
+    except json.JSONDecodeError:
+        logger.error(f"Невалидный JSON файл: {path}")
+        raise ValueError(f"Ошибка в формате конфигурационного файла: {path}")
+
+
+@dataclass(frozen=True)
+class TableMetadata:
+    """
+    Неизменяемый снимок метаданных одной таблицы.
+    Фрагменты промпта сериализуются один раз при загрузке, а не на каждый запрос.
+    """
+    table_name: str
+    schema: Dict
+    catalog: Dict
+    schema_prompt: str
+    catalog_prompt: str
+    version: str
+    mtimes: Tuple[float, float]
+
+
+def _file_mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _build_table_metadata(table_name: str, schema_path: str, catalog_path: str) -> TableMetadata:
+    """Читает схему и каталог таблицы и готовит сериализованные фрагменты для промпта."""
+    mtimes = (_file_mtime(schema_path), _file_mtime(catalog_path))
+    schema = load_json(schema_path)
+    # Каталог необязателен: у таблицы может не быть категориальных колонок
+    catalog = load_json(catalog_path) if os.path.exists(catalog_path) else {}
+
+    schema_prompt = json.dumps(schema.get("columns", {}), indent=2, ensure_ascii=False)
+    catalog_prompt = json.dumps(catalog, indent=2, ensure_ascii=False)
+
+    digest = hashlib.sha256()
+    digest.update(schema_prompt.encode("utf-8"))
+    digest.update(catalog_prompt.encode("utf-8"))
+
+    return TableMetadata(
+        table_name=table_name,
+        schema=schema,
+        catalog=catalog,
+        schema_prompt=schema_prompt,
+        catalog_prompt=catalog_prompt,
+        version=digest.hexdigest()[:16],
+        mtimes=mtimes,
+    )
+
+
+class MetadataRegistry:
+    """
+    Реестр метаданных всех таблиц из папки `metadata_output`.
+
+    Загружает схемы и каталоги один раз (на старте приложения), а затем не чаще,
+    чем раз в `reload_interval` секунд, сверяет mtime файлов и перечитывает только
+    изменившиеся таблицы. Новая версия подменяет словарь целиком, поэтому
+    конкурентные запросы всегда видят согласованный снимок.
+    """
+
+    def __init__(self, base_dir: str, reload_interval: float = METADATA_RELOAD_INTERVAL):
+        self.base_dir = base_dir
+        self.reload_interval = reload_interval
+        self._tables: Dict[str, TableMetadata] = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def _discover(self) -> Dict[str, Tuple[str, str]]:
+        """Находит все пары schema/catalog в папке с метаданными."""
+        found = {}
+        for schema_path in glob.glob(os.path.join(self.base_dir, f"*{SCHEMA_SUFFIX}")):
+            table_name = os.path.basename(schema_path)[:-len(SCHEMA_SUFFIX)]
+            catalog_path = os.path.join(self.base_dir, f"{table_name}{CATALOG_SUFFIX}")
+            found[table_name] = (schema_path, catalog_path)
+        return found
+
+    def load_all(self) -> None:
+        """Полная (пере)загрузка метаданных. Вызывается из startup-хука API."""
+        with self._lock:
+            self._refresh(force=True)
+
+    def _refresh(self, force: bool = False) -> None:
+        current = self._tables
+        updated: Dict[str, TableMetadata] = {}
+        changed = []
+
+        for table_name, (schema_path, catalog_path) in self._discover().items():
+            existing = current.get(table_name)
+            mtimes = (_file_mtime(schema_path), _file_mtime(catalog_path))
+            if existing is not None and not force and existing.mtimes == mtimes:
+                updated[table_name] = existing
+                continue
+            try:
+                updated[table_name] = _build_table_metadata(table_name, schema_path, catalog_path)
+                changed.append(table_name)
+            except ValueError:
+                # Файл мог быть прочитан в момент записи — оставляем предыдущую версию
+                if existing is None:
+                    raise
+                logger.warning(f"Не удалось перечитать метаданные '{table_name}', используется прежняя версия.")
+                updated[table_name] = existing
+
+        removed = set(current) - set(updated)
+        if changed or removed or force:
+            self._tables = updated
+            if changed:
+                logger.info(f"Метаданные загружены: {', '.join(sorted(changed))}")
+            if removed:
+                logger.info(f"Метаданные удалены: {', '.join(sorted(removed))}")
+        self._last_check = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        if self._tables and time.monotonic() - self._last_check < self.reload_interval:
+            return
+        if not self._lock.acquire(blocking=not self._tables):
+            # Другой поток уже проверяет файлы — работаем с текущим снимком
+            return
+        try:
+            if not self._tables:
+                self._refresh(force=True)
+            elif time.monotonic() - self._last_check >= self.reload_interval:
+                self._refresh()
+        finally:
+            self._lock.release()
+
+    def get(self, table_name: str) -> TableMetadata:
+        """Возвращает актуальные метаданные таблицы по её имени."""
+        self._maybe_reload()
+        metadata = self._tables.get(table_name)
+        if metadata is None:
+            logger.error(f"Метаданные для таблицы не найдены: {table_name}")
+            raise ValueError(f"Конфигурационный файл не найден для таблицы: {table_name}")
+        return metadata
+
+    def tables(self) -> List[TableMetadata]:
+        """Снимок метаданных всех известных таблиц."""
+        self._maybe_reload()
+        return list(self._tables.values())
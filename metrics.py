@@ -0,0 +1,147 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Границы гистограмм длительности (секунды): от быстрых попаданий в кеш до долгих ответов LLM
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_DURATION = Histogram(
+    "chatbot_stage_duration_seconds", "Длительность этапа пайплайна", ["stage"], buckets=_LATENCY_BUCKETS
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "chatbot_http_request_duration_seconds", "Длительность HTTP запроса", ["path", "method", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_REQUEST_DURATION = Histogram(
+    "chatbot_llm_request_duration_seconds", "Длительность одной попытки вызова LLM", ["provider", "outcome"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens", "Токены LLM по данным провайдера", ["provider", "type"]
+)
+COALESCED_REQUESTS = Counter(
+    "chatbot_coalesced_requests", "Запросы, дождавшиеся результата уже выполняющегося одинакового запроса", ["stage"]
+)
+DB_ROWS = Histogram(
+    "chatbot_db_rows_returned", "Число строк в результате SQL-запроса",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 500, 1000, 5000, 10000),
+)
+DB_POOL_WAIT = Histogram(
+    "chatbot_db_pool_wait_seconds", "Ожидание соединения из пула БД",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+
+# Длительности этапов текущего HTTP запроса (для заголовка X-Timing)
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замеряет этап пайплайна: гистограмма в /metrics и сумма по этапу в X-Timing текущего запроса."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.labels(stage=name).observe(elapsed)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def add_timings(timings: Dict[str, float]) -> None:
+    """Добавляет длительности этапов, замеренные в другой задаче, в X-Timing текущего запроса."""
+    current = request_timings.get()
+    if current is None:
+        return
+    for name, seconds in timings.items():
+        current[name] = current.get(name, 0.0) + seconds
+
+
+def record_llm_usage(provider: str, usage) -> None:
+    """Учитывает токены из поля usage ответа (dict или объект OpenAI SDK), если провайдер его вернул."""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            LLM_TOKENS.labels(provider=provider, type=kind.replace("_tokens", "")).inc(value)
+
+
+def format_timings(timings: Dict[str, float], total: float) -> str:
+    """Значение заголовка X-Timing: "resolve_sql=812.4;execute_sql=3.1;total=830.2" (мс)."""
+    parts = [f"{name}={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total={total * 1000:.1f}")
+    return ";".join(parts)
+
+
+class StatsCollector:
+    """
+    Экспортирует счетчики попаданий/промахов кешей из их stats() на момент запроса
+    /metrics, не добавляя работы в горячий путь.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], Dict]]):
+        self.sources = sources
+
+    def collect(self):
+        family = CounterMetricFamily("chatbot_cache_lookups", "Обращения к кешам", labels=["cache", "result"])
+        for name, stats in self.sources.items():
+            values = stats()
+            family.add_metric([name, "hit"], values.get("hits", 0))
+            family.add_metric([name, "miss"], values.get("misses", values.get("fallbacks", 0)))
+        yield family
+
+
+class PoolCollector:
+    """Состояние пула соединений к БД (занятые, свободные, сверх pool_size) на момент запроса /metrics."""
+
+    def __init__(self, stats: Callable[[], Dict]):
+        self.stats = stats
+
+    def collect(self):
+        family = GaugeMetricFamily("chatbot_db_pool_connections", "Соединения пула БД", labels=["state"])
+        values = self.stats()
+        for state in ("checked_out", "idle", "overflow"):
+            if state in values:
+                family.add_metric([state], values[state])
+        yield family
+
+
+_stats_collectors = []
+
+
+def _register(collector) -> None:
+    _stats_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def register_stats_collector(sources: Dict[str, Callable[[], Dict]]) -> None:
+    _register(StatsCollector(sources))
+
+
+def register_pool_collector(stats: Callable[[], Dict]) -> None:
+    _register(PoolCollector(stats))
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Текст для /metrics. При нескольких воркерах uvicorn задайте PROMETHEUS_MULTIPROC_DIR:
+    тогда гистограммы и счетчики собираются со всех процессов (счетчики кешей и пула — только текущего).
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _stats_collectors:
+            registry.register(collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,44 +1,45 @@
 import json
+import time
+import asyncio
 import pandas as pd
 import re
 import sqlparse
 from sqlalchemy import text
-from typing import Dict
+from typing import Dict, List, AsyncIterator, Sequence
 from sqlparse.exceptions import SQLParseError
 
 # --- Импорт общих ресурсов и утилит ---
-from config import db_engine, logger, get_llm_completion
-from utils import format_numbers_in_df
+from config import (
+    db_executor, logger,
+    SQL_STATEMENT_TIMEOUT_MS, FAST_PATH_ENABLED, BATCH_CONCURRENCY, PROMPT_COMPACTION_ENABLED,
+    TABLE_ROUTER_TOP_K, TABLE_ROUTER_MIN_RELATIVE_SCORE, SINGLE_FLIGHT_ENABLED,
+)
+from llm_client import get_llm_completion, stream_llm_completion, warm_providers
+from utils import format_numbers_in_df, normalize_text
+from metadata_registry import MetadataRegistry, TableMetadata
+from query_cache import sql_cache
+from semantic_cache import semantic_cache
+from fast_router import fast_router
+from answer_renderer import render_answer
+from metrics import stage, DB_ROWS
+from prompt_compaction import prompt_compactor, count_tokens
+from table_router import TableRouter
+from sql_rewriter import year_filter_rewriter
+from result_cache import result_cache, data_version, normalize_sql
+from single_flight import SingleFlight
+from resources import db_connection
 
 # --- Конфигурация, специфичная для этого пайплайна ---
 # Указываем путь к файлам с метаданными
 BOT_BASE_DIR = "metadata_output"
 BOT_CONFIG = {
     "table_name_db": "top_12_german_companies",
-    "schema_path": f"{BOT_BASE_DIR}/top_12_german_companies_schema.json",
-    "catalog_path": f"{BOT_BASE_DIR}/top_12_german_companies_catalog.json",
 }
 
-def load_json(path: str) -> Dict:
-    """Загружает JSON файл с обработкой ошибок."""
-    try:
-        with open(path, encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logger.error(f"Файл не найден: {path}")
-        raise ValueError(f"Конфигурационный файл не найден: {path}")
-    except json.JSONDecodeError:
-        logger.error(f"Невалидный JSON файл: {path}")
-        raise ValueError(f"Ошибка в формате конфигурационного файла: {path}")
-
-async def generate_sql(user_query: str, schema: Dict, catalog: Dict, table_name: str) -> Dict:
-    """
-    Генерирует SQL-запрос на основе запроса пользователя, используя LLM
-    с тщательно подобранными примерами (few-shot prompting).
-    """
-
-    # Блок с примерами для обучения модели "на лету"
-    few_shot_examples = """
+# Примеры few-shot для промпта generate_sql по таблицам: в промпт попадают примеры только тех
+# таблиц, которые table_router выбрал для запроса
+FEW_SHOT_EXAMPLES = {
+    "top_12_german_companies": """
 # Пример 1: Простой поиск по одному показателю и одной компании
 Запрос: какая выручка у Volkswagen за 2023 год?
 Ответ:
@@ -110,9 +111,61 @@ async def generate_sql(user_query: str, schema: Dict, catalog: Dict, table_name:
   "years": [2019],
   "units": []
 }
-"""
+""",
+}
+
+# Метаданные загружаются один раз на старте и перечитываются при изменении файлов
+metadata_registry = MetadataRegistry(BOT_BASE_DIR)
+# Выбор таблиц под запрос; BOT_CONFIG задает таблицу по умолчанию
+table_router = TableRouter(
+    metadata_registry, BOT_CONFIG["table_name_db"], TABLE_ROUTER_TOP_K, TABLE_ROUTER_MIN_RELATIVE_SCORE
+)
+# Объединение одинаковых одновременных запросов: весь пайплайн, генерация SQL и выполнение SQL
+pipeline_flight = SingleFlight("pipeline", SINGLE_FLIGHT_ENABLED)
+sql_generation_flight = SingleFlight("generate_sql", SINGLE_FLIGHT_ENABLED)
+sql_execution_flight = SingleFlight("execute_sql", SINGLE_FLIGHT_ENABLED)
+
+
+def _metadata_fragments(user_query: str, metadata: TableMetadata):
+    """Фрагменты схемы и каталога таблицы: целиком или только релевантные запросу."""
+    if PROMPT_COMPACTION_ENABLED:
+        return prompt_compactor.build(user_query, metadata)
+    return metadata.schema_prompt, metadata.catalog_prompt, 0
+
+
+async def generate_sql(user_query: str, metadata: TableMetadata,
+                       related_tables: Sequence[TableMetadata] = ()) -> Dict:
+    """
+    Генерирует SQL-запрос на основе запроса пользователя, используя LLM
+    с тщательно подобранными примерами (few-shot prompting).
+    related_tables — другие таблицы-кандидаты от table_router; их схемы и
+    каталоги добавляются в промпт с подписью имени таблицы.
+    """
+    table_name = metadata.table_name
+
+    schema_prompt, catalog_prompt, full_fragments_tokens = _metadata_fragments(user_query, metadata)
+    tables_rule = f"ИСПОЛЬЗУЙ ТОЛЬКО ТАБЛИЦУ `{table_name}`"
+    if related_tables:
+        tables_rule = "ИСПОЛЬЗУЙ ТОЛЬКО ТАБЛИЦЫ " + ", ".join(
+            f"`{t.table_name}`" for t in (metadata, *related_tables)
+        )
+        schema_parts = [f"Таблица `{table_name}`: {schema_prompt}"]
+        catalog_parts = [f"Таблица `{table_name}`: {catalog_prompt}"]
+        for related in related_tables:
+            related_schema, related_catalog, related_full = _metadata_fragments(user_query, related)
+            schema_parts.append(f"Таблица `{related.table_name}`: {related_schema}")
+            catalog_parts.append(f"Таблица `{related.table_name}`: {related_catalog}")
+            full_fragments_tokens += related_full
+        schema_prompt = "\n    ".join(schema_parts)
+        catalog_prompt = "\n    ".join(catalog_parts)
+
+    # Примеры добавляются только для таблиц, для которых они написаны
+    few_shot_examples = "".join(
+        f"\nВот хорошие примеры для таблицы `{t.table_name}`:\n{FEW_SHOT_EXAMPLES[t.table_name]}"
+        for t in (metadata, *related_tables) if t.table_name in FEW_SHOT_EXAMPLES
+    )
     prompt = f"""
-Ты text-to-SQL бот. Твоя задача — сгенерировать SQL-запрос и структурированный JSON-ответ на основе ТОЛЬКО предоставленной схемы и каталога для таблицы с финансовыми данными немецких компаний.
+Ты text-to-SQL бот. Твоя задача — сгенерировать SQL-запрос и структурированный JSON-ответ на основе ТОЛЬКО предоставленных схемы и каталога.
 - Если ты уверен больше чем на 80%, что можешь составить точный SQL-запрос, сгенерируй JSON с этим запросом.
 - Если ты НЕ УВЕРЕН, или запрос нерелевантен, или нужной информации нет в схеме/каталоге, ты ОБЯЗАН вернуть JSON, где ключ "sql" имеет значение null.
 
@@ -120,20 +173,18 @@ async def generate_sql(user_query: str, schema: Dict, catalog: Dict, table_name:
 "{user_query}"
 
 **КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА ГЕНЕРАЦИИ SQL:**
-1.  **ИСПОЛЬЗУЙ ТОЛЬКО ТАБЛИЦУ `{table_name}`**.
+1.  **{tables_rule}**.
 2.  **ЭКРАНИРОВАНИЕ КОЛОНОК ОБЯЗАТЕЛЬНО**: Названия колонок в этой таблице содержат пробелы и спецсимволы (например, `Net Income`, `ROA (%)`). Ты **ОБЯЗАН** заключать КАЖДОЕ название колонки в двойные кавычки.
 3.  **СТРУКТУРА ТАБЛИЦЫ**: Это "широкая" таблица. Каждая колонка представляет собой отдельный показатель.
 4.  **ИСПОЛЬЗУЙ СХЕМУ**: Используй только те колонки, что перечислены в схеме. Не придумывай новые.
     Схема:
-    {json.dumps(schema['columns'], indent=2, ensure_ascii=False)}
+    {schema_prompt}
 5.  **ИСПОЛЬЗУЙ КАТАЛОГ**: Для фильтрации в `WHERE` используй официальные названия из каталога. Если пользователь пишет "БМВ", в запросе должно быть `WHERE "Company" = 'BMW AG'`.
     Каталог:
-    {json.dumps(catalog, indent=2, ensure_ascii=False)}
+    {catalog_prompt}
 6.  **ФИЛЬТРАЦИЯ ПО ДАТАМ**: Колонка "Period" — это текст (например, '12/31/2023'). Для фильтрации по году используй оператор `LIKE`. Пример для 2022 года: `WHERE "Period" LIKE '%2022'`.
 7.  **АГРЕГАЦИЯ**: Если пользователь просит сумму, среднее или максимум, используй `SUM()`, `AVG()`, `MAX()`. Если используешь агрегатную функцию вместе с другой колонкой в `SELECT`, эта колонка **ОБЯЗАТЕЛЬНО** должна быть в `GROUP BY`.
 8.  **ГОДОВЫЕ СУММЫ**: Если пользователь спрашивает финансовый показатель (как Выручка или Прибыль) за целый год, не указывая квартал, он почти всегда хочет видеть **общую годовую сумму**. В этом случае используй `SUM()` для этого показателя и фильтруй по году через `LIKE`.
-
-Вот хорошие примеры для таблицы `{table_name}`:
 {few_shot_examples}
 
 Сформируй ответ в виде строгого JSON со следующими полями:
@@ -146,6 +197,11 @@ async def generate_sql(user_query: str, schema: Dict, catalog: Dict, table_name:
 
 Верни ТОЛЬКО JSON объект и ничего больше.
 """
+    if PROMPT_COMPACTION_ENABLED:
+        prompt_compactor.report(
+            prompt, count_tokens(schema_prompt) + count_tokens(catalog_prompt), full_fragments_tokens
+        )
+
     llm_response_str = await get_llm_completion(
         messages=[{"role": "user", "content": prompt}],
         temperature=0.0
@@ -174,26 +230,122 @@ def validate_sql(sql_query: str):
         logger.warning(f"Синтаксическая ошибка в сгенерированном SQL: {e}\nЗапрос: {sql_query}")
         raise ValueError("Сгенерирован некорректный SQL-запрос.")
 
-def execute_sql(sql_query: str) -> pd.DataFrame:
+def execute_sql(sql_query: str, timeout_ms: int = SQL_STATEMENT_TIMEOUT_MS) -> pd.DataFrame:
     """Выполняет SQL-запрос и возвращает результат в виде DataFrame."""
     try:
-        with db_engine.connect() as conn:
+        with db_connection() as conn:
+            sql_query = year_filter_rewriter.rewrite(sql_query, conn)
+            if timeout_ms and conn.dialect.name == "postgresql":
+                # SET LOCAL действует только в рамках текущей транзакции соединения
+                conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
             df = pd.read_sql(text(sql_query), conn)
         return df
     except Exception as e:
         logger.error(f"Ошибка выполнения SQL-запроса: {sql_query}\nОшибка: {e}")
         raise IOError("Произошла ошибка при запросе к базе данных.")
 
-async def summarize_result(df: pd.DataFrame, user_query: str) -> str:
-    """Формирует итоговый текстовый ответ, используя предварительное форматирование."""
-    if df.empty:
-        return "По вашему запросу данные не найдены."
+async def execute_sql_async(sql_query: str, timeout_ms: int = SQL_STATEMENT_TIMEOUT_MS) -> pd.DataFrame:
+    """
+    Асинхронная обертка над execute_sql: запрос выполняется в ограниченном пуле потоков,
+    event loop в это время продолжает обслуживать другие запросы. Результаты кешируются
+    до следующей загрузки данных (штамп версии данных пишет db_uploader.py).
+    """
+    loop = asyncio.get_running_loop()
+    cache_key = None
+    flight_key = normalize_sql(sql_query)
+    if result_cache.enabled:
+        version = data_version.value
+        if data_version.is_stale():
+            version = await loop.run_in_executor(db_executor, data_version.refresh)
+        # Без известной версии данных кеш не читается и не пополняется
+        if version is not None:
+            cache_key = flight_key = result_cache.make_key(sql_query, version)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Результат SQL взят из кеша.")
+                return cached
+
+    async def run_query() -> pd.DataFrame:
+        future = loop.run_in_executor(db_executor, execute_sql, sql_query, timeout_ms)
+        if not timeout_ms:
+            df = await future
+        else:
+            try:
+                # Небольшой запас поверх statement_timeout, чтобы БД успела сама прервать запрос
+                df = await asyncio.wait_for(future, timeout=timeout_ms / 1000 + 1.0)
+            except asyncio.TimeoutError:
+                logger.error(f"Превышено время ожидания SQL-запроса ({timeout_ms} мс): {sql_query}")
+                raise IOError("База данных не ответила вовремя. Пожалуйста, попробуйте позже.")
+
+        if cache_key is not None:
+            result_cache.set(cache_key, df)
+        return df
+
+    # Одинаковый SQL, который уже выполняется, не отправляется в БД второй раз
+    return await sql_execution_flight.run(flight_key, run_query)
+
+async def _generate_and_cache(user_query: str, metadata: TableMetadata,
+                              related_tables: Sequence[TableMetadata], cache_key: str) -> Dict:
+    """Генерация SQL через LLM с валидацией и записью в кеши (выполняется один раз на ключ)."""
+    generation_result = await generate_sql(user_query, metadata, related_tables)
+    sql_query = generation_result.get("sql")
+    if sql_query:
+        validate_sql(sql_query)
+        sql_cache.set(cache_key, generation_result)
+        if not related_tables:
+            semantic_cache.add(user_query, metadata, generation_result)
+    return generation_result
+
+async def resolve_sql(user_query: str, metadata: TableMetadata,
+                      related_tables: Sequence[TableMetadata] = ()) -> Dict:
+    """
+    Возвращает результат генерации SQL: сначала из кеша по нормализованному запросу,
+    затем через шаблонный разбор без LLM, семантический кеш (перефразировки), и только
+    потом через LLM. В кеши попадают только ответы с SQL, прошедшим валидацию.
+    Быстрый путь и семантический кеш работают только для одной таблицы-кандидата.
+    """
+    cache_key = sql_cache.make_key(user_query, metadata, related_tables)
+    cached = sql_cache.get(cache_key)
+    if cached is not None:
+        logger.info("SQL взят из кеша.")
+        return cached
+
+    if related_tables:
+        return await sql_generation_flight.run(
+            cache_key, lambda: _generate_and_cache(user_query, metadata, related_tables, cache_key)
+        )
+
+    if FAST_PATH_ENABLED:
+        routed = fast_router.route(user_query, metadata)
+        if routed is not None:
+            validate_sql(routed["sql"])
+            return routed
 
+    similar = semantic_cache.lookup(user_query, metadata)
+    if similar is not None:
+        try:
+            validate_sql(similar["sql"])
+            sql_cache.set(cache_key, similar)
+            return similar
+        except ValueError:
+            logger.warning("SQL из семантического кеша не прошел валидацию, запрос уходит в LLM.")
+
+    # Ключ кеша — нормализованный запрос и версии метаданных
+    return await sql_generation_flight.run(
+        cache_key, lambda: _generate_and_cache(user_query, metadata, (), cache_key)
+    )
+
+NO_SQL_ANSWER = "К сожалению, я не уверен, как точно ответить на ваш вопрос. Пожалуйста, попробуйте переформулировать его."
+EMPTY_RESULT_ANSWER = "По вашему запросу данные не найдены."
+INTERNAL_ERROR_ANSWER = "Произошла непредвиденная внутренняя ошибка. Пожалуйста, попробуйте позже."
+
+def _build_summary_prompt(df: pd.DataFrame, user_query: str) -> str:
+    """Готовит промпт суммаризации, используя предварительное форматирование."""
     # Форматируем числа для лучшего восприятия моделью и пользователем
     df_formatted = format_numbers_in_df(df.head(15))
     data_for_prompt_string = df_formatted.to_string(index=False)
 
-    prompt = f"""
+    return f"""
 Ты — ассистент, который формирует краткий и понятный текстовый ответ на русском языке на основе данных из таблицы.
 Отвечай строго на основе предоставленных данных, не выдумывай информацию.
 
@@ -203,49 +355,170 @@ async def summarize_result(df: pd.DataFrame, user_query: str) -> str:
 
 Твоя задача: Предоставь краткий, человекочитаемый ответ на русском языке.
 """
+
+async def summarize_result(df: pd.DataFrame, user_query: str) -> str:
+    """Формирует итоговый текстовый ответ, используя предварительное форматирование."""
+    if df.empty:
+        return EMPTY_RESULT_ANSWER
+
     answer = await get_llm_completion(
-        messages=[{"role": "user", "content": prompt}],
+        messages=[{"role": "user", "content": _build_summary_prompt(df, user_query)}],
         temperature=0.2
     )
     return answer.strip()
 
-async def run_companies_pipeline(user_query: str) -> str:
+async def stream_summary(df: pd.DataFrame, user_query: str) -> AsyncIterator[str]:
+    """Потоковый вариант summarize_result: отдает ответ LLM по мере генерации."""
+    if df.empty:
+        yield EMPTY_RESULT_ANSWER
+        return
+
+    async for token in stream_llm_completion(
+        messages=[{"role": "user", "content": _build_summary_prompt(df, user_query)}],
+        temperature=0.2
+    ):
+        yield token
+
+async def stream_companies_pipeline(user_query: str, stream_answer: bool = True) -> AsyncIterator[Dict]:
     """
-    Основной асинхронный пайплайн. Принимает вопрос, возвращает ответ.
+    Основной асинхронный пайплайн в виде последовательности событий:
+    sql_generated -> rows_fetched -> token (если ответ генерирует LLM) -> answer | error.
+    События отдаются сразу по мере готовности каждого этапа.
     """
     pipeline_name = "companies_pipeline"
     logger.info(f"[{pipeline_name}] Запрос в обработке: '{user_query}'")
     try:
-        # 1. Загрузка конфигурации
-        schema = load_json(BOT_CONFIG["schema_path"])
-        catalog = load_json(BOT_CONFIG["catalog_path"])
-        table_name = BOT_CONFIG["table_name_db"]
+        # 1. Выбор таблиц-кандидатов и их предзагруженных метаданных
+        with stage("route_tables"):
+            metadata, *related_tables = table_router.route(user_query)
 
-        # 2. Генерация SQL
-        generation_result = await generate_sql(user_query, schema, catalog, table_name)
+        # 2. Генерация SQL (с учетом кеша)
+        with stage("resolve_sql"):
+            generation_result = await resolve_sql(user_query, metadata, related_tables)
         sql_query = generation_result.get("sql")
 
         if not sql_query:
             logger.info(f"[{pipeline_name}] Модель не сгенерировала SQL.")
-            return "К сожалению, я не уверен, как точно ответить на ваш вопрос. Пожалуйста, попробуйте переформулировать его."
+            yield {"event": "answer", "data": {"answer": NO_SQL_ANSWER}}
+            return
 
         logger.info(f"[{pipeline_name}] Сгенерирован SQL: {sql_query}")
+        yield {"event": "sql_generated", "data": {"sql": sql_query, "source": generation_result.get("source", "llm")}}
 
         # 3. Валидация и выполнение SQL
-        validate_sql(sql_query)
-        result_df = execute_sql(sql_query)
+        with stage("execute_sql"):
+            validate_sql(sql_query)
+            result_df = await execute_sql_async(sql_query)
+        DB_ROWS.observe(len(result_df))
         logger.info(f"[{pipeline_name}] Из БД получено строк: {len(result_df)}")
+        yield {"event": "rows_fetched", "data": {"rows": len(result_df)}}
+
+        # 4. Формирование ответа: по шаблону для простых результатов, иначе через LLM
+        with stage("summarize"):
+            answer = render_answer(result_df, generation_result, metadata)
+            if answer is None:
+                clarified_prompt = generation_result.get("clarified_prompt", user_query)
+                if stream_answer:
+                    parts = []
+                    async for token in stream_summary(result_df, clarified_prompt):
+                        parts.append(token)
+                        yield {"event": "token", "data": {"text": token}}
+                    answer = "".join(parts).strip()
+                else:
+                    answer = await summarize_result(result_df, clarified_prompt)
 
-        # 4. Суммаризация результата
-        clarified_prompt = generation_result.get("clarified_prompt", user_query)
-        answer = await summarize_result(result_df, clarified_prompt)
-        
         logger.info(f"[{pipeline_name}] Ответ готов.")
-        return answer
+        yield {"event": "answer", "data": {"answer": answer}}
 
     except (ValueError, IOError) as e:
         logger.warning(f"[{pipeline_name}] Ошибка обработки запроса: {e}")
-        return str(e)
+        yield {"event": "error", "data": {"message": str(e)}}
     except Exception as e:
         logger.exception(f"[{pipeline_name}] Критическая ошибка в пайплайне для запроса: '{user_query}'")
-        return "Произошла непредвиденная внутренняя ошибка. Пожалуйста, попробуйте позже."
\ No newline at end of file
+        yield {"event": "error", "data": {"message": INTERNAL_ERROR_ANSWER}}
+
+async def run_companies_pipeline(user_query: str) -> str:
+    """
+    Основной асинхронный пайплайн. Принимает вопрос, возвращает ответ.
+    Одинаковые вопросы (с точностью до регистра и пунктуации), пришедшие одновременно,
+    обрабатываются один раз.
+    """
+    return await pipeline_flight.run(normalize_text(user_query), lambda: _run_companies_pipeline(user_query))
+
+async def _run_companies_pipeline(user_query: str) -> str:
+    async for event in stream_companies_pipeline(user_query, stream_answer=False):
+        if event["event"] == "answer":
+            return event["data"]["answer"]
+        if event["event"] == "error":
+            return event["data"]["message"]
+    return INTERNAL_ERROR_ANSWER
+
+async def run_companies_batch(queries: List[str], concurrency: int = BATCH_CONCURRENCY) -> List[Dict]:
+    """
+    Пакетный режим: обрабатывает список вопросов параллельно (не более `concurrency` одновременно).
+    Одинаковые вопросы (с точностью до регистра и пунктуации) выполняются один раз.
+    Результаты возвращаются в порядке входного списка вместе со временем обработки.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    unique: Dict[str, asyncio.Task] = {}
+
+    async def run_one(query: str) -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            answer = await run_companies_pipeline(query)
+            return {"answer": answer, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    keys = []
+    for query in queries:
+        key = normalize_text(query)
+        keys.append(key)
+        if key not in unique:
+            unique[key] = asyncio.create_task(run_one(query))
+
+    await asyncio.gather(*unique.values())
+
+    results = []
+    seen = set()
+    for query, key in zip(queries, keys):
+        outcome = unique[key].result()
+        results.append({
+            "query": query,
+            "answer": outcome["answer"],
+            "elapsed_ms": outcome["elapsed_ms"],
+            "deduplicated": key in seen,
+        })
+        seen.add(key)
+    logger.info(f"[companies_pipeline] Пакет обработан: {len(queries)} вопросов, уникальных {len(unique)}.")
+    return results
+
+# Состояние фонового прогрева воркера (показывается в /health)
+warmup_state = {"done": False, "seconds": None}
+
+def _warm_db_pool() -> None:
+    with db_connection() as conn:
+        conn.execute(text("SELECT 1"))
+
+async def prewarm() -> None:
+    """
+    Прогрев воркера после старта: первое соединение с БД и клиенты LLM провайдеров.
+    Выполняется в фоне, чтобы сервер сразу отвечал на /health; ошибки только логируются —
+    в худшем случае за инициализацию заплатит первый запрос.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    jobs = [
+        loop.run_in_executor(db_executor, _warm_db_pool),
+        asyncio.ensure_future(asyncio.to_thread(warm_providers)),
+    ]
+    try:
+        results = await asyncio.shield(asyncio.gather(*jobs, return_exceptions=True))
+    except asyncio.CancelledError:
+        # Поток прервать нельзя: при отмене дожидаемся его, чтобы ресурсы не закрылись под ним
+        await asyncio.gather(*jobs, return_exceptions=True)
+        raise
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Ошибка прогрева: {result!r}")
+    warmup_state["seconds"] = round(time.perf_counter() - started, 3)
+    warmup_state["done"] = True
+    logger.info(f"Прогрев завершен за {warmup_state['seconds']} с.")
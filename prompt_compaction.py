@@ -0,0 +1,195 @@
+import json
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import logger, PROMPT_COMPACTION_ENABLED, PROMPT_SCHEMA_TOP_K, PROMPT_CATALOG_TOP_K
+from metadata_registry import TableMetadata
+from query_cache import get_alias_resolver
+from fast_router import fast_router
+from utils import normalize_text, stem_word, QUERY_STOPWORDS
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken не установлен или не может загрузить словарь
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов в тексте: точно через tiktoken, если он установлен, иначе оценка ~4 символа на токен."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def _compact(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def text_stems(*texts: str) -> Set[str]:
+    """Основы значимых слов текстов (без служебных слов); общая основа лексических индексов."""
+    stems = set()
+    for text in texts:
+        for token in normalize_text(text).split():
+            if token not in QUERY_STOPWORDS and token != "%":
+                stems.add(stem_word(token))
+    return stems
+
+
+def _matches(query_stem: str, entry_stem: str) -> bool:
+    """Совпадение основ с учетом разной длины окончаний ("актив" и "акти")."""
+    if query_stem == entry_stem:
+        return True
+    shorter, longer = sorted((query_stem, entry_stem), key=len)
+    return len(shorter) >= 4 and longer.startswith(shorter)
+
+
+class LexicalIndex:
+    """Небольшой лексический индекс: основы слов записей и их IDF."""
+
+    def __init__(self, entries: Dict[str, Set[str]]):
+        self.entries = entries
+        frequencies = Counter(stem for stems in entries.values() for stem in stems)
+        total = max(1, len(entries))
+        self.idf = {stem: math.log(1 + total / count) for stem, count in frequencies.items()}
+
+    def score(self, query_stems: Set[str]) -> Dict[str, float]:
+        scores = {}
+        for key, stems in self.entries.items():
+            value = sum(self.idf[s] for s in stems if any(_matches(q, s) for q in query_stems))
+            if value > 0:
+                scores[key] = value
+        return scores
+
+
+class TableIndex:
+    """Индексы колонок схемы и значений каталога для одной версии метаданных."""
+
+    def __init__(self, metadata: TableMetadata):
+        self.metadata = metadata
+        columns = metadata.schema.get("columns", {})
+        self.dimension_columns = [c for c in columns if c in metadata.catalog]
+        self.metric_columns = [c for c in columns if c not in metadata.catalog]
+        self.columns_index = LexicalIndex({
+            column: text_stems(column, (info or {}).get("description", ""), *((info or {}).get("aliases") or {}).values())
+            for column, info in columns.items() if column in self.metric_columns
+        })
+        self.catalog_indexes = {
+            column: LexicalIndex({
+                value: text_stems(value, *((entry or {}).get("aliases") or {}).values())
+                for value, entry in values.items()
+            })
+            for column, values in metadata.catalog.items() if isinstance(values, dict)
+        }
+        self.full_tokens = count_tokens(metadata.schema_prompt) + count_tokens(metadata.catalog_prompt)
+
+
+class PromptCompactor:
+    """
+    Сокращает фрагменты схемы и каталога в промпте generate_sql до релевантных запросу:
+    колонки-измерения (из каталога) передаются всегда, показатели — top-k по совпадению
+    алиасов и лексическому индексу, значения каталога — найденные в запросе (или только
+    официальные названия без описаний, если ничего не найдено). Периоды передаются все:
+    у найденных — с алиасами, у остальных — только названия. JSON сериализуется компактно.
+    """
+
+    def __init__(self, schema_top_k: int, catalog_top_k: int):
+        self.schema_top_k = schema_top_k
+        self.catalog_top_k = catalog_top_k
+        self._indexes: Dict[str, TableIndex] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def _get_index(self, metadata: TableMetadata) -> TableIndex:
+        key = f"{metadata.table_name}:{metadata.version}"
+        index = self._indexes.get(key)
+        if index is None:
+            index = TableIndex(metadata)
+            with self._lock:
+                for stale in [k for k in self._indexes if k.startswith(f"{metadata.table_name}:")]:
+                    self._indexes.pop(stale, None)
+                self._indexes[key] = index
+        return index
+
+    def _select_metrics(self, index: TableIndex, tokens: List[str], query_stems: Set[str]) -> Optional[List[str]]:
+        scores = index.columns_index.score(query_stems)
+        # Прямое совпадение алиаса показателя весомее любого лексического совпадения
+        for column in fast_router.get_rules(index.metadata).find_metrics(tokens, [False] * len(tokens)):
+            scores[column] = scores.get(column, 0.0) + 100.0
+        if not scores:
+            return None
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.schema_top_k]
+        # Сохраняем исходный порядок колонок схемы
+        return [c for c in index.metric_columns if c in ranked]
+
+    def _select_catalog(self, index: TableIndex, normalized: str, query_stems: Set[str]) -> Dict:
+        found: Dict[str, Set[str]] = {}
+        for column, canonical, _ in get_alias_resolver(index.metadata).find(normalized):
+            found.setdefault(column, set()).add(canonical)
+
+        period_column = fast_router.get_rules(index.metadata).period_column
+        compact_catalog = {}
+        for column, values in index.metadata.catalog.items():
+            if not isinstance(values, dict):
+                continue
+            scores = index.catalog_indexes[column].score(query_stems)
+            for value in found.get(column, ()):
+                scores[value] = scores.get(value, 0.0) + 100.0
+            if scores:
+                top = sorted(scores, key=scores.get, reverse=True)[:self.catalog_top_k]
+                # Периоды не обрезаются: "за 2020-2022" или "после 2020" касаются и периодов, которых
+                # нет в тексте запроса. Алиасы — только у top-k, остальные периоды — одними названиями
+                keep_all = column == period_column
+                compact_catalog[column] = {
+                    value: {"aliases": (values[value] or {}).get("aliases", {})} if value in top else {}
+                    for value in values if keep_all or value in top
+                }
+            else:
+                # Ничего не найдено — только официальные названия, чтобы модель не выдумывала значения
+                compact_catalog[column] = list(values)
+        return compact_catalog
+
+    def build(self, user_query: str, metadata: TableMetadata) -> Tuple[str, str, int]:
+        """
+        Возвращает (фрагмент схемы, фрагмент каталога, число токенов полных фрагментов).
+        Если показатели определить не удалось, схема передается целиком.
+        """
+        index = self._get_index(metadata)
+        normalized = normalize_text(user_query)
+        tokens = normalized.split()
+        query_stems = text_stems(normalized)
+
+        metrics = self._select_metrics(index, tokens, query_stems)
+        if metrics is None:
+            schema_prompt = metadata.schema_prompt
+        else:
+            columns = metadata.schema.get("columns", {})
+            schema_prompt = _compact({c: columns[c] for c in columns if c in index.dimension_columns or c in metrics})
+        catalog_prompt = _compact(self._select_catalog(index, normalized, query_stems))
+        return schema_prompt, catalog_prompt, index.full_tokens
+
+    def report(self, prompt: str, fragments_tokens: int, full_fragments_tokens: int) -> None:
+        """Учитывает размер промпта до и после сокращения и пишет его в лог."""
+        after = count_tokens(prompt)
+        before = after - fragments_tokens + full_fragments_tokens
+        self.requests += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        logger.info(f"Промпт generate_sql: {before} -> {after} токенов ({after / before:.0%}).")
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": PROMPT_COMPACTION_ENABLED,
+            "exact_token_count": _encoding is not None,
+            "requests": self.requests,
+            "tokens_before_total": self.tokens_before,
+            "tokens_after_total": self.tokens_after,
+            "avg_ratio": round(self.tokens_after / self.tokens_before, 4) if self.tokens_before else None,
+        }
+
+
+prompt_compactor = PromptCompactor(PROMPT_SCHEMA_TOP_K, PROMPT_CATALOG_TOP_K)
@@ -0,0 +1,161 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import logger, SQL_CACHE_MAX_SIZE, SQL_CACHE_TTL, SQL_CACHE_SQLITE_PATH
+from metadata_registry import TableMetadata
+from utils import normalize_text, build_catalog_aliases
+
+
+class AliasResolver:
+    """Заменяет алиасы из каталога (ru/en/kz, короткие формы) на официальные названия."""
+
+    def __init__(self, catalog: Dict):
+        self.aliases = build_catalog_aliases(catalog)
+        # Длинные алиасы проверяем первыми, чтобы "дойче банк" не разбивался на части
+        alternatives = sorted(self.aliases, key=len, reverse=True)
+        # Допускаем падежные окончания: "у Даймлера", "для Сименса"
+        self._pattern = (
+            re.compile(
+                r"(?<!\w)(" + "|".join(re.escape(a) for a in alternatives) + r")"
+                r"(?:а|у|е|ом|ой|ы|и|ов|ам|ах)?(?!\w)"
+            )
+            if alternatives else None
+        )
+
+    def resolve(self, normalized_query: str) -> str:
+        if self._pattern is None:
+            return normalized_query
+        return self._pattern.sub(
+            lambda m: normalize_text(self.aliases[m.group(1)][1]), normalized_query
+        )
+
+    def find(self, normalized_query: str) -> List[Tuple[str, str, str]]:
+        """Возвращает найденные в запросе значения каталога: (колонка, значение, фрагмент запроса)."""
+        if self._pattern is None:
+            return []
+        found = []
+        for match in self._pattern.finditer(normalized_query):
+            column, canonical = self.aliases[match.group(1)]
+            found.append((column, canonical, match.group(0)))
+        return found
+
+
+_resolvers: Dict[str, AliasResolver] = {}
+
+
+def get_alias_resolver(metadata: TableMetadata) -> AliasResolver:
+    """Возвращает резолвер алиасов для версии метаданных (строится один раз на версию)."""
+    key = f"{metadata.table_name}:{metadata.version}"
+    resolver = _resolvers.get(key)
+    if resolver is None:
+        resolver = AliasResolver(metadata.catalog)
+        # Старые версии этой таблицы больше не понадобятся
+        for stale in [k for k in _resolvers if k.startswith(f"{metadata.table_name}:")]:
+            _resolvers.pop(stale, None)
+        _resolvers[key] = resolver
+    return resolver
+
+
+def normalize_query(user_query: str, metadata: TableMetadata) -> str:
+    """
+    Нормализует вопрос пользователя: регистр, пробелы и пунктуация схлопываются,
+    алиасы из каталога заменяются на официальные названия.
+    """
+    return get_alias_resolver(metadata).resolve(normalize_text(user_query))
+
+
+class QueryCache:
+    """
+    LRU/TTL кеш результатов generate_sql в памяти с необязательным вторым уровнем в SQLite.
+    SQLite-файл может быть общим для нескольких воркеров uvicorn.
+    """
+
+    def __init__(self, max_size: int, ttl: float, sqlite_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(user_query: str, metadata: TableMetadata, related_tables: Sequence[TableMetadata] = ()) -> str:
+        """Ключ: нормализованный запрос + версии схем/каталогов основной и связанных таблиц."""
+        normalized = normalize_query(user_query, metadata)
+        raw = f"{metadata.table_name}|{metadata.version}|{normalized}"
+        for related in related_tables:
+            raw += f"|{related.table_name}|{related.version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(value)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM sql_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Dict) -> None:
+        serialized = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, serialized, expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sql_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, serialized, expires_at),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Не удалось записать в SQLite-кеш: {e}")
+
+    def _store(self, key: str, serialized: str, expires_at: float) -> None:
+        self._entries[key] = (expires_at, serialized)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+sql_cache = QueryCache(SQL_CACHE_MAX_SIZE, SQL_CACHE_TTL, SQL_CACHE_SQLITE_PATH or None)
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Connection, Engine, make_url
+
+from metrics import DB_POOL_WAIT
+from config import (
+    logger, DATABASE_URL, OPENAI_API_KEY,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    LLM_HTTP_TIMEOUT, LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE,
+)
+
+# Ресурсы принадлежат процессу: пул соединений, унаследованный через fork от родителя,
+# не используется, а при первом обращении в воркере создается заново.
+_engine: Optional[Engine] = None
+_engine_pid: Optional[int] = None
+_engine_lock = threading.Lock()
+_http_client: Optional[httpx.AsyncClient] = None
+_openai_client = None
+
+
+def _create_engine() -> Engine:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # Для SQLite (бенчмарки, локальный запуск) остается пул по умолчанию
+    if make_url(DATABASE_URL).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            # LIFO оставляет лишние соединения простаивать, и pool_recycle их закрывает
+            pool_use_lifo=True,
+        )
+    return create_engine(DATABASE_URL, **options)
+
+
+def get_db_engine() -> Engine:
+    """Движок SQLAlchemy текущего процесса; создается при старте воркера или при первом обращении."""
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
+    with _engine_lock:
+        if _engine is not None and _engine_pid != pid:
+            # Соединения родителя закрывать нельзя — ими пользуется он сам
+            _engine.dispose(close=False)
+            _engine = None
+        if _engine is None:
+            _engine = _create_engine()
+            _engine_pid = pid
+            logger.info(f"Создан пул соединений к БД (pid {pid}).")
+        return _engine
+
+
+@contextmanager
+def db_connection() -> Iterator[Connection]:
+    """Соединение из пула с замером времени ожидания выдачи (метрика chatbot_db_pool_wait_seconds)."""
+    started = time.perf_counter()
+    conn = get_db_engine().connect()
+    DB_POOL_WAIT.observe(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def dispose_db_engine() -> None:
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            logger.info("Пул соединений к БД закрыт.")
+        _engine = None
+        _engine_pid = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий HTTP клиент для вызовов кастомного LLM (keep-alive соединения переиспользуются)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=LLM_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+def get_openai_client():
+    """
+    Асинхронный клиент OpenAI. SDK импортируется только здесь: импорт тянет сотни модулей
+    типов и заметно замедляет старт, а при LLM_PROVIDER=custom он может не понадобиться вовсе.
+    """
+    global _openai_client
+    if _openai_client is None:
+        import openai
+
+        # Повторы выполняет llm_client с общей политикой, встроенные повторы SDK отключаем
+        _openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _openai_client
+
+
+async def close_openai_client() -> None:
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+    _openai_client = None
+
+
+def open_resources() -> None:
+    """Создает ресурсы воркера при старте, чтобы первый запрос не платил за их инициализацию."""
+    get_db_engine()
+    get_http_client()
+
+
+async def close_resources() -> None:
+    """Корректное освобождение при остановке воркера: соединения с БД и HTTP клиенты."""
+    await close_http_client()
+    await close_openai_client()
+    dispose_db_engine()
+
+
+def db_pool_stats() -> Dict:
+    if _engine is None:
+        return {"initialized": False}
+    pool = _engine.pool
+    stats = {"initialized": True, "pool": type(pool).__name__, "status": pool.status()}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(0, pool.overflow()),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+    return stats
@@ -0,0 +1,219 @@
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import pandas as pd
+import sqlparse
+from sqlparse import tokens
+from sqlalchemy import inspect, text
+
+from config import (
+    logger,
+    RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_SQLITE_PATH, DATA_VERSION_CHECK_INTERVAL,
+)
+from resources import db_connection
+from utils import DATA_VERSIONS_TABLE
+
+try:
+    import pyarrow as pa
+except ImportError:  # без pyarrow результаты сериализуются через pickle
+    pa = None
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Нормализованный текст SQL для ключа: токены sqlparse без комментариев и пробельных
+    промежутков, ключевые слова (включая LIKE/ILIKE) в верхнем регистре.
+    """
+    parts = []
+    for statement in sqlparse.parse(sql_query):
+        for token in statement.flatten():
+            if token.is_whitespace or token.ttype in tokens.Comment:
+                continue
+            value = token.value
+            if token.is_keyword or (token.ttype in tokens.Operator.Comparison and value.isalpha()):
+                value = value.upper()
+            parts.append(value)
+    return " ".join(parts).rstrip(" ;")
+
+
+def serialize_frame(df: pd.DataFrame) -> bytes:
+    """Компактное представление результата: Arrow IPC, если установлен pyarrow, иначе pickle."""
+    buffer = io.BytesIO()
+    if pa is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+        return b"A" + buffer.getvalue()
+    df.to_pickle(buffer, compression=None)
+    return b"P" + buffer.getvalue()
+
+
+def deserialize_frame(payload: bytes) -> pd.DataFrame:
+    if payload[:1] == b"A":
+        if pa is None:
+            raise ValueError("Для чтения результата из кеша нужен pyarrow.")
+        return pa.ipc.open_stream(payload[1:]).read_all().to_pandas()
+    return pd.read_pickle(io.BytesIO(payload[1:]), compression=None)
+
+
+class DataVersion:
+    """
+    Штамп версии данных из таблицы data_versions. Читается из БД не чаще раза
+    в check_interval секунд; пока таблицы нет (данные грузились не через
+    db_uploader.py), штамп постоянный и результаты устаревают только по TTL.
+    Если штамп прочитать не удалось, версия неизвестна и кеш результатов не используется.
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self.value: Optional[str] = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return self.value is None or time.monotonic() - self.checked_at >= self.check_interval
+
+    def refresh(self) -> Optional[str]:
+        """
+        Перечитывает штамп из БД (синхронно, вызывать вне event loop). При ошибке возвращает
+        None: данные могли измениться, пока БД была недоступна, поэтому ни прежний штамп,
+        ни постоянный не подходят. Следующий запрос попробует прочитать штамп снова.
+        """
+        try:
+            with db_connection() as conn:
+                if not inspect(conn).has_table(DATA_VERSIONS_TABLE):
+                    raw = "unversioned"
+                else:
+                    rows = conn.execute(text(
+                        f"SELECT table_name, version FROM {DATA_VERSIONS_TABLE} ORDER BY table_name"
+                    )).fetchall()
+                    raw = "|".join(f"{name}:{version}" for name, version in rows)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать версию данных, кеш результатов пропускается: {e}")
+            return None
+        value = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            if value != self.value and self.value is not None:
+                logger.info(f"Версия данных изменилась: {self.value} -> {value}, кеш результатов сброшен.")
+            self.value = value
+            self.checked_at = time.monotonic()
+        return value
+
+
+class ResultCache:
+    """
+    Кеш результатов выполненного SQL. Ключ — нормализованный SQL и штамп версии
+    данных, поэтому после загрузки данных старые записи просто перестают находиться.
+    В памяти — LRU с ограничением по суммарному размеру сериализованных DataFrame;
+    опционально — общий для воркеров уровень в SQLite.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, sqlite_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        # Слишком большие результаты не кешируются, чтобы не вытеснять все остальное
+        self.max_entry_bytes = max_bytes // 4
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        if sqlite_path and max_bytes > 0:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(sql_query: str, data_version: str) -> str:
+        raw = f"{data_version}|{normalize_sql(sql_query)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return deserialize_frame(payload)
+                self._remove(key)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM result_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._store(key, bytes(row[0]), row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return deserialize_frame(bytes(row[0]))
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, df: pd.DataFrame) -> None:
+        try:
+            payload = serialize_frame(df)
+        except Exception as e:
+            logger.warning(f"Не удалось сериализовать результат для кеша: {e}")
+            return
+        if len(payload) > self.max_entry_bytes:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, payload, expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, payload, expires_at),
+                    )
+                    self._db.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+                except sqlite3.Error as e:
+                    logger.warning(f"Не удалось записать в SQLite-кеш результатов: {e}")
+
+    def _remove(self, key: str) -> None:
+        _, payload = self._entries.pop(key)
+        self._size -= len(payload)
+
+    def _store(self, key: str, payload: bytes, expires_at: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, payload)
+        self._size += len(payload)
+        while self._size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "format": "arrow" if pa is not None else "pickle",
+            "size": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "data_version": data_version.value,
+        }
+
+
+data_version = DataVersion(DATA_VERSION_CHECK_INTERVAL)
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_SQLITE_PATH or None)
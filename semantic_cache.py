@@ -0,0 +1,154 @@
+import re
+import zlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from config import logger, SEMANTIC_CACHE_MAX_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_DIM
+from metadata_registry import TableMetadata
+from query_cache import get_alias_resolver
+from fast_router import fast_router
+from utils import normalize_text, QUERY_STOPWORDS
+
+_NUMBER_RE = re.compile(r"\d+")
+# Слова, которые меняют агрегацию, группировку или сам показатель: "средняя выручка" и "выручка"
+# близки по n-граммам, но требуют разного SQL. Метка каждой найденной группы входит в сигнатуру.
+_MODIFIER_PATTERNS = {
+    "avg": r"средн|avg(?!\w)|average|mean(?!\w)",
+    "max": r"максим|наибольш|max(?!\w)|highest|largest",
+    "min": r"минимал|наименьш|min(?!\w)|minimum|lowest|smallest",
+    "sum": r"сумм|итог|совокупн|total|sum(?!\w)",
+    "count": r"количеств|count",
+    "net": r"net(?!\w)|чист",
+    "month": r"месяц|помесячн|monthly|month",
+    "quarter": r"квартал|ежекварт|quarter",
+    "year": r"ежегодн|годов|годам(?!\w)|annual|yearly",
+    "each": r"кажд|each(?!\w)|every|per(?!\w)",
+    "trend": r"динамик|рост|изменен|growth|change|trend",
+    "compare": r"сравн|разниц|compar|vs(?!\w)",
+    # Границы периода и сравнения с порогом: "до 2020" и "после 2020" дают одни и те же числа
+    "before": r"до(?!\w)|раньше|ранее|before|until|till|prior|<",
+    "after": r"после|позже|начиная|after|since|later|>",
+    "range": r"между|between|с \d+ по(?!\w)|from \d+ to(?!\w)|\d{4}\s*[-–]\s*\d{4}",
+    "above": r"больше|более|свыше|выше|превыш|above|over(?!\w)|greater|more(?!\w)|exceed",
+    "below": r"меньше|менее|ниже|below|under(?!\w)|less(?!\w)|fewer",
+    # Порядок и отбор лучших/худших
+    "desc": r"убыв|desc|top(?!\w)|топ|лучш|лидер|best",
+    "asc": r"возраст|asc(?!\w)|ascending|худш|bottom|worst",
+    "order": r"сортир|упорядоч|sort|order|rank|рейтинг",
+    # Единицы измерения ответа
+    "usd": r"доллар|usd|dollar|\$",
+    "eur": r"евро|eur(?!\w)|€",
+    "percent": r"процент|percent|%",
+    "billion": r"млрд|миллиард|billion|bn(?!\w)",
+    "million": r"млн|миллион|million|mn(?!\w)",
+}
+_MODIFIERS = [(label, re.compile(rf"(?<!\w)(?:{pattern})")) for label, pattern in _MODIFIER_PATTERNS.items()]
+
+
+class HashedNgramVectorizer:
+    """
+    Векторизатор на хешированных символьных n-граммах: работает локально на CPU,
+    не требует обучения и внешних моделей.
+    """
+
+    def __init__(self, dim: int, ngram_range: Tuple[int, int] = (2, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            padded = f" {word} "
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for i in range(len(padded) - n + 1):
+                    # crc32 стабилен между процессами, в отличие от встроенного hash()
+                    vector[zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class SemanticCache:
+    """
+    Кеш результатов generate_sql по смысловой близости запросов.
+
+    Хранит векторы прошлых запросов в NumPy-матрице (кольцевой буфер) и возвращает
+    сохраненный результат, если косинусное сходство выше порога. Дополнительно требует
+    точного совпадения "сигнатуры" запроса — чисел (годы, кварталы), официальных
+    названий из каталога, найденных показателей и слов агрегации, группировки, сравнения,
+    порядка и единиц, — чтобы "BMW 2022" не отвечал на вопрос про "BMW 2023", "выручка" —
+    на "средняя выручка", а "после 2020" — на "до 2020".
+    """
+
+    def __init__(self, max_size: int, threshold: float, dim: int):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.vectorizer = HashedNgramVectorizer(dim)
+        self._matrix = np.zeros((max_size, dim), dtype=np.float32)
+        self._entries: List[Optional[Tuple[str, tuple, Dict]]] = [None] * max_size
+        self._next = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _prepare(self, user_query: str, metadata: TableMetadata) -> Tuple[np.ndarray, tuple]:
+        resolver = get_alias_resolver(metadata)
+        normalized = resolver.resolve(normalize_text(user_query))
+        canonical_names = {normalize_text(value) for _, value in resolver.aliases.values()}
+        entities = sorted(
+            set(_NUMBER_RE.findall(normalized))
+            | {name for name in canonical_names if re.search(rf"(?<!\w){re.escape(name)}(?!\w)", normalized)}
+        )
+        tokens = normalized.split()
+        metrics = sorted(fast_router.get_rules(metadata).find_metrics(tokens, [False] * len(tokens)))
+        # normalize_text убирает символы ("$", "<", "2018-2020"), поэтому смотрим и исходный текст
+        modifier_text = f"{normalized} {user_query.casefold()}"
+        modifiers = [label for label, pattern in _MODIFIERS if pattern.search(modifier_text)]
+        content = " ".join(w for w in tokens if w not in QUERY_STOPWORDS)
+        return self.vectorizer.transform(content), (tuple(entities), tuple(metrics), tuple(modifiers))
+
+    def lookup(self, user_query: str, metadata: TableMetadata) -> Optional[Dict]:
+        """Ищет ранее сгенерированный результат для близкого по смыслу запроса."""
+        if self.max_size <= 0:
+            return None
+        vector, signature = self._prepare(user_query, metadata)
+        scope = f"{metadata.table_name}:{metadata.version}"
+        with self._lock:
+            similarities = self._matrix @ vector
+            for idx in np.argsort(similarities)[::-1]:
+                score = float(similarities[idx])
+                if score < self.threshold:
+                    break
+                entry = self._entries[idx]
+                if entry is not None and entry[0] == scope and entry[1] == signature:
+                    self.hits += 1
+                    logger.info(f"Семантический кеш: найдено совпадение (сходство {score:.3f}).")
+                    return dict(entry[2])
+            self.misses += 1
+            return None
+
+    def add(self, user_query: str, metadata: TableMetadata, generation_result: Dict) -> None:
+        if self.max_size <= 0:
+            return
+        vector, signature = self._prepare(user_query, metadata)
+        scope = f"{metadata.table_name}:{metadata.version}"
+        with self._lock:
+            self._matrix[self._next] = vector
+            self._entries[self._next] = (scope, signature, dict(generation_result))
+            self._next = (self._next + 1) % self.max_size
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": sum(1 for e in self._entries if e is not None),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_MAX_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_DIM)
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+from metrics import COALESCED_REQUESTS, request_timings, add_timings
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых запросов, выполняющихся одновременно: первый запрос с ключом
+    запускает работу в отдельной задаче, остальные ждут ее результат (или исключение)
+    вместо повторного вызова LLM или БД. Результат общий — его нельзя изменять на месте.
+    Задача защищена от отмены: если первый клиент отключился, остальные все равно получат ответ.
+    Этапы, замеренные внутри общей задачи, попадают в X-Timing каждого дождавшегося запроса.
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._inflight: Dict[str, Tuple[asyncio.Task, Dict[str, float]]] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await func()
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            timings: Dict[str, float] = {}
+            task = asyncio.create_task(self._lead(func, timings))
+            self._inflight[key] = (task, timings)
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.leaders += 1
+        else:
+            task, timings = entry
+            self.coalesced += 1
+            COALESCED_REQUESTS.labels(stage=self.name).inc()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                add_timings(timings)
+
+    @staticmethod
+    async def _lead(func: Callable[[], Awaitable[T]], timings: Dict[str, float]) -> T:
+        # Задача выполняется в копии контекста: этапы пишутся в общий словарь, а не в запрос лидера
+        request_timings.set(timings)
+        return await func()
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Помечаем исключение полученным, даже если ждать результат было уже некому
+            task.exception()
+
+    def stats(self) -> Dict:
+        total = self.leaders + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,203 @@
+import re
+import threading
+import time
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+from config import logger, SQL_REWRITE_ENABLED, SQL_REWRITE_REFRESH_INTERVAL
+from utils import YEAR_COLUMN, YEARLY_PERIODS_COLUMN, date_column_name, yearly_table_name
+
+# "Period" LIKE '%2023' (в том числе с префиксом таблицы: t."Period")
+_LIKE_YEAR_RE = re.compile(r"""(?P<prefix>\b\w+\.)?"(?P<column>[^"]+)"\s+LIKE\s+'%(?P<year>\d{4})'""", re.IGNORECASE)
+_TABLE_RE = re.compile(r"""\b(?:FROM|JOIN)\s+"?(?P<table>\w+)"?""", re.IGNORECASE)
+# Строковые литералы и идентификаторы в кавычках: в них не ищем ни FROM, ни скобки ("ROE (%)")
+_QUOTED_RE = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*\"""")
+_SUBQUERY_RE = re.compile(r"\(\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+# Для годового агрегата: SUM по одной колонке ("Revenue" или t."Revenue"), идентификаторы в кавычках
+# (с признаком псевдонима AS) и вызовы функций, результат которых не меняется при суммировании по годам
+_SUM_RE = re.compile(r"""\bSUM\s*\(\s*(?:\w+\.)?"(?P<column>(?:[^"]|"")*)"\s*\)""", re.IGNORECASE)
+_IDENTIFIER_RE = re.compile(r"""(?P<alias>\bAS\s+)?"(?P<name>(?:[^"]|"")*)\"""", re.IGNORECASE)
+_CALL_RE = re.compile(r"(\w+)\s*\(")
+_YEARLY_SAFE_CALLS = {
+    "ROUND", "COALESCE", "NULLIF", "ABS", "CAST", "IN", "AND", "OR", "NOT", "SELECT", "WHERE", "BY", "HAVING",
+}
+_YEARLY_UNSAFE_RE = re.compile(
+    r"\b(?:JOIN|UNION|INTERSECT|EXCEPT|WITH|OVER|DISTINCT|FILTER)\b|SELECT\s+\*|\.\s*\*|,\s*\*", re.IGNORECASE
+)
+_FROM_CLAUSE_RE = re.compile(
+    r"""\bFROM\s+"?(?P<table>\w+)"?(?:\s+(?:AS\s+)?(?!WHERE|GROUP|ORDER|HAVING|LIMIT)\w+)?"""
+    r"""\s*(?:\bWHERE\b|\bGROUP\b|\bORDER\b|\bHAVING\b|\bLIMIT\b|;|$)""",
+    re.IGNORECASE,
+)
+
+
+def _mask_quoted(match: re.Match) -> str:
+    quoted = match.group(0)
+    if quoted.startswith("'"):
+        return "'" + " " * (len(quoted) - 2) + "'"
+    return quoted.replace("(", " ").replace(")", " ")
+
+
+def referenced_tables(sql_query: str) -> Set[str]:
+    """
+    Таблицы из FROM/JOIN запроса, включая подзапросы. FROM внутри вызовов функций
+    (`EXTRACT(YEAR FROM "Period")`, `SUBSTRING(x FROM 1)`) пропускается: это не таблица.
+    """
+    masked = _QUOTED_RE.sub(_mask_quoted, sql_query)
+    tables = set()
+    # Для каждой открытой скобки: True, если она открывает подзапрос
+    stack = []
+    position = 0
+    for match in _TABLE_RE.finditer(masked):
+        for index in range(position, match.start()):
+            if masked[index] == "(":
+                stack.append(bool(_SUBQUERY_RE.match(masked, index)))
+            elif masked[index] == ")" and stack:
+                stack.pop()
+        position = match.start()
+        if all(stack):
+            tables.add(match.group("table"))
+    return tables
+
+
+class YearFilterRewriter:
+    """
+    Переписывает фильтры `"Period" LIKE '%YYYY'` из сгенерированного SQL в индексируемое
+    условие `"year" = YYYY`. Работает только для таблиц, где db_uploader.py добавил
+    производную колонку year и типизированную дату периода; состав колонок таблиц
+    перечитывается из БД не чаще раза в refresh_interval секунд.
+
+    Запросы, которые читают только суммы денежных показателей по компании и году
+    (`SUM("Revenue") ... WHERE "Company" = ... AND "year" = ... GROUP BY "Company"`),
+    переводятся на сводную таблицу `<table>_yearly`: результат тот же, а строк втрое меньше.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._columns: Dict[str, Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+        self.rewritten = 0
+        self.yearly = 0
+
+    def _table_columns(self, conn: Connection, table_name: str) -> List[str]:
+        """Колонки таблицы в порядке создания; пустой список, если таблицы нет."""
+        now = time.monotonic()
+        cached = self._columns.get(table_name)
+        if cached is not None and now - cached[0] < self.refresh_interval:
+            return cached[1]
+        try:
+            inspector = inspect(conn)
+            columns = [c["name"] for c in inspector.get_columns(table_name)] if inspector.has_table(table_name) else []
+        except Exception as e:
+            logger.warning(f"Не удалось получить колонки таблицы {table_name}: {e}")
+            columns = []
+        with self._lock:
+            self._columns[table_name] = (now, columns)
+        return columns
+
+    def _period_columns(self, conn: Connection, table_name: str) -> Set[str]:
+        columns = set(self._table_columns(conn, table_name))
+        if YEAR_COLUMN not in columns:
+            return set()
+        return {c for c in columns if date_column_name(c) in columns}
+
+    def _rewrite_year_filters(self, sql_query: str, conn: Connection, tables: Set[str]) -> str:
+        if "LIKE" not in sql_query.upper():
+            return sql_query
+        period_columns = set()
+        for table_name in tables:
+            period_columns |= self._period_columns(conn, table_name)
+        if not period_columns:
+            return sql_query
+
+        def replace(match: re.Match) -> str:
+            if match.group("column") not in period_columns:
+                return match.group(0)
+            return f'{match.group("prefix") or ""}"{YEAR_COLUMN}" = {int(match.group("year"))}'
+
+        return _LIKE_YEAR_RE.sub(replace, sql_query)
+
+    def _route_to_yearly(self, sql_query: str, conn: Connection, tables: Set[str]) -> str:
+        """
+        Переводит запрос на `<table>_yearly`, если он гарантированно дает тот же результат:
+        одна таблица без подзапросов и JOIN, хотя бы один SUM, агрегаты — только SUM по
+        денежной колонке из сводной таблицы, остальные колонки — группировки (компания, год).
+        Иначе возвращает запрос без изменений.
+        """
+        if len(tables) != 1 or "SUM" not in sql_query.upper():
+            return sql_query
+        table_name = next(iter(tables))
+        masked = _QUOTED_RE.sub(_mask_quoted, sql_query)
+        from_clause = _FROM_CLAUSE_RE.search(masked)
+        if (
+            from_clause is None or from_clause.group("table") != table_name
+            or _YEARLY_UNSAFE_RE.search(masked) or _SUBQUERY_RE.search(masked)
+        ):
+            return sql_query
+
+        summary_columns = self._table_columns(conn, yearly_table_name(table_name))
+        if YEARLY_PERIODS_COLUMN not in summary_columns:
+            return sql_query
+        split = summary_columns.index(YEARLY_PERIODS_COLUMN)
+        groups, sums = set(summary_columns[:split]), set(summary_columns[split + 1:])
+
+        # SUM по колонкам сводной таблицы вырезаем; все остальное не должно ссылаться на показатели
+        found_sum = False
+
+        def drop_sum(match: re.Match) -> str:
+            nonlocal found_sum
+            if match.group("column").replace('""', '"') not in sums:
+                return match.group(0)
+            found_sum = True
+            return " 0 "
+
+        rest = _SUM_RE.sub(drop_sum, sql_query)
+        if not found_sum:
+            return sql_query
+        allowed = groups | {table_name}
+        for match in _IDENTIFIER_RE.finditer(rest):
+            name = match.group("name").replace('""', '"')
+            if match.group("alias"):
+                # Псевдоним с именем показателя в WHERE ссылался бы на исходную колонку, а не на сумму
+                if name in sums:
+                    return sql_query
+                allowed.add(name)
+            elif name not in allowed:
+                return sql_query
+        rest_masked = _IDENTIFIER_RE.sub(" ", _QUOTED_RE.sub(_mask_quoted, rest))
+        if any(name.upper() not in _YEARLY_SAFE_CALLS for name in _CALL_RE.findall(rest_masked)):
+            return sql_query
+        base_columns = {c.lower() for c in self._table_columns(conn, table_name)} - {c.lower() for c in groups}
+        if any(word.lower() in base_columns for word in re.findall(r"\w+", rest_masked)):
+            return sql_query
+
+        start, end = from_clause.span("table")
+        quote = '"' if masked[start - 1] == '"' else ""
+        summary = yearly_table_name(table_name)
+        routed = sql_query[:start - len(quote)] + f'"{summary}"' + sql_query[end + len(quote):]
+        self.yearly += 1
+        return routed
+
+    def rewrite(self, sql_query: str, conn: Connection) -> str:
+        if not SQL_REWRITE_ENABLED:
+            return sql_query
+        tables = referenced_tables(sql_query)
+        rewritten = self._rewrite_year_filters(sql_query, conn, tables)
+        if rewritten != sql_query:
+            self.rewritten += 1
+        rewritten = self._route_to_yearly(rewritten, conn, tables)
+        if rewritten != sql_query:
+            logger.info(f"SQL переписан для индекса по году и годовых сумм: {rewritten}")
+        return rewritten
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": SQL_REWRITE_ENABLED,
+            "rewritten": self.rewritten,
+            "yearly": self.yearly,
+        }
+
+
+year_filter_rewriter = YearFilterRewriter(SQL_REWRITE_REFRESH_INTERVAL)
@@ -0,0 +1,105 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import logger
+from metadata_registry import MetadataRegistry, TableMetadata
+from query_cache import get_alias_resolver
+from fast_router import fast_router
+from prompt_compaction import LexicalIndex, text_stems
+from utils import normalize_text
+
+# Вес прямого совпадения алиаса (значение каталога или показатель) относительно лексического
+ALIAS_MATCH_WEIGHT = 5.0
+
+
+def _table_document(metadata: TableMetadata) -> List[str]:
+    """Тексты, по которым таблица находится в поиске: описание, колонки и значения каталога."""
+    texts = [metadata.table_name.replace("_", " "), metadata.schema.get("description", "")]
+    for column, info in metadata.schema.get("columns", {}).items():
+        info = info or {}
+        texts.append(column)
+        texts.append(info.get("description", ""))
+        texts.extend(v for v in (info.get("aliases") or {}).values() if isinstance(v, str))
+    for values in metadata.catalog.values():
+        if not isinstance(values, dict):
+            continue
+        for value, entry in values.items():
+            texts.append(value)
+            texts.extend(v for v in ((entry or {}).get("aliases") or {}).values() if isinstance(v, str))
+    return texts
+
+
+class TableRouter:
+    """
+    Выбор таблиц для запроса без обращения к LLM. Индексирует описания всех
+    `*_schema.json` (и каталоги) из реестра метаданных и ранжирует таблицы по
+    совпадениям алиасов и лексическому индексу. В generate_sql попадают
+    метаданные только лучших кандидатов, поэтому стоимость запроса не растет
+    с числом подключенных наборов данных.
+    """
+
+    def __init__(self, registry: MetadataRegistry, default_table: str, top_k: int, min_relative_score: float):
+        self.registry = registry
+        self.default_table = default_table
+        self.top_k = max(1, top_k)
+        self.min_relative_score = min_relative_score
+        self._index: Optional[Tuple[tuple, LexicalIndex]] = None
+        self._lock = threading.Lock()
+        self.routed: Dict[str, int] = {}
+
+    def _get_index(self, tables: List[TableMetadata]) -> LexicalIndex:
+        signature = tuple(sorted((t.table_name, t.version) for t in tables))
+        cached = self._index
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        index = LexicalIndex({t.table_name: text_stems(*_table_document(t)) for t in tables})
+        with self._lock:
+            self._index = (signature, index)
+        logger.info(f"Индекс таблиц перестроен: {len(tables)} таблиц.")
+        return index
+
+    def _default(self, tables: List[TableMetadata]) -> TableMetadata:
+        for metadata in tables:
+            if metadata.table_name == self.default_table:
+                return metadata
+        return tables[0]
+
+    def route(self, user_query: str) -> List[TableMetadata]:
+        """Возвращает таблицы-кандидаты для запроса, лучшая — первая."""
+        tables = sorted(self.registry.tables(), key=lambda t: t.table_name)
+        if not tables:
+            raise ValueError("Не найдено ни одной таблицы с метаданными.")
+        if len(tables) == 1:
+            return self._count(tables)
+
+        normalized = normalize_text(user_query)
+        tokens = normalized.split()
+        scores = self._get_index(tables).score(text_stems(normalized))
+        for metadata in tables:
+            catalog_hits = {canonical for _, canonical, _ in get_alias_resolver(metadata).find(normalized)}
+            metric_hits = fast_router.get_rules(metadata).find_metrics(tokens, [False] * len(tokens))
+            bonus = ALIAS_MATCH_WEIGHT * (len(catalog_hits) + len(metric_hits))
+            if bonus:
+                scores[metadata.table_name] = scores.get(metadata.table_name, 0.0) + bonus
+
+        if not scores:
+            return self._count([self._default(tables)])
+
+        by_name = {t.table_name: t for t in tables}
+        # При равных оценках предпочитаем таблицу по умолчанию
+        ranked = sorted(scores, key=lambda name: (scores[name], name == self.default_table), reverse=True)
+        best = scores[ranked[0]]
+        selected = [by_name[name] for name in ranked[:self.top_k] if scores[name] >= best * self.min_relative_score]
+        logger.info(f"Выбраны таблицы: {', '.join(t.table_name for t in selected)}")
+        return self._count(selected)
+
+    def _count(self, selected: List[TableMetadata]) -> List[TableMetadata]:
+        name = selected[0].table_name
+        self.routed[name] = self.routed.get(name, 0) + 1
+        return selected
+
+    def stats(self) -> Dict:
+        return {
+            "top_k": self.top_k,
+            "routed": dict(self.routed),
+        }
@@ -1,10 +1,51 @@
 import asyncio
 import argparse
+import json
 import sys
+import time
 
 # --- Импортируем основной пайплайн из нашего бота ---
-from pipeline import run_companies_pipeline
-from config import logger
+from pipeline import run_companies_pipeline, run_companies_batch
+from config import logger, BATCH_CONCURRENCY
+
+def read_batch_queries(path: str, field: str) -> list:
+    """
+    Читает вопросы из JSONL файла: по одному JSON объекту на строку, вопрос берется из поля `field`.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            query = record.get(field) if isinstance(record, dict) else None
+            if not query:
+                logger.warning(f"Строка {line_number}: нет поля '{field}', пропускаем.")
+                continue
+            queries.append(query)
+    return queries
+
+async def run_batch(path: str, field: str, concurrency: int):
+    """Пакетный режим: прогоняет все вопросы из файла и печатает ответы с временем обработки."""
+    queries = read_batch_queries(path, field)
+    if not queries:
+        logger.error(f"В файле {path} не найдено ни одного вопроса.")
+        return
+
+    logger.info(f"--- Запуск пакетного теста CLI: {len(queries)} вопросов, параллельно до {concurrency} ---")
+    started = time.perf_counter()
+    results = await run_companies_batch(queries, concurrency=concurrency)
+    total_ms = (time.perf_counter() - started) * 1000
+
+    for idx, item in enumerate(results, start=1):
+        print("\n" + "="*50)
+        note = " (повтор)" if item["deduplicated"] else ""
+        print(f"[{idx}] {item['query']} — {item['elapsed_ms']} мс{note}")
+        print("-"*50)
+        print(item["answer"])
+    print("="*50)
+    print(f"Всего вопросов: {len(results)}, общее время: {total_ms:.0f} мс")
 
 async def main():
     """
@@ -17,8 +58,25 @@ async def main():
     parser.add_argument(
         "query",
         type=str,
+        nargs="?",
         help="Текстовый запрос к боту в кавычках."
     )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="JSONL файл с вопросами для пакетного режима (по одному JSON объекту на строку)."
+    )
+    parser.add_argument(
+        "--field",
+        default="query",
+        help="Поле JSON объекта, в котором лежит вопрос (по умолчанию: query)."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help="Сколько вопросов обрабатывать одновременно в пакетном режиме."
+    )
     
     # Если аргументы не переданы, выводим справку и выходим
     if len(sys.argv) == 1:
@@ -26,7 +84,11 @@ async def main():
         sys.exit(1)
         
     args = parser.parse_args()
-    
+
+    if args.batch:
+        await run_batch(args.batch, args.field, args.concurrency)
+        return
+
     user_query = args.query
     
     if not user_query:
@@ -1,31 +1,182 @@
 # utils.py
+import re
+import numpy as np
 import pandas as pd
+from typing import Dict, Tuple
+
+# Все, кроме букв, цифр и знака процента, считается разделителем
+_NON_WORD_RE = re.compile(r"[^\w%]+")
+# Организационно-правовые формы, которые пользователи обычно опускают ("BMW" вместо "BMW AG")
+_LEGAL_FORM_SUFFIXES = {"ag", "se", "kgaa", "gmbh", "аг", "се", "кгаа"}
+# Служебные слова, которые не меняют смысл вопроса к данным
+QUERY_STOPWORDS = {
+    "какая", "какой", "какие", "каков", "какова", "каковы", "сколько", "было", "был", "была", "были",
+    "у", "в", "во", "за", "по", "на", "для", "о", "об", "и", "а", "с", "со", "год", "году", "года", "г", "гг",
+    "покажи", "показать", "скажи", "подскажи", "выведи", "посчитай", "посчитать", "найди", "пожалуйста",
+    "мне", "нам", "компании", "компания", "время",
+    "what", "is", "was", "the", "of", "for", "in", "show", "me", "year",
+}
+
+# Пороговые значения и подписи величин: (порог, делитель, подпись)
+_MAGNITUDES = (
+    (1_000_000_000, 1_000_000_000, " млрд евро"),
+    (1_000_000, 1_000_000, " млн евро"),
+)
+_SMALL_SUFFIX = " €"
+_format_money = "{:,.2f}".format
+# Готовые строки для групп разрядов и копеек: индексируются массивами NumPy вместо форматирования каждого числа
+_GROUP_HEAD = np.array([str(i) for i in range(1000)], dtype=object)
+_GROUP_TAIL = np.array([f" {i:03d}" for i in range(1000)], dtype=object)
+_CENTS = np.array([""] + [f".{i:02d}" for i in range(1, 100)], dtype=object)
+# Выше этого значения (в копейках) float теряет точность целых, такие числа форматируются по одному
+_MAX_EXACT_CENTS = 2 ** 52
+
+
+def _format_money_bulk(scaled: np.ndarray) -> np.ndarray:
+    """
+    То же, что f"{x:,.2f}".replace(",", " ").replace(".00", "") для массива, но без
+    форматирования каждого числа. Значения, у которых округление до копеек неоднозначно
+    (дробная часть около половины копейки), и нечисловые (inf) форматируются через Python,
+    поэтому результат совпадает посимвольно.
+    """
+    cents_float = scaled * 100
+    rounded = np.rint(cents_float)
+    with np.errstate(invalid="ignore"):
+        exact = (
+            np.isfinite(cents_float)
+            & (np.abs(cents_float) < _MAX_EXACT_CENTS)
+            & (np.abs(np.abs(cents_float - np.trunc(cents_float)) - 0.5) > 1e-6)
+        )
+
+    result = np.empty(len(scaled), dtype=object)
+    cents = np.abs(rounded[exact]).astype(np.int64)
+    integer, fraction = np.divmod(cents, 100)
+
+    text = np.empty(len(cents), dtype=object)
+    groups = np.ones(len(cents), dtype=np.int64)
+    for power in range(1, 6):
+        groups[integer >= 1000 ** power] = power + 1
+    for count in np.unique(groups):
+        mask = groups == count
+        part = integer[mask]
+        value = _GROUP_HEAD[(part // 1000 ** (count - 1)) % 1000]
+        for power in range(count - 2, -1, -1):
+            value = value + _GROUP_TAIL[(part // 1000 ** power) % 1000]
+        text[mask] = value
+    text = text + _CENTS[fraction]
+    # Знак берется у исходного числа: f"{-0.001:.2f}" == "-0.00"
+    negative = np.signbit(scaled[exact])
+    text[negative] = "-" + text[negative]
+    result[exact] = text
+
+    inexact = ~exact
+    if inexact.any():
+        result[inexact] = [
+            _format_money(value).replace(",", " ").replace(".00", "") for value in scaled[inexact].tolist()
+        ]
+    return result
+
+
+def format_number_series(series: pd.Series) -> pd.Series:
+    """
+    Векторно форматирует числовую колонку: величины разбиваются масками NumPy на
+    млрд/млн/€, каждая группа форматируется целиком. Пропуски (в том числе pd.NA
+    у Int64/Float64) становятся NaN, как и в поэлементном форматировании.
+    """
+    values = series.to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(values)
+    magnitude = np.abs(values)
+
+    scaled = values.copy()
+    suffixes = np.full(len(values), _SMALL_SUFFIX, dtype=object)
+    remaining = ~missing
+    for threshold, divisor, suffix in _MAGNITUDES:
+        mask = remaining & (magnitude >= threshold)
+        scaled[mask] = values[mask] / divisor
+        suffixes[mask] = suffix
+        remaining &= ~mask
+
+    result = np.empty(len(values), dtype=object)
+    present = ~missing
+    if present.any():
+        result[present] = _format_money_bulk(scaled[present]) + suffixes[present]
+    if missing.any():
+        result[missing] = np.nan
+    return pd.Series(result, index=series.index, name=series.name).astype(str)
+
 
 def format_numbers_in_df(df: pd.DataFrame) -> pd.DataFrame:
     """
     Принимает DataFrame и форматирует числовые колонки для человекочитаемого вида.
     """
-    df_copy = df.copy()
-    
-    for col in df_copy.columns:
-        if not pd.api.types.is_numeric_dtype(df_copy[col]):
+    # Неглубокой копии достаточно: числовые колонки заменяются целиком, исходный df не меняется
+    df_copy = df.copy(deep=False)
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            df_copy[col] = format_number_series(df[col])
+    return df_copy
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит текст к каноническому виду для сравнения: нижний регистр (casefold),
+    ё -> е, пунктуация и повторные пробелы схлопываются в один пробел.
+    """
+    text = text.casefold().replace("ё", "е")
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def stem_word(word: str) -> str:
+    """Грубый стемминг: отрезаем окончание, чтобы "выручку" совпадало с "выручка"."""
+    return word[:-2] if len(word) > 5 else word
+
+
+def build_catalog_aliases(catalog: Dict) -> Dict[str, Tuple[str, str]]:
+    """
+    Строит словарь {нормализованный алиас: (колонка, официальное значение)} по каталогу.
+    Помимо ru/en/kz алиасов добавляет короткие формы без организационно-правовой формы
+    ("бмв", "sap"), если они однозначны.
+    """
+    aliases: Dict[str, Tuple[str, str]] = {}
+    short_forms: Dict[str, set] = {}
+
+    for column, values in catalog.items():
+        if not isinstance(values, dict):
             continue
+        for canonical, entry in values.items():
+            names = [canonical]
+            if isinstance(entry, dict):
+                names.extend(v for v in (entry.get("aliases") or {}).values() if isinstance(v, str))
+            for name in names:
+                normalized = normalize_text(name)
+                if not normalized:
+                    continue
+                aliases.setdefault(normalized, (column, canonical))
+                words = normalized.split()
+                if len(words) > 1 and words[-1] in _LEGAL_FORM_SUFFIXES:
+                    short_forms.setdefault(" ".join(words[:-1]), set()).add((column, canonical))
+
+    for short, targets in short_forms.items():
+        if len(targets) == 1 and short not in aliases:
+            aliases[short] = next(iter(targets))
+    return aliases
+
+
+# Производные колонки периода, которые добавляет db_uploader.py
+YEAR_COLUMN = "year"
+QUARTER_COLUMN = "quarter"
+# Годовые суммы по компаниям, которые строит db_uploader.py: в `<table>_yearly` сначала идут
+# колонки группировки (включая year), затем счетчик периодов и суммы денежных показателей
+YEARLY_PERIODS_COLUMN = "periods"
+# Таблица со штампами версий данных: ее обновляет db_uploader.py в транзакции загрузки,
+# по ней API сбрасывает кеш результатов SQL
+DATA_VERSIONS_TABLE = "data_versions"
+
+
+def yearly_table_name(table_name: str) -> str:
+    return f"{table_name}_yearly"
+
 
-        def format_value(x):
-            if pd.isna(x):
-                return x
-            try:
-                num = float(x)
-                if abs(num) >= 1_000_000_000:
-                    val = f'{num / 1_000_000_000:,.2f}'.replace(',', ' ').replace('.00', '')
-                    return f'{val} млрд евро'
-                if abs(num) >= 1_000_000:
-                    val = f'{num / 1_000_000:,.2f}'.replace(',', ' ').replace('.00', '')
-                    return f'{val} млн евро'
-                return f'{num:,.2f}'.replace(',', ' ').replace('.00', '') + ' €'
-            except (ValueError, TypeError):
-                return x
-
-        df_copy[col] = df_copy[col].apply(format_value).astype(str)
-            
-    return df_copy
\ No newline at end of file
+def date_column_name(column: str) -> str:
+    """Имя типизированной колонки-даты рядом с исходной текстовой: "Period" -> "period_date"."""
+    return re.sub(r"\W+", "_", column.strip().lower()) + "_date"